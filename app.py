@@ -1,21 +1,45 @@
+import asyncio
+import click
 import logging
-from flask import Flask, request, render_template, session, redirect, url_for
+from flask import Flask, request, render_template, session, redirect, url_for, jsonify, Response, stream_with_context, current_app, g, has_app_context
+from flask import before_render_template, template_rendered
 from flask_bcrypt import Bcrypt
 from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError, PyMongoError
 import os
 from dotenv import load_dotenv
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
 from functools import wraps
+import csv
+import gzip
+import base64
+import hashlib
+import io
+import json
+import math
+import random
+import secrets
+import tempfile
+import orjson
+import threading
+import time
 import urllib.parse
-import pymysql
-import psycopg2
-import pyodbc
-import sqlite3
-from sqlalchemy import create_engine, text
+import uuid
+from xml.etree import ElementTree
+import zstandard
+from concurrent.futures import ThreadPoolExecutor
+from tenacity import AsyncRetrying, Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+import importlib
+import sys
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
 import re
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
 from bson.objectid import ObjectId
-from langchain_groq import ChatGroq
-from langchain.schema import HumanMessage
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
@@ -26,55 +50,981 @@ load_dotenv()
 
 # Initialize Flask app
 app = Flask(__name__)
-app.secret_key = os.getenv("SECRET_KEY", "default-secret-key")
+DEFAULT_SECRET_KEY = "default-secret-key"
+app.secret_key = os.getenv("SECRET_KEY", DEFAULT_SECRET_KEY)
 
 # Initialize Bcrypt
 bcrypt = Bcrypt(app)
 
-# Set up MongoDB connection for storing user details
-mongo_client = MongoClient(os.getenv("MONGODB_URI"))
-db = mongo_client[os.getenv("MONGODB_DATABASE")]
-users_collection = db["users"]
+# MongoDB connection for storing user details. The client is created on
+# first use in each process: a MongoClient must not be shared across a fork,
+# and importing the app should not open sockets.
+_mongo_client = None
+_mongo_client_pid = None
+_mongo_client_lock = threading.Lock()
 
-# Initialize Grok (ChatGroq) for SQL query generation
+def get_mongo_db():
+    global _mongo_client, _mongo_client_pid
+    with _mongo_client_lock:
+        if _mongo_client is None or _mongo_client_pid != os.getpid():
+            _mongo_client = MongoClient(os.getenv("MONGODB_URI"))
+            _mongo_client_pid = os.getpid()
+        return _mongo_client[os.getenv("MONGODB_DATABASE")]
+
+def get_users_collection():
+    return get_mongo_db()["users"]
+
+# LangChain is imported on first use; it accounts for most of the app's import time
+def human_messages(prompt):
+    from langchain_core.messages import HumanMessage
+    return [HumanMessage(content=prompt)]
+
+def ai_message(content, usage_metadata=None, response_metadata=None, chunk=False):
+    from langchain_core.messages import AIMessage, AIMessageChunk
+    message_class = AIMessageChunk if chunk else AIMessage
+    return message_class(content=content, usage_metadata=usage_metadata, response_metadata=response_metadata or {})
+
+class StubLLM:
+    """Offline stand-in for ChatGroq that answers every prompt with canned SQL.
+    Selected with LLM_PROVIDER=stub for benchmarks and load tests that must
+    not depend on a Groq key.
+
+    Latency is drawn per call from a distribution around latency_ms: fixed,
+    uniform (+/- jitter as a fraction), exponential (mean latency_ms) or
+    lognormal (median latency_ms, sigma jitter). With tail_probability a call
+    takes an extra tail_ms, and with invalid_rate it returns broken SQL.
+    stream/astream emit the answer word by word, token_latency_ms apart;
+    invoke waits for the whole answer as a non-streaming call would.
+    """
+
+    def __init__(self, sql="SELECT 1", latency_ms=0.0, distribution='fixed', jitter=0.0,
+                 tail_probability=0.0, tail_ms=0.0, invalid_rate=0.0, seed=None, token_latency_ms=0.0):
+        self.sql = sql
+        self.latency_ms = latency_ms
+        self.token_latency_ms = token_latency_ms
+        self.distribution = distribution
+        self.jitter = jitter
+        self.tail_probability = tail_probability
+        self.tail_ms = tail_ms
+        self.invalid_rate = invalid_rate
+        self.random = random.Random(seed)
+
+    def bind(self, **kwargs):
+        # Sampling parameters such as temperature do not change canned answers
+        return self
+
+    def sample_latency_ms(self):
+        if self.distribution == 'uniform':
+            latency = self.random.uniform(self.latency_ms * (1 - self.jitter), self.latency_ms * (1 + self.jitter))
+        elif self.distribution == 'exponential':
+            latency = self.random.expovariate(1 / self.latency_ms) if self.latency_ms else 0.0
+        elif self.distribution == 'lognormal':
+            latency = self.latency_ms * math.exp(self.random.gauss(0, self.jitter))
+        else:
+            latency = self.latency_ms
+        if self.random.random() < self.tail_probability:
+            latency += self.tail_ms
+        return max(latency, 0.0)
+
+    def _content(self):
+        return self.sql if self.random.random() >= self.invalid_rate else "SELECT FROM WHERE"
+
+    def _response(self, messages, content):
+        prompt_tokens = sum(estimate_tokens(message.content) for message in messages)
+        completion_tokens = estimate_tokens(content)
+        return ai_message(content, {
+            'input_tokens': prompt_tokens,
+            'output_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens
+        })
+
+    def _chunks(self, content):
+        return re.findall(r'\s*\S+', content) or ['']
+
+    def invoke(self, messages):
+        content = self._content()
+        time.sleep((self.sample_latency_ms() + self.token_latency_ms * len(self._chunks(content))) / 1000)
+        return self._response(messages, content)
+
+    async def ainvoke(self, messages):
+        content = self._content()
+        await asyncio.sleep((self.sample_latency_ms() + self.token_latency_ms * len(self._chunks(content))) / 1000)
+        return self._response(messages, content)
+
+    def stream(self, messages):
+        time.sleep(self.sample_latency_ms() / 1000)
+        for chunk in self._chunks(self._content()):
+            time.sleep(self.token_latency_ms / 1000)
+            yield ai_message(chunk, chunk=True)
+
+    async def astream(self, messages):
+        await asyncio.sleep(self.sample_latency_ms() / 1000)
+        for chunk in self._chunks(self._content()):
+            await asyncio.sleep(self.token_latency_ms / 1000)
+            yield ai_message(chunk, chunk=True)
+
+# Initialize Grok (ChatGroq) for SQL query generation. The client is built on
+# first use in each process, so langchain/groq are not imported at startup and
+# forked workers never share the parent's HTTP connection pool.
 API_KEY = os.getenv("GROQ_API_KEY")
-llm = ChatGroq(api_key=API_KEY, model="llama-3.3-70b-versatile")
-
-# Database configuration
-DB_CONFIGS = {
-    'mysql': {
-        'name': 'MySQL',
-        'icon': 'fas fa-database',
-        'default_port': 3306,
-        'fields': ['server', 'port', 'database', 'username', 'password']
-    },
-    'postgresql': {
-        'name': 'PostgreSQL',
-        'icon': 'fas fa-elephant',
-        'default_port': 5432,
-        'fields': ['server', 'port', 'database', 'username', 'password']
-    },
-    'sqlite': {
-        'name': 'SQLite',
-        'icon': 'fas fa-file-alt',
-        'default_port': None,
-        'fields': ['database_path']
-    },
-    'sqlserver': {
-        'name': 'SQL Server',
-        'icon': 'fas fa-server',
-        'default_port': 1433,
-        'fields': ['server', 'port', 'database', 'username', 'password']
-    }
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "groq").lower()
+
+_llm = None
+_llm_pid = None
+_llm_lock = threading.Lock()
+
+def create_llm():
+    if LLM_PROVIDER == 'stub':
+        return StubLLM(
+            os.getenv("STUB_LLM_SQL", "SELECT 1"),
+            float(os.getenv("STUB_LLM_LATENCY_MS", 0)),
+            distribution=os.getenv("STUB_LLM_LATENCY_DISTRIBUTION", "fixed").lower(),
+            jitter=float(os.getenv("STUB_LLM_LATENCY_JITTER", 0)),
+            tail_probability=float(os.getenv("STUB_LLM_TAIL_PROBABILITY", 0)),
+            tail_ms=float(os.getenv("STUB_LLM_TAIL_MS", 0)),
+            invalid_rate=float(os.getenv("STUB_LLM_INVALID_RATE", 0)),
+            seed=os.getenv("STUB_LLM_SEED"),
+            token_latency_ms=float(os.getenv("STUB_LLM_TOKEN_LATENCY_MS", 0))
+        )
+    from langchain_groq import ChatGroq
+    return ChatGroq(api_key=API_KEY, model="llama-3.3-70b-versatile")
+
+def get_llm():
+    global _llm, _llm_pid
+    with _llm_lock:
+        if _llm is None or _llm_pid != os.getpid():
+            _llm = create_llm()
+            _llm_pid = os.getpid()
+        return _llm
+
+def set_llm(model):
+    """Replace this process's LLM client, e.g. with a StubLLM in benchmarks"""
+    global _llm, _llm_pid
+    with _llm_lock:
+        _llm = model
+        _llm_pid = os.getpid()
+
+# Database dialects. Each engine the app can talk to is a DialectAdapter
+# (defined with the query helpers further down) registered under its db_type;
+# DB_CONFIGS is what the connection form sees of them. Modules listed in
+# DIALECT_PLUGINS are imported after the built-in dialects and register more
+# through their register_dialects(app_module) function.
+DIALECT_PLUGINS = [name.strip() for name in os.getenv("DIALECT_PLUGINS", "").split(',') if name.strip()]
+DIALECTS = {}
+DB_CONFIGS = {}
+_dialects_by_backend = {}
+
+def register_dialect(adapter):
+    DIALECTS[adapter.db_type] = adapter
+    DB_CONFIGS[adapter.db_type] = adapter.config()
+    _dialects_by_backend[adapter.backend] = adapter
+    return adapter
+
+def get_dialect(db_type):
+    adapter = DIALECTS.get(db_type)
+    if adapter is None:
+        raise ValueError(f"Unsupported database type: {db_type}")
+    return adapter
+
+def dialect_for_url(url):
+    """The adapter for a SQLAlchemy URL, e.g. SQL Server for mssql+pyodbc://"""
+    return _dialects_by_backend.get(url.get_backend_name(), _generic_dialect)
+
+# Request instrumentation settings
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "false").lower() == "true"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+METRIC_BUCKETS = {
+    'seconds': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+    'tokens': (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000),
+    'rows': (0, 1, 10, 100, 1000, 10000, 100000, 1000000),
+    'bytes': (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864),
+    'candidates': (0, 1, 2, 3, 4, 6, 8)
 }
 
+class MetricsRegistry:
+    """Minimal Prometheus histogram registry. Each gunicorn worker keeps its own."""
+
+    def __init__(self):
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def histogram(self, name, description, buckets, labels):
+        self.histograms[name] = {
+            'description': description,
+            'buckets': buckets,
+            'labels': labels,
+            'series': {}
+        }
+
+    def observe(self, name, value, **labels):
+        histogram = self.histograms[name]
+        key = tuple(str(labels.get(label) or 'none') for label in histogram['labels'])
+        with self.lock:
+            series = histogram['series'].get(key)
+            if series is None:
+                series = histogram['series'][key] = {'buckets': [0] * len(histogram['buckets']), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(histogram['buckets']):
+                if value <= bound:
+                    series['buckets'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, histogram in self.histograms.items():
+                lines.append(f"# HELP {name} {histogram['description']}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, series in sorted(histogram['series'].items()):
+                    labels = ','.join(f'{label}="{_escape_label(value)}"' for label, value in zip(histogram['labels'], key))
+                    prefix = f"{labels}," if labels else ''
+                    for bound, count in zip(histogram['buckets'], series['buckets']):
+                        lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {count}')
+                    lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {series["count"]}')
+                    lines.append(f"{name}_sum{{{labels}}} {series['sum']}")
+                    lines.append(f"{name}_count{{{labels}}} {series['count']}")
+        return '\n'.join(lines) + '\n'
+
+def _escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+metrics = MetricsRegistry()
+metrics.histogram('querywhisper_request_duration_seconds', 'End-to-end request latency.',
+                  METRIC_BUCKETS['seconds'], ('endpoint', 'db_type', 'role'))
+metrics.histogram('querywhisper_stage_duration_seconds', 'Latency of each pipeline stage.',
+                  METRIC_BUCKETS['seconds'], ('stage', 'db_type', 'role'))
+metrics.histogram('querywhisper_llm_prompt_tokens', 'Prompt tokens per LLM call.',
+                  METRIC_BUCKETS['tokens'], ('db_type', 'role'))
+metrics.histogram('querywhisper_llm_completion_tokens', 'Completion tokens per LLM call.',
+                  METRIC_BUCKETS['tokens'], ('db_type', 'role'))
+metrics.histogram('querywhisper_result_rows', 'Rows returned to the client per query.',
+                  METRIC_BUCKETS['rows'], ('db_type', 'role'))
+metrics.histogram('querywhisper_response_bytes', 'Response body size.',
+                  METRIC_BUCKETS['bytes'], ('endpoint', 'db_type', 'role'))
+metrics.histogram('querywhisper_llm_candidates_launched', 'LLM requests fired per question in hedged mode.',
+                  METRIC_BUCKETS['candidates'], ('mode', 'db_type', 'role'))
+metrics.histogram('querywhisper_llm_winning_candidate', 'Index of the candidate whose SQL was used (0 = first request).',
+                  METRIC_BUCKETS['candidates'], ('mode', 'db_type', 'role'))
+
+def set_metric_labels(**labels):
+    """Attach db_type/role labels to everything measured for the current request"""
+    if has_app_context():
+        g.metric_labels = {**g.get('metric_labels', {}), **labels}
+
+def _metric_labels(db_type=None, role=None):
+    labels = dict(g.get('metric_labels', {})) if has_app_context() else {}
+    if db_type:
+        labels['db_type'] = db_type
+    if role:
+        labels['role'] = role
+    return labels
+
+def record_stage(stage, seconds, db_type=None, role=None):
+    labels = _metric_labels(db_type, role)
+    metrics.observe('querywhisper_stage_duration_seconds', seconds, stage=stage,
+                    db_type=labels.get('db_type'), role=labels.get('role'))
+    if has_app_context():
+        g.setdefault('timings', []).append((stage, seconds))
+
+@contextmanager
+def timed_stage(stage, db_type=None, role=None):
+    """Time a block as one pipeline stage (histogram plus Server-Timing entry)"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started, db_type, role)
+
+def record_llm_usage(response, db_type=None, role=None):
+    usage = getattr(response, 'usage_metadata', None) or {}
+    token_usage = (getattr(response, 'response_metadata', None) or {}).get('token_usage', {})
+    prompt_tokens = usage.get('input_tokens', token_usage.get('prompt_tokens'))
+    completion_tokens = usage.get('output_tokens', token_usage.get('completion_tokens'))
+    labels = _metric_labels(db_type, role)
+    if prompt_tokens is not None:
+        metrics.observe('querywhisper_llm_prompt_tokens', prompt_tokens, **labels)
+    if completion_tokens is not None:
+        metrics.observe('querywhisper_llm_completion_tokens', completion_tokens, **labels)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    labels = g.get('metric_labels', {})
+    endpoint = request.endpoint or 'unknown'
+    metrics.observe('querywhisper_request_duration_seconds', time.perf_counter() - started, endpoint=endpoint, **labels)
+    if not response.is_streamed:
+        metrics.observe('querywhisper_response_bytes', response.calculate_content_length() or 0, endpoint=endpoint, **labels)
+    if SERVER_TIMING_ENABLED and g.get('timings'):
+        response.headers['Server-Timing'] = ', '.join(
+            f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in g.timings
+        )
+    return response
+
+# Jinja rendering is timed through Flask's template signals
+def _template_render_started(sender, template, context, **extra):
+    g.render_started = time.perf_counter()
+
+def _template_render_finished(sender, template, context, **extra):
+    started = g.pop('render_started', None)
+    if started is not None:
+        record_stage('render', time.perf_counter() - started)
+
+before_render_template.connect(_template_render_started, app)
+template_rendered.connect(_template_render_finished, app)
+
+# Connection pool settings for the shared engine registry
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+POOL_MAX_OVERFLOW = int(os.getenv("DB_POOL_MAX_OVERFLOW", 10))
+POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+ENGINE_IDLE_TIMEOUT = int(os.getenv("DB_ENGINE_IDLE_TIMEOUT", 900))
+STATEMENT_TIMEOUT_MS = int(os.getenv("STATEMENT_TIMEOUT_MS", 30000))  # 0 disables
+# Background jobs exist for queries too slow for a request, so their
+# connections get their own timeout for the duration of the job
+JOB_STATEMENT_TIMEOUT_MS = int(os.getenv("JOB_STATEMENT_TIMEOUT_MS", 600000))  # 0 disables
+
+# SQLite pragmas applied to every pooled connection. A journal mode such as
+# "wal" lets queries read while another process writes, but it is stored in
+# the user's database file and stays after the app disconnects, so it is
+# opt-in and never applied to files opened read-only.
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "").lower()
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", 268435456))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", 65536))
+
+# Process-wide engine registry keyed by connection fingerprint. Each gunicorn
+# worker owns its own registry; engines inherited across a fork are dropped
+# without closing the parent's sockets.
+_engine_registry = {}
+_engine_registry_lock = threading.Lock()
+_engine_registry_pid = os.getpid()
+
+def engine_fingerprint(uri):
+    """Build a stable registry key for a connection URI"""
+    url = make_url(uri)
+    parts = [
+        url.get_backend_name(),
+        url.drivername.lower(),
+        (url.host or '').lower(),
+        str(url.port or dialect_for_url(url).default_port or ''),
+        url.database or '',
+        url.username or '',
+        url.password or '',
+        '&'.join(f"{key}={url.query[key]}" for key in sorted(url.query))
+    ]
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+def _pool_options():
+    return {
+        'pool_pre_ping': POOL_PRE_PING,
+        'pool_recycle': POOL_RECYCLE,
+        'pool_size': POOL_SIZE,
+        'max_overflow': POOL_MAX_OVERFLOW,
+        'pool_timeout': POOL_TIMEOUT
+    }
+
+def _set_mysql_timeout(dbapi_connection, timeout_ms):
+    # MAX_EXECUTION_TIME only applies to SELECT; MariaDB has max_statement_time instead
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"SET SESSION MAX_EXECUTION_TIME = {timeout_ms}")
+    except Exception:
+        cursor.execute(f"SET SESSION max_statement_time = {timeout_ms / 1000}")
+    cursor.close()
+
+def _set_postgresql_timeout(dbapi_connection, timeout_ms):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"SET SESSION statement_timeout = {timeout_ms}")
+    cursor.close()
+    # SET is transactional; commit so a later rollback keeps it
+    dbapi_connection.commit()
+
+def _set_sqlite_timeout(dbapi_connection, connection_record):
+    # SQLite has no server-side timeout: the progress handler aborts the
+    # running statement once the deadline set before each execute has passed
+    deadline = connection_record.info.setdefault('statement_deadline', [None])
+    dbapi_connection.set_progress_handler(
+        lambda: 1 if deadline[0] is not None and time.monotonic() > deadline[0] else 0, 10000
+    )
+
+def _set_sqlserver_timeout(dbapi_connection, timeout_ms):
+    # pyodbc's query timeout is in whole seconds; 0 waits forever
+    dbapi_connection.timeout = math.ceil(timeout_ms / 1000)
+
+def _start_sqlite_deadline(connection, cursor, statement, parameters, context, executemany):
+    # The deadline covers fetching the rows too, which is when SQLite does most
+    # of the work; it is only cleared when the connection goes back to the pool
+    deadline = connection.info.get('statement_deadline')
+    if deadline is not None:
+        timeout_ms = connection.info.get('statement_timeout_ms', STATEMENT_TIMEOUT_MS)
+        deadline[0] = time.monotonic() + timeout_ms / 1000 if timeout_ms else None
+
+def _clear_sqlite_deadline(dbapi_connection, connection_record):
+    deadline = connection_record.info.get('statement_deadline')
+    if deadline is not None:
+        deadline[0] = None
+
+def override_statement_timeout(connection, timeout_ms):
+    """Give one checkout of a pooled connection its own statement timeout
+    (0 disables it); the pool's STATEMENT_TIMEOUT_MS is restored at checkin"""
+    adapter = dialect_for_url(connection.engine.url)
+    connection.info['statement_timeout_ms'] = timeout_ms
+    if adapter.set_statement_timeout is not None:
+        adapter.set_statement_timeout(connection.connection.dbapi_connection, timeout_ms)
+
+def _restore_statement_timeout(adapter):
+    def restore(dbapi_connection, connection_record):
+        if connection_record.info.pop('statement_timeout_ms', None) is None or dbapi_connection is None:
+            return
+        if adapter.set_statement_timeout is not None:
+            adapter.set_statement_timeout(dbapi_connection, STATEMENT_TIMEOUT_MS)
+    return restore
+
+def sqlite_file_writable(url):
+    """Whether the app may change a SQLite file: not in-memory, not opened with
+    mode=ro or immutable=1, and the file and its directory (where WAL puts
+    its -wal and -shm files) are writable"""
+    database = url.database or ''
+    if database in ('', ':memory:') or database.startswith('file::memory:'):
+        return False
+    path, _, uri_query = database.removeprefix('file:').partition('?')
+    options = {**url.query, **dict(part.split('=', 1) for part in uri_query.split('&') if '=' in part)}
+    if options.get('mode') == 'ro' or options.get('immutable') == '1':
+        return False
+    return os.access(path, os.W_OK) and os.access(os.path.dirname(os.path.abspath(path)), os.W_OK)
+
+def _set_sqlite_pragmas(dbapi_connection, journal_mode):
+    cursor = dbapi_connection.cursor()
+    try:
+        if journal_mode:
+            try:
+                cursor.execute(f"PRAGMA journal_mode = {journal_mode}")
+                if journal_mode == 'wal':
+                    cursor.execute("PRAGMA synchronous = NORMAL")
+            except Exception as e:
+                # Databases locked by another process keep their mode
+                logger.debug(f"SQLite journal mode unchanged: {str(e)}")
+        cursor.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute("PRAGMA temp_store = MEMORY")
+    finally:
+        cursor.close()
+
+def _create_pooled_engine(uri):
+    url = make_url(uri)
+    adapter = dialect_for_url(url)
+    engine = adapter.install_hooks(adapter.create_engine(url))
+    event.listen(engine, 'checkin', _restore_statement_timeout(adapter))
+    return engine
+
+def _evict_idle_engines(now):
+    for key, entry in list(_engine_registry.items()):
+        if now - entry['last_used'] > ENGINE_IDLE_TIMEOUT and entry['engine'].pool.checkedout() == 0:
+            logger.debug(f"Disposing idle engine {key[:12]}")
+            entry['engine'].dispose()
+            del _engine_registry[key]
+
+def _get_engine_entry(uri):
+    global _engine_registry_pid
+    key = engine_fingerprint(uri)
+    now = time.monotonic()
+    with _engine_registry_lock:
+        if _engine_registry_pid != os.getpid():
+            for entry in _engine_registry.values():
+                entry['engine'].dispose(close=False)
+            _engine_registry.clear()
+            _engine_registry_pid = os.getpid()
+
+        _evict_idle_engines(now)
+        entry = _engine_registry.get(key)
+        if entry is None:
+            entry = {
+                'engine': _create_pooled_engine(uri),
+                'created_at': now,
+                'last_used': now,
+                'connects': 0,
+                'wait_total': 0.0,
+                'wait_max': 0.0
+            }
+            _engine_registry[key] = entry
+        entry['last_used'] = now
+        return entry
+
+def get_engine(uri):
+    """Return the shared pooled engine for a connection URI"""
+    return _get_engine_entry(uri)['engine']
+
+def engine_connect(uri):
+    """Check a connection out of the shared pool, recording the wait time"""
+    entry = _get_engine_entry(uri)
+    started = time.perf_counter()
+    connection = entry['engine'].connect()
+    waited = time.perf_counter() - started
+    with _engine_registry_lock:
+        entry['connects'] += 1
+        entry['wait_total'] += waited
+        entry['wait_max'] = max(entry['wait_max'], waited)
+    return connection
+
+def dispose_engine(uri):
+    """Close pooled connections for a URI and drop it from the registry"""
+    if not uri:
+        return
+    with _engine_registry_lock:
+        entry = _engine_registry.pop(engine_fingerprint(uri), None)
+    if entry:
+        entry['engine'].dispose()
+    dispose_async_engine(uri)
+
+def pool_stats():
+    """Report pool usage for every engine in this worker's registry"""
+    now = time.monotonic()
+    stats = []
+    with _engine_registry_lock:
+        for key, entry in _engine_registry.items():
+            pool = entry['engine'].pool
+            stats.append({
+                'engine': key[:12],
+                'backend': entry['engine'].url.get_backend_name(),
+                'pool': type(pool).__name__,
+                'size': pool.size() if callable(getattr(pool, 'size', None)) else None,
+                'checked_out': pool.checkedout() if hasattr(pool, 'checkedout') else None,
+                'overflow': pool.overflow() if hasattr(pool, 'overflow') else None,
+                'connects': entry['connects'],
+                'avg_wait_ms': round(entry['wait_total'] / entry['connects'] * 1000, 3) if entry['connects'] else 0.0,
+                'max_wait_ms': round(entry['wait_max'] * 1000, 3),
+                'idle_seconds': round(now - entry['last_used'], 1)
+            })
+    return {'pid': os.getpid(), 'engines': stats}
+
+# Each worker process runs one background event loop. Async engines and the
+# LLM's async HTTP client are bound to the loop they were first used on, so
+# every coroutine of the async path is scheduled here rather than on the
+# short-lived loop Flask creates for each async view.
+_async_loop = None
+_async_loop_pid = None
+_async_loop_lock = threading.Lock()
+_async_engine_registry = {}
+
+def get_async_loop():
+    """Return this worker's background event loop, starting it on first use"""
+    global _async_loop, _async_loop_pid
+    with _async_loop_lock:
+        if _async_loop is None or _async_loop_pid != os.getpid():
+            _async_engine_registry.clear()
+            _async_loop = asyncio.new_event_loop()
+            _async_loop_pid = os.getpid()
+            threading.Thread(target=_async_loop.run_forever, name='async-query-loop', daemon=True).start()
+        return _async_loop
+
+def run_async(coro):
+    """Schedule a coroutine on the background loop; returns a concurrent.futures.Future"""
+    return asyncio.run_coroutine_threadsafe(coro, get_async_loop())
+
+def get_async_engine(uri):
+    """Return the pooled async engine for a URI. Must be called on the background loop."""
+    key = engine_fingerprint(uri)
+    engine = _async_engine_registry.get(key)
+    if engine is None:
+        url = make_url(uri)
+        adapter = dialect_for_url(url)
+        async_url = url.set(drivername=adapter.async_driver)
+        from sqlalchemy.ext.asyncio import create_async_engine
+        engine = create_async_engine(async_url, **adapter.engine_options(async_url))
+        adapter.install_hooks(engine.sync_engine, asynchronous=True)
+        _async_engine_registry[key] = engine
+    return engine
+
+async def _dispose_async_engine(key):
+    engine = _async_engine_registry.pop(key, None)
+    if engine:
+        await engine.dispose()
+
+def dispose_async_engine(uri):
+    if _async_loop is not None and _async_loop_pid == os.getpid():
+        run_async(_dispose_async_engine(engine_fingerprint(uri)))
+
+def test_connection(uri):
+    """Run a trivial query through the pool; drop the engine if it fails"""
+    try:
+        with engine_connect(uri) as connection:
+            connection.execute(text('SELECT 1'))
+    except Exception:
+        dispose_engine(uri)
+        raise
+
+# Server-side connection store. The session cookie only carries an opaque
+# handle; the URI and credentials stay on the server, in this worker's
+# registry and (with CONNECTION_STORE=mongodb) encrypted in MongoDB so any
+# worker can pick the connection up. Handles idle for CONNECTION_IDLE_TIMEOUT
+# are forgotten, and a user keeps at most CONNECTION_MAX_PER_USER of them.
+CONNECTION_STORE = os.getenv("CONNECTION_STORE", "mongodb").lower()  # mongodb or memory
+CONNECTION_IDLE_TIMEOUT = int(os.getenv("CONNECTION_IDLE_TIMEOUT", 3600))
+CONNECTION_MAX_PER_USER = int(os.getenv("CONNECTION_MAX_PER_USER", 3))
+CONNECTION_TOUCH_INTERVAL = 60  # seconds between last_used updates in MongoDB
+# gunicorn starts this many worker processes (it reads the same variable)
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", 1))
+
+if CONNECTION_STORE == 'mongodb' and app.secret_key == DEFAULT_SECRET_KEY:
+    # The credentials would be encrypted with a key published in this file
+    logger.error("SECRET_KEY is not set: connection credentials are not stored in MongoDB and stay in the worker that connected")
+    CONNECTION_STORE = 'memory'
+if CONNECTION_STORE == 'memory' and WEB_CONCURRENCY > 1:
+    # Requests reaching another worker would find no connection
+    raise RuntimeError(f"The connection store is in memory (CONNECTION_STORE=memory, or SECRET_KEY is not set), "
+                       f"which needs a single worker, but WEB_CONCURRENCY={WEB_CONCURRENCY}. "
+                       f"Set SECRET_KEY and CONNECTION_STORE=mongodb, or WEB_CONCURRENCY=1.")
+
+_connection_registry = OrderedDict()
+_connection_registry_lock = threading.Lock()
+_connection_registry_pid = os.getpid()
+_connection_cipher = None
+_connection_indexes_ready = False
+
+def get_connection_cipher():
+    """Fernet cipher for stored connection secrets, keyed from SECRET_KEY"""
+    global _connection_cipher
+    if _connection_cipher is None:
+        from cryptography.fernet import Fernet
+        key = hashlib.sha256(f"connection-store:{app.secret_key}".encode('utf-8')).digest()
+        _connection_cipher = Fernet(base64.urlsafe_b64encode(key))
+    return _connection_cipher
+
+def get_connection_collection():
+    global _connection_indexes_ready
+    collection = get_mongo_db()['connections']
+    if not _connection_indexes_ready:
+        collection.create_index('last_used', expireAfterSeconds=CONNECTION_IDLE_TIMEOUT)
+        collection.create_index('user_id')
+        _connection_indexes_ready = True
+    return collection
+
+def _evict_idle_connections(now):
+    for handle, entry in list(_connection_registry.items()):
+        if now - entry['last_used'] > CONNECTION_IDLE_TIMEOUT:
+            logger.debug(f"Forgetting idle connection handle {handle[:8]}")
+            del _connection_registry[handle]
+
+def _connection_registry_entries():
+    """The registry for this process; a forked worker starts with an empty one"""
+    global _connection_registry_pid
+    if _connection_registry_pid != os.getpid():
+        _connection_registry.clear()
+        _connection_registry_pid = os.getpid()
+    _evict_idle_connections(time.monotonic())
+    return _connection_registry
+
+def _load_stored_connection(handle, user_id):
+    """Fetch and decrypt a connection another worker registered"""
+    try:
+        record = get_connection_collection().find_one_and_update(
+            {'_id': handle, 'user_id': user_id}, {'$set': {'last_used': datetime.utcnow()}}
+        )
+        if record is None:
+            return None
+        secret = orjson.loads(get_connection_cipher().decrypt(record['secret']))
+    except Exception as e:
+        logger.error(f"Could not load stored connection: {str(e)}")
+        return None
+    now = time.monotonic()
+    return {
+        'user_id': user_id,
+        'db_type': record['db_type'],
+        'database': record['database'],
+        'uri': secret['uri'],
+        'credentials': secret['credentials'],
+        'last_used': now,
+        'touched_at': now
+    }
+
+def _forget_connections(handles):
+    if CONNECTION_STORE == 'mongodb' and handles:
+        try:
+            get_connection_collection().delete_many({'_id': {'$in': handles}})
+        except PyMongoError as e:
+            logger.error(f"Could not delete stored connections: {str(e)}")
+
+def register_connection(user_id, db_type, connection_result):
+    """Store a tested connection and return the opaque handle for the session"""
+    handle = secrets.token_urlsafe(32)
+    now = time.monotonic()
+    entry = {
+        'user_id': user_id,
+        'db_type': db_type,
+        'database': connection_result['database'],
+        'uri': connection_result['uri'],
+        'credentials': connection_result['credentials'],
+        'last_used': now,
+        'touched_at': now
+    }
+    if CONNECTION_STORE == 'mongodb':
+        secret = orjson.dumps({'uri': entry['uri'], 'credentials': entry['credentials']})
+        get_connection_collection().insert_one({
+            '_id': handle,
+            'user_id': user_id,
+            'db_type': db_type,
+            'database': entry['database'],
+            'secret': get_connection_cipher().encrypt(secret),
+            'last_used': datetime.utcnow()
+        })
+
+    with _connection_registry_lock:
+        registry = _connection_registry_entries()
+        registry[handle] = entry
+        owned = [key for key, value in registry.items() if value['user_id'] == user_id]
+    # Over the cap, the user's least recently used handles are dropped; with
+    # MongoDB the stored records count, since other workers may hold the rest
+    if CONNECTION_STORE == 'mongodb':
+        stored = get_connection_collection().find({'user_id': user_id}, {'_id': 1}).sort('last_used', -1)
+        evicted = [record['_id'] for record in stored.skip(CONNECTION_MAX_PER_USER) if record['_id'] != handle]
+    else:
+        evicted = owned[:max(len(owned) - CONNECTION_MAX_PER_USER, 0)]
+    if evicted:
+        with _connection_registry_lock:
+            for key in evicted:
+                _connection_registry.pop(key, None)
+        _forget_connections(evicted)
+    return handle
+
+def get_connection(handle, user_id):
+    """Look up a handle for its owner, loading it from MongoDB if another worker registered it"""
+    if not handle or not user_id:
+        return None
+    now = time.monotonic()
+    with _connection_registry_lock:
+        registry = _connection_registry_entries()
+        entry = registry.get(handle)
+        if entry is not None:
+            if entry['user_id'] != user_id:
+                return None
+            entry['last_used'] = now
+            registry.move_to_end(handle)
+            touch = CONNECTION_STORE == 'mongodb' and now - entry['touched_at'] > CONNECTION_TOUCH_INTERVAL
+            if touch:
+                entry['touched_at'] = now
+            else:
+                return entry
+
+    if entry is not None:
+        # Keep the stored copy from expiring while this worker serves the
+        # handle; a missing record was released or evicted by another worker
+        try:
+            result = get_connection_collection().update_one({'_id': handle}, {'$set': {'last_used': datetime.utcnow()}})
+        except PyMongoError as e:
+            logger.error(f"Could not refresh stored connection: {str(e)}")
+            return entry
+        if result.matched_count == 0:
+            with _connection_registry_lock:
+                _connection_registry.pop(handle, None)
+            return None
+        return entry
+    if CONNECTION_STORE != 'mongodb':
+        return None
+
+    entry = _load_stored_connection(handle, user_id)
+    if entry is not None:
+        with _connection_registry_lock:
+            _connection_registry_entries()[handle] = entry
+    return entry
+
+def release_connection(handle):
+    """Forget a handle and close the pooled connections behind it once no
+    other handle in this worker shares the engine (same fingerprint)"""
+    if not handle:
+        return
+    with _connection_registry_lock:
+        registry = _connection_registry_entries()
+        entry = registry.pop(handle, None)
+        if entry:
+            fingerprint = engine_fingerprint(entry['uri'])
+            shared = any(engine_fingerprint(other['uri']) == fingerprint for other in registry.values())
+    _forget_connections([handle])
+    if entry and not shared:
+        dispose_engine(entry['uri'])
+
+def connection_stats():
+    with _connection_registry_lock:
+        registry = _connection_registry_entries()
+        return {
+            'store': CONNECTION_STORE,
+            'handles': len(registry),
+            'users': len({entry['user_id'] for entry in registry.values()})
+        }
+
+def get_connection_details():
+    """(uri, db_type, credentials) for the session's connection, or Nones"""
+    entry = get_connection(session.get('connection'), session.get('user_id'))
+    if entry is None:
+        session.pop('connection', None)
+        return None, None, None
+    return entry['uri'], entry['db_type'], entry['credentials']
+
+def set_last_query(query):
+    """Keep the last SELECT of the session's connection on the server, for
+    /export, /stream_results and result pages served by other workers"""
+    handle, user_id = session.get('connection'), session.get('user_id')
+    entry = get_connection(handle, user_id)
+    if entry is None:
+        return
+    entry['last_query'] = query
+    if CONNECTION_STORE == 'mongodb':
+        try:
+            stored = get_connection_cipher().encrypt(query.encode('utf-8')) if query else None
+            get_connection_collection().update_one({'_id': handle, 'user_id': user_id}, {'$set': {'last_query': stored}})
+        except PyMongoError as e:
+            logger.error(f"Could not store last query: {str(e)}")
+
+def get_last_query():
+    """The last SELECT run on the session's connection, or None"""
+    handle, user_id = session.get('connection'), session.get('user_id')
+    entry = get_connection(handle, user_id)
+    if entry is None:
+        return None
+    if CONNECTION_STORE != 'mongodb':
+        return entry.get('last_query')
+    # Read the stored copy: the query may have run in another worker
+    try:
+        record = get_connection_collection().find_one({'_id': handle, 'user_id': user_id}, {'last_query': 1})
+    except PyMongoError as e:
+        logger.error(f"Could not load last query: {str(e)}")
+        return entry.get('last_query')
+    if not record or not record.get('last_query'):
+        return None
+    return get_connection_cipher().decrypt(record['last_query']).decode('utf-8')
+
+def clear_session_connection():
+    release_connection(session.pop('connection', None))
+    session.pop('result_handle', None)
+    session.pop('database', None)
+    session.pop('db_type', None)
+
+# Result delivery settings: rows rendered into the page, and rows per
+# server-side cursor batch when streaming
+RESULT_ROW_CAP = int(os.getenv("RESULT_ROW_CAP", 1000))
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", 1000))
+
+# Cached user principal (name, email, role). A role change bumps a version
+# stamp in MongoDB; each worker reads the stamp at most every
+# PRINCIPAL_VERSION_CHECK_INTERVAL seconds and drops its cached principals
+# when it moved, so a revoked role is not served for the whole TTL.
+PRINCIPAL_CACHE_TTL = int(os.getenv("PRINCIPAL_CACHE_TTL", 30))
+PRINCIPAL_VERSION_CHECK_INTERVAL = float(os.getenv("PRINCIPAL_VERSION_CHECK_INTERVAL", 1))
+_principal_cache = {}
+_principal_cache_lock = threading.Lock()
+_principal_version = None
+_principal_version_checked_at = None
+_user_indexes_ready = False
+
+def ensure_user_indexes():
+    """Create the unique users.email index once per process so login and
+    registration lookups use it instead of a collection scan"""
+    global _user_indexes_ready
+    if _user_indexes_ready:
+        return
+    try:
+        get_users_collection().create_index('email', unique=True)
+        _user_indexes_ready = True
+    except PyMongoError as e:
+        logger.error(f"Could not create unique index on users.email: {str(e)}")
+
+def get_principal_versions():
+    return get_mongo_db()['principal_versions']
+
+def _check_principal_version(now):
+    """Drop this worker's cached principals when a role changed anywhere"""
+    global _principal_version, _principal_version_checked_at
+    with _principal_cache_lock:
+        if _principal_version_checked_at is not None and now - _principal_version_checked_at < PRINCIPAL_VERSION_CHECK_INTERVAL:
+            return
+        _principal_version_checked_at = now
+    try:
+        stamp = get_principal_versions().find_one({'_id': 'roles'})
+        version = stamp['version'] if stamp else 0
+    except PyMongoError as e:
+        # Without the stamp a revocation could be missed, so stop trusting the cache
+        logger.error(f"Could not read the principal version: {str(e)}")
+        version = None
+    with _principal_cache_lock:
+        if version is None or version != _principal_version:
+            _principal_cache.clear()
+        _principal_version = version
+
+def get_current_user():
+    """Return the logged-in user's principal, or None.
+
+    Cached for the request in ``g`` and for PRINCIPAL_CACHE_TTL seconds per
+    process, so routes do not each make their own MongoDB round trip.
+    """
+    user_id = session.get('user_id')
+    if not user_id:
+        return None
+    if g.get('current_user_id') == user_id:
+        return g.current_user
+
+    now = time.monotonic()
+    _check_principal_version(now)
+    with _principal_cache_lock:
+        cached = _principal_cache.get(user_id)
+    if cached and cached[0] > now:
+        principal = cached[1]
+    else:
+        with timed_stage('user_lookup'):
+            user = get_users_collection().find_one({'_id': ObjectId(user_id)}, {'name': 1, 'email': 1, 'role': 1})
+        principal = {
+            'name': user.get('name', 'User'),
+            'email': user['email'],
+            'role': user.get('role', 'user')
+        } if user else None
+        with _principal_cache_lock:
+            _principal_cache[user_id] = (now + PRINCIPAL_CACHE_TTL, principal)
+
+    g.current_user_id = user_id
+    g.current_user = principal
+    if principal:
+        set_metric_labels(role=principal['role'])
+    return principal
+
+def invalidate_user_principal(user_id):
+    with _principal_cache_lock:
+        _principal_cache.pop(str(user_id), None)
+    if g.get('current_user_id') == str(user_id):
+        g.pop('current_user_id')
+        g.pop('current_user', None)
+
+def set_user_role(email, role):
+    """Change a user's role, drop this process's cached principal for them and
+    bump the version stamp so the other workers drop theirs"""
+    user = get_users_collection().find_one_and_update({'email': email}, {'$set': {'role': role}}, projection={'_id': 1})
+    if user:
+        get_principal_versions().update_one({'_id': 'roles'}, {'$inc': {'version': 1}}, upsert=True)
+        invalidate_user_principal(user['_id'])
+    return user is not None
+
+@app.cli.command('set-role')
+@click.argument('email')
+@click.argument('role', type=click.Choice(['admin', 'user']))
+def set_role_command(email, role):
+    """Change a user's role (admin or user)."""
+    with app.test_request_context():
+        if set_user_role(email, role):
+            click.echo(f"{email} is now {role}")
+        else:
+            click.echo(f"No user registered with {email}", err=True)
+
 # Decorator to restrict access to logged-in users only
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             return redirect(url_for('login'))
-        return f(*args, **kwargs)
+        return current_app.ensure_sync(f)(*args, **kwargs)
     return decorated_function
 
 # Registration route with role selection
@@ -89,7 +1039,8 @@ def register():
         if role not in ['admin', 'user']:
             return render_template('register.html', error='Invalid role selected')
 
-        if users_collection.find_one({'email': email}):
+        ensure_user_indexes()
+        if get_users_collection().find_one({'email': email}, {'_id': 1}):
             return render_template('register.html', error='Email already registered')
 
         hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
@@ -101,7 +1052,10 @@ def register():
             'role': role,
             'created_at': datetime.utcnow()
         }
-        users_collection.insert_one(user)
+        try:
+            get_users_collection().insert_one(user)
+        except DuplicateKeyError:
+            return render_template('register.html', error='Email already registered')
 
         return render_template('register.html', success='Registration successful! Please login.')
 
@@ -114,7 +1068,8 @@ def login():
         email = request.form['username']
         password = request.form['password']
 
-        user = users_collection.find_one({'email': email})
+        ensure_user_indexes()
+        user = get_users_collection().find_one({'email': email}, {'password': 1})
         if user and bcrypt.check_password_hash(user['password'], password):
             session['user_id'] = str(user['_id'])
             return redirect(url_for('index'))
@@ -126,416 +1081,1586 @@ def login():
 # Logout route
 @app.route('/logout')
 def logout():
+    clear_session_connection()
+    if 'user_id' in session:
+        invalidate_user_principal(session['user_id'])
     session.pop('user_id', None)
-    session.pop('uri', None)
-    session.pop('database', None)
-    session.pop('db_type', None)
-    session.pop('db_credentials', None)
     return redirect(url_for('index'))
 
 # Index route with welcome message and role display
 @app.route('/')
 def index():
-    user_data = None
-    if 'user_id' in session:
-        user = users_collection.find_one({'_id': ObjectId(session['user_id'])})
-        if user:
-            user_data = {
-                'name': user.get('name', 'User'),
-                'email': user['email'],
-                'role': user.get('role', 'user')
-            }
-    return render_template('index.html', user_data=user_data, db_configs=DB_CONFIGS)
+    return render_template('index.html', user_data=get_current_user(), db_configs=DB_CONFIGS)
 
 # Database connection route (protected)
 @app.route('/getinput', methods=['POST'])
 @login_required
 def getinput():
     db_type = request.form['db_type']
+    set_metric_labels(db_type=db_type if db_type in DB_CONFIGS else 'unknown')
 
     try:
-        if db_type == 'mysql':
-            connection_result = connect_mysql(request.form)
-        elif db_type == 'postgresql':
-            connection_result = connect_postgresql(request.form)
-        elif db_type == 'sqlite':
-            connection_result = connect_sqlite(request.form)
-        elif db_type == 'sqlserver':
-            connection_result = connect_sqlserver(request.form)
-        else:
-            raise ValueError(f"Unsupported database type: {db_type}")
+        with timed_stage('connect'):
+            connection_result = get_dialect(db_type).connect(request.form)
 
         if connection_result['success']:
+            release_connection(session.pop('connection', None))
+            session['connection'] = register_connection(session['user_id'], db_type, connection_result)
             session['db_type'] = db_type
-            session['uri'] = connection_result['uri']
             session['database'] = connection_result['database']
-            session['db_credentials'] = connection_result['credentials']
+            session.pop('result_handle', None)
 
-            user = users_collection.find_one({'_id': ObjectId(session['user_id'])})
-            user_data = {
-                'name': user.get('name', 'User'),
-                'email': user['email'],
-                'role': user.get('role', 'user')
-            }
             return render_template('index.html',
                                   status='success',
                                   message=f'Successfully connected to {DB_CONFIGS[db_type]["name"]} database.',
                                   connected_db=connection_result['database'],
                                   connected_db_type=DB_CONFIGS[db_type]['name'],
-                                  user_data=user_data,
+                                  user_data=get_current_user(),
                                   db_configs=DB_CONFIGS)
         else:
             raise Exception(connection_result['error'])
 
     except Exception as e:
-        user = users_collection.find_one({'_id': ObjectId(session['user_id'])})
-        user_data = {
-            'name': user.get('name', 'User'),
-            'email': user['email'],
-            'role': user.get('role', 'user')
-        } if user else None
         return render_template('index.html',
                               status='error',
                               message=f'Connection failed: {str(e)}',
-                              user_data=user_data,
+                              user_data=get_current_user(),
                               db_configs=DB_CONFIGS)
 
-def connect_mysql(form_data):
-    server = form_data['server']
-    port = form_data.get('port', 3306)
-    database = form_data['database']
-    username = form_data['username']
-    password = form_data['password']
+def get_database_schema(db_type, uri):
+    """Get schema information based on database type"""
+    return get_dialect(db_type).introspect(uri)
 
-    password_encoded = urllib.parse.quote(password)
-    uri = f"mysql+pymysql://{username}:{password_encoded}@{server}:{port}/{database}"
+# Schema cache settings
+SCHEMA_CACHE_TTL = int(os.getenv("SCHEMA_CACHE_TTL", 300))
+SCHEMA_CACHE_MAX_ENTRIES = int(os.getenv("SCHEMA_CACHE_MAX_ENTRIES", 64))
 
-    engine = create_engine(uri)
-    connection = engine.connect()
-    connection.execute(text('SELECT 1'))
-    connection.close()
+# LRU of introspected schemas keyed by the dialect's schema_cache_key
+_schema_cache = OrderedDict()
+_schema_cache_lock = threading.Lock()
 
-    return {
-        'success': True,
-        'uri': uri,
-        'database': database,
-        'credentials': {
-            'host': server,
-            'port': int(port),
-            'user': username,
-            'password': password,
-            'database': database
-        }
-    }
+def schema_cache_key(db_type, credentials):
+    return get_dialect(db_type).schema_cache_key(credentials)
 
-def connect_postgresql(form_data):
-    server = form_data['server']
-    port = form_data.get('port', 5432)
-    database = form_data['database']
-    username = form_data['username']
-    password = form_data['password']
+def probe_schema_version(db_type, uri):
+    """Return an opaque token that changes when the schema changes, or None"""
+    probe = get_dialect(db_type).schema_version_probe
+    if not probe:
+        return None
+    try:
+        with engine_connect(uri) as connection:
+            row = connection.execute(text(probe)).fetchone()
+        return tuple(str(value) for value in row) if row else None
+    except Exception as e:
+        logger.warning(f"Schema version probe failed for {db_type}: {str(e)}")
+        return None
 
-    password_encoded = urllib.parse.quote(password)
-    uri = f"postgresql://{username}:{password_encoded}@{server}:{port}/{database}"
+def get_cached_schema(db_type, uri, credentials, force_refresh=False):
+    """Get the database schema, reusing the cached copy while it is still current.
 
-    engine = create_engine(uri)
-    connection = engine.connect()
-    connection.execute(text('SELECT 1'))
-    connection.close()
+    Within SCHEMA_CACHE_TTL no round trips are made at all. After that a single
+    version probe decides whether the cached schema can be kept or has to be
+    introspected again.
+    """
+    key = schema_cache_key(db_type, credentials)
+    now = time.monotonic()
+    with _schema_cache_lock:
+        entry = _schema_cache.get(key)
+        if entry:
+            _schema_cache.move_to_end(key)
 
-    return {
-        'success': True,
-        'uri': uri,
-        'database': database,
-        'credentials': {
-            'host': server,
-            'port': int(port),
-            'user': username,
-            'password': password,
-            'database': database
+    if entry and not force_refresh and now - entry['checked_at'] < SCHEMA_CACHE_TTL:
+        return entry['schema']
+
+    version = probe_schema_version(db_type, uri)
+    if entry and not force_refresh and version is not None and version == entry['version']:
+        entry['checked_at'] = now
+        return entry['schema']
+
+    schema_dict = get_database_schema(db_type, uri)
+    with _schema_cache_lock:
+        _schema_cache[key] = {
+            'schema': schema_dict,
+            'version': version,
+            'checked_at': time.monotonic()
         }
-    }
+        _schema_cache.move_to_end(key)
+        while len(_schema_cache) > SCHEMA_CACHE_MAX_ENTRIES:
+            _schema_cache.popitem(last=False)
+    return schema_dict
 
-def connect_sqlite(form_data):
-    database_path = form_data['database_path']
+def invalidate_schema(db_type, credentials):
+    with _schema_cache_lock:
+        _schema_cache.pop(schema_cache_key(db_type, credentials), None)
 
-    uri = f"sqlite:///{database_path}"
+# Set-based introspection queries. Each returns one row per column, ordered by
+# table and ordinal position, as (table, column, type, nullable, default,
+# primary_key, foreign_key, indexed) so the whole schema is read in one round trip.
+MYSQL_SCHEMA_QUERY = """
+    SELECT c.TABLE_NAME, c.COLUMN_NAME, c.COLUMN_TYPE, c.IS_NULLABLE = 'YES', c.COLUMN_DEFAULT,
+           c.COLUMN_KEY = 'PRI',
+           CONCAT(k.REFERENCED_TABLE_NAME, '.', k.REFERENCED_COLUMN_NAME),
+           c.COLUMN_KEY <> ''
+    FROM information_schema.COLUMNS c
+    LEFT JOIN information_schema.KEY_COLUMN_USAGE k
+           ON k.TABLE_SCHEMA = c.TABLE_SCHEMA
+          AND k.TABLE_NAME = c.TABLE_NAME
+          AND k.COLUMN_NAME = c.COLUMN_NAME
+          AND k.REFERENCED_TABLE_NAME IS NOT NULL
+    WHERE c.TABLE_SCHEMA = DATABASE()
+    ORDER BY c.TABLE_NAME, c.ORDINAL_POSITION
+"""
 
-    engine = create_engine(uri)
-    connection = engine.connect()
-    connection.execute(text('SELECT 1'))
-    connection.close()
+POSTGRESQL_SCHEMA_QUERY = """
+    SELECT c.relname, a.attname, format_type(a.atttypid, a.atttypmod), NOT a.attnotnull,
+           pg_get_expr(d.adbin, d.adrelid),
+           EXISTS (SELECT 1 FROM pg_catalog.pg_index i
+                   WHERE i.indrelid = c.oid AND i.indisprimary AND a.attnum = ANY(i.indkey)),
+           (SELECT fc.relname || '.' || fa.attname
+              FROM pg_catalog.pg_constraint f
+              JOIN pg_catalog.pg_class fc ON fc.oid = f.confrelid
+              JOIN pg_catalog.pg_attribute fa
+                ON fa.attrelid = f.confrelid
+               AND fa.attnum = f.confkey[array_position(f.conkey, a.attnum)]
+             WHERE f.conrelid = c.oid AND f.contype = 'f' AND a.attnum = ANY(f.conkey)
+             LIMIT 1),
+           EXISTS (SELECT 1 FROM pg_catalog.pg_index i
+                   WHERE i.indrelid = c.oid AND a.attnum = ANY(i.indkey))
+    FROM pg_catalog.pg_class c
+    JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_catalog.pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+    LEFT JOIN pg_catalog.pg_attrdef d ON d.adrelid = c.oid AND d.adnum = a.attnum
+    WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p', 'v', 'm')
+    ORDER BY c.relname, a.attnum
+"""
 
-    return {
-        'success': True,
-        'uri': uri,
-        'database': database_path.split('/')[-1],
-        'credentials': {
-            'database_path': database_path
-        }
+SQLITE_SCHEMA_QUERY = """
+    SELECT m.name, p.name, p.type, NOT p."notnull", p.dflt_value, p.pk > 0,
+           CASE WHEN f."table" IS NULL THEN NULL
+                ELSE f."table" || '.' || COALESCE(f."to", p.name) END,
+           ix.col IS NOT NULL
+    FROM sqlite_master m
+    JOIN pragma_table_info(m.name) p
+    LEFT JOIN pragma_foreign_key_list(m.name) f ON f."from" = p.name
+    LEFT JOIN (SELECT DISTINCT im.name AS tbl, ii.name AS col
+               FROM sqlite_master im
+               JOIN pragma_index_list(im.name) il
+               JOIN pragma_index_info(il.name) ii
+               WHERE im.type = 'table') ix ON ix.tbl = m.name AND ix.col = p.name
+    WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%'
+    ORDER BY m.name, p.cid
+"""
+
+SQLSERVER_SCHEMA_QUERY = """
+    SELECT t.name, c.name, ty.name, c.is_nullable, dc.definition,
+           CASE WHEN EXISTS (SELECT 1 FROM sys.index_columns ic
+                             JOIN sys.indexes i ON i.object_id = ic.object_id AND i.index_id = ic.index_id
+                             WHERE ic.object_id = t.object_id AND ic.column_id = c.column_id
+                               AND i.is_primary_key = 1) THEN 1 ELSE 0 END,
+           (SELECT TOP 1 rt.name + '.' + rc.name
+              FROM sys.foreign_key_columns fkc
+              JOIN sys.tables rt ON rt.object_id = fkc.referenced_object_id
+              JOIN sys.columns rc
+                ON rc.object_id = fkc.referenced_object_id
+               AND rc.column_id = fkc.referenced_column_id
+             WHERE fkc.parent_object_id = t.object_id AND fkc.parent_column_id = c.column_id),
+           CASE WHEN EXISTS (SELECT 1 FROM sys.index_columns ic
+                             WHERE ic.object_id = t.object_id AND ic.column_id = c.column_id) THEN 1 ELSE 0 END
+    FROM sys.tables t
+    JOIN sys.columns c ON c.object_id = t.object_id
+    JOIN sys.types ty ON ty.user_type_id = c.user_type_id
+    LEFT JOIN sys.default_constraints dc ON dc.object_id = c.default_object_id
+    ORDER BY t.name, c.column_id
+"""
+
+def build_schema_dict(rows):
+    """Group introspection rows into {table: [column, ...]}"""
+    schema_dict = {}
+    for table, name, col_type, nullable, default, primary_key, foreign_key, indexed in rows:
+        columns = schema_dict.setdefault(table, [])
+        # A column in several foreign keys comes back once per key; keep the first
+        if columns and columns[-1]['name'] == name:
+            continue
+        columns.append({
+            "name": name,
+            "type": col_type,
+            "nullable": bool(nullable),
+            "default": default,
+            "primary_key": bool(primary_key),
+            "foreign_key": foreign_key,
+            "indexed": bool(indexed)
+        })
+    return schema_dict
+
+# Statement execution settings. In batched mode independent SELECTs run
+# concurrently on separate pooled connections, and any batch containing writes
+# runs in one transaction with consecutive INSERTs merged into multi-row VALUES.
+EXECUTION_MODE = os.getenv("EXECUTION_MODE", "sequential").lower()  # sequential or batched
+# Rows per merged VALUES list; SQL Server accepts at most 1000
+BATCH_INSERT_MAX_ROWS = min(int(os.getenv("BATCH_INSERT_MAX_ROWS", 500)), 1000)
+
+INSERT_VALUES_PATTERN = re.compile(
+    r'^\s*(INSERT\s+INTO\s+[^\s(]+\s*(?:\([^)]*\))?\s*VALUES)\s*(\(.*\))\s*$',
+    re.IGNORECASE | re.DOTALL
+)
+# Tails that make an INSERT unsafe to merge with its neighbours
+INSERT_MERGE_BLOCKERS = re.compile(r'\b(ON\s+CONFLICT|ON\s+DUPLICATE|RETURNING|OUTPUT|SELECT)\b', re.IGNORECASE)
+
+def split_statements(sql_query):
+    return [q.strip() for q in sql_query.split(';') if q.strip()]
+
+def is_read_statement(query):
+    """True for SELECTs and for WITH queries whose CTEs do not modify data"""
+    if re.match(r'^\s*SELECT\b', query, re.IGNORECASE):
+        return True
+    if not re.match(r'^\s*WITH\b', query, re.IGNORECASE):
+        return False
+    return sql_statement_kinds(query) in (['select'], ['other'])
+
+def split_values_rows(values):
+    """The row tuples of a VALUES list, or None when it is not a plain list of tuples"""
+    rows = []
+    depth = 0
+    quote = None
+    start = gap_start = 0
+    for position, char in enumerate(values):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in '\'"`':
+            quote = char
+        elif char == '(':
+            if depth == 0:
+                if values[gap_start:position].strip() != (',' if rows else ''):
+                    return None
+                start = position
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if depth < 0:
+                return None
+            if depth == 0:
+                rows.append(values[start:position + 1])
+                gap_start = position + 1
+        elif depth == 0 and not char.isspace() and char != ',':
+            return None
+    if quote or depth or values[gap_start:].strip():
+        return None
+    return rows
+
+def merge_insert_statements(statements):
+    """Merge runs of single-table INSERT ... VALUES statements into multi-row
+    INSERTs of at most BATCH_INSERT_MAX_ROWS row tuples each"""
+    merged = []
+    prefix_key = None
+    rows_in_batch = 0
+    for query in statements:
+        match = INSERT_VALUES_PATTERN.match(query)
+        rows = split_values_rows(match.group(2)) if match and not INSERT_MERGE_BLOCKERS.search(match.group(2)) else None
+        if not rows:
+            merged.append(query)
+            prefix_key = None
+            continue
+        key = ' '.join(match.group(1).lower().split())
+        for row in rows:
+            if key == prefix_key and rows_in_batch < BATCH_INSERT_MAX_ROWS:
+                merged[-1] += f", {row}"
+                rows_in_batch += 1
+            else:
+                merged.append(f"{match.group(1)} {row}")
+                prefix_key = key
+                rows_in_batch = 1
+    return merged
+
+def execute_streamed(connection, query):
+    """Execute with the dialect's fetch strategy (server-side cursor where it has one)"""
+    return connection.execution_options(**dialect_for_url(connection.engine.url).stream_options()).execute(text(query))
+
+def _run_statement(connection, query):
+    """Execute one statement; SELECTs use a server-side cursor and only
+    RESULT_ROW_CAP rows are fetched, the rest stay on the server for /stream_results"""
+    result = execute_streamed(connection, query)
+    if not result.returns_rows:
+        return None
+    rows = result.fetchmany(RESULT_ROW_CAP + 1)
+    result_set = {
+        'statement': query,
+        'columns': list(result.keys()),
+        'rows': [list(row) for row in rows[:RESULT_ROW_CAP]],
+        'truncated': len(rows) > RESULT_ROW_CAP
     }
+    result.close()
+    return result_set
+
+def _run_read_statement(uri, query):
+    with engine_connect(uri) as connection:
+        return _run_statement(connection, query)
+
+_statement_executor = None
+_statement_executor_pid = None
+_statement_executor_lock = threading.Lock()
 
-def connect_sqlserver(form_data):
-    server = form_data['server']
-    port = form_data.get('port', 1433)
-    database = form_data['database']
-    username = form_data['username']
-    password = form_data['password']
+def get_statement_executor():
+    global _statement_executor, _statement_executor_pid
+    with _statement_executor_lock:
+        if _statement_executor is None or _statement_executor_pid != os.getpid():
+            _statement_executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix='read-statement')
+            _statement_executor_pid = os.getpid()
+        return _statement_executor
 
-    password_encoded = urllib.parse.quote(password)
-    uri = f"mssql+pyodbc://{username}:{password_encoded}@{server}:{port}/{database}?driver=ODBC+Driver+17+for+SQL+Server"
+def plan_statements(sql_query):
+    """How both executors run a query's statements under EXECUTION_MODE.
 
-    engine = create_engine(uri)
-    connection = engine.connect()
-    connection.execute(text('SELECT 1'))
-    connection.close()
+    Returns (plan, statements): 'parallel' for several reads on their own
+    connections, 'transaction' for one transaction with consecutive INSERTs
+    merged, or 'sequential' for a commit after every statement.
+    """
+    statements = split_statements(sql_query)
+    if EXECUTION_MODE != 'batched':
+        return 'sequential', statements
+    if len(statements) > 1 and all(is_read_statement(q) for q in statements):
+        return 'parallel', statements
+    return 'transaction', merge_insert_statements(statements)
 
+def _execution_result(result_sets):
+    """Every result set, with the last one also at the top level"""
+    result_sets = [result_set for result_set in result_sets if result_set]
+    last = result_sets[-1] if result_sets else {'statement': None, 'columns': [], 'rows': [], 'truncated': False}
     return {
-        'success': True,
-        'uri': uri,
-        'database': database,
-        'credentials': {
-            'host': server,
-            'port': int(port),
-            'user': username,
-            'password': password,
-            'database': database
-        }
+        'columns': last['columns'],
+        'rows': last['rows'],
+        'truncated': last['truncated'],
+        'last_select': last['statement'] if last['statement'] and is_read_statement(last['statement']) else None,
+        'result_sets': result_sets
     }
 
-def get_database_schema(db_type, credentials):
-    """Get schema information based on database type"""
-    if db_type == 'mysql':
-        return get_mysql_schema(credentials)
-    elif db_type == 'postgresql':
-        return get_postgresql_schema(credentials)
-    elif db_type == 'sqlite':
-        return get_sqlite_schema(credentials)
-    elif db_type == 'sqlserver':
-        return get_sqlserver_schema(credentials)
+def execute_sql(uri, sql_query):
+    """Run the statements of a generated query and return every result set.
+
+    The last result set is also exposed at the top level (columns, rows,
+    truncated, last_select) for callers that show a single table.
+    """
+    plan, statements = plan_statements(sql_query)
+    if plan == 'parallel':
+        result_sets = list(get_statement_executor().map(lambda query: _run_read_statement(uri, query), statements))
+    elif plan == 'transaction':
+        with engine_connect(uri) as connection:
+            with connection.begin():
+                result_sets = [_run_statement(connection, query) for query in statements]
     else:
-        raise ValueError(f"Unsupported database type: {db_type}")
+        result_sets = []
+        with engine_connect(uri) as connection:
+            for query in statements:
+                result_sets.append(_run_statement(connection, query))
+                connection.commit()
+    return _execution_result(result_sets)
 
-def get_mysql_schema(credentials):
-    connection = pymysql.connect(
-        host=credentials['host'],
-        port=credentials['port'],
-        user=credentials['user'],
-        password=credentials['password'],
-        database=credentials['database'],
-        cursorclass=pymysql.cursors.DictCursor
-    )
+async def _run_statement_async(connection, query):
+    """Async counterpart of _run_statement. Reads are streamed; other
+    statements are buffered, since AsyncResult does not expose returns_rows"""
+    if is_read_statement(query):
+        result = await connection.stream(text(query))
+        rows = await result.fetchmany(RESULT_ROW_CAP + 1)
+        columns = list(result.keys())
+        await result.close()
+    else:
+        result = await connection.execute(text(query))
+        if not result.returns_rows:
+            return None
+        rows = result.fetchmany(RESULT_ROW_CAP + 1)
+        columns = list(result.keys())
+        result.close()
+    return {
+        'statement': query,
+        'columns': columns,
+        'rows': [list(row) for row in rows[:RESULT_ROW_CAP]],
+        'truncated': len(rows) > RESULT_ROW_CAP
+    }
 
-    schema_dict = {}
-    with connection.cursor() as cursor:
-        cursor.execute("SHOW TABLES")
-        table_names = [row[f'Tables_in_{credentials["database"]}'] for row in cursor.fetchall()]
-
-        for table in table_names:
-            cursor.execute(f"SHOW COLUMNS FROM `{table}`")
-            schema_dict[table] = [{
-                "name": col['Field'],
-                "type": col['Type'],
-                "key": col.get('Key')
-            } for col in cursor.fetchall()]
-
-    connection.close()
-    return schema_dict
+async def _run_read_statement_async(uri, query):
+    async with get_async_engine(uri).connect() as connection:
+        return await _run_statement_async(connection, query)
 
-def get_postgresql_schema(credentials):
-    connection = psycopg2.connect(
-        host=credentials['host'],
-        port=credentials['port'],
-        user=credentials['user'],
-        password=credentials['password'],
-        database=credentials['database']
-    )
+async def execute_sql_async(uri, sql_query):
+    """Async counterpart of execute_sql, following the same plan_statements;
+    must run on the background loop"""
+    plan, statements = plan_statements(sql_query)
+    if plan == 'parallel':
+        result_sets = await asyncio.gather(*(_run_read_statement_async(uri, query) for query in statements))
+    else:
+        result_sets = []
+        async with get_async_engine(uri).connect() as connection:
+            if plan == 'transaction':
+                async with connection.begin():
+                    for query in statements:
+                        result_sets.append(await _run_statement_async(connection, query))
+            else:
+                for query in statements:
+                    result_sets.append(await _run_statement_async(connection, query))
+                    await connection.commit()
+    return _execution_result(result_sets)
 
-    schema_dict = {}
-    cursor = connection.cursor()
-
-    # Get table names
-    cursor.execute("""
-        SELECT table_name 
-        FROM information_schema.tables 
-        WHERE table_schema = 'public'
-    """)
-    table_names = [row[0] for row in cursor.fetchall()]
-
-    # Get column information for each table
-    for table in table_names:
-        cursor.execute("""
-            SELECT column_name, data_type, is_nullable, column_default
-            FROM information_schema.columns
-            WHERE table_name = %s AND table_schema = 'public'
-            ORDER BY ordinal_position
-        """, (table,))
-
-        schema_dict[table] = [{
-            "name": col[0],
-            "type": col[1],
-            "nullable": col[2] == 'YES',
-            "default": col[3]
-        } for col in cursor.fetchall()]
-
-    connection.close()
-    return schema_dict
+def check_generated_sql(sql_query, user_role, db_type=None):
+    """Return (http_status, payload) when generated SQL must not run, else None"""
+    if sql_query.startswith("Error:"):
+        return 422, {'status': 'error', 'message': sql_query}
 
-def get_sqlite_schema(credentials):
-    connection = sqlite3.connect(credentials['database_path'])
-    cursor = connection.cursor()
+    # Classify on the parse tree so CTEs and WITH ... DELETE are judged by what they do
+    kinds = sql_statement_kinds(sql_query, db_type)
+    if 'other' in kinds:
+        return 422, {'status': 'error', 'message': 'Invalid SQL query: Query must be a SELECT, INSERT, UPDATE, or DELETE statement'}
 
-    # Get table names
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-    table_names = [row[0] for row in cursor.fetchall()]
+    if user_role == 'user' and any(kind != 'select' for kind in kinds):
+        return 403, {
+            'status': 'error',
+            'message': 'You are not authorized to perform INSERT, UPDATE, or DELETE operations. Only SELECT queries are allowed for users.',
+            'sql_query': sql_query
+        }
+    return None
 
-    schema_dict = {}
-    for table in table_names:
-        cursor.execute(f"PRAGMA table_info({table})")
-        schema_dict[table] = [{
-            "name": col[1],
-            "type": col[2],
-            "nullable": not col[3],
-            "default": col[4],
-            "primary_key": col[5]
-        } for col in cursor.fetchall()]
-
-    connection.close()
-    return schema_dict
+# Pre-execution cost guard settings (opt-in). SELECTs are EXPLAINed first;
+# when the planner's estimate exceeds a threshold the query is rejected, gets
+# a row limit, or is moved to a background job (COST_GUARD_ACTION). A limit
+# changes the answer, so every response that carries one says so.
+COST_GUARD_ENABLED = os.getenv("COST_GUARD_ENABLED", "false").lower() == "true"
+COST_GUARD_MAX_ROWS = float(os.getenv("COST_GUARD_MAX_ROWS", 1000000))
+COST_GUARD_MAX_COST = float(os.getenv("COST_GUARD_MAX_COST", 0))  # planner cost units per dialect; 0 disables
+COST_GUARD_ACTION = os.getenv("COST_GUARD_ACTION", "limit").lower()  # reject, limit or background
+COST_GUARD_LIMIT = int(os.getenv("COST_GUARD_LIMIT", RESULT_ROW_CAP))
 
-def get_sqlserver_schema(credentials):
-    connection_string = f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={credentials['host']},{credentials['port']};DATABASE={credentials['database']};UID={credentials['user']};PWD={credentials['password']}"
-    connection = pyodbc.connect(connection_string)
-    cursor = connection.cursor()
+SHOWPLAN_NAMESPACE = '{http://schemas.microsoft.com/sqlserver/2004/07/showplan}'
+SQLITE_TABLE_ALIAS_PATTERN = re.compile(r'(?:FROM|JOIN|,)\s*[`"\[]?([\w$]+)[`"\]]?(?:\s+(?:AS\s+)?([\w$]+))?', re.IGNORECASE)
 
-    # Get table names
-    cursor.execute("""
-        SELECT TABLE_NAME 
-        FROM INFORMATION_SCHEMA.TABLES 
-        WHERE TABLE_TYPE = 'BASE TABLE'
-    """)
-    table_names = [row[0] for row in cursor.fetchall()]
+def _iter_dicts(value):
+    if isinstance(value, dict):
+        yield value
+        value = list(value.values())
+    if isinstance(value, list):
+        for item in value:
+            yield from _iter_dicts(item)
 
-    schema_dict = {}
-    for table in table_names:
-        cursor.execute("""
-            SELECT COLUMN_NAME, DATA_TYPE, IS_NULLABLE, COLUMN_DEFAULT
-            FROM INFORMATION_SCHEMA.COLUMNS
-            WHERE TABLE_NAME = ?
-            ORDER BY ORDINAL_POSITION
-        """, table)
-
-        schema_dict[table] = [{
-            "name": col[0],
-            "type": col[1],
-            "nullable": col[2] == 'YES',
-            "default": col[3]
-        } for col in cursor.fetchall()]
-
-    connection.close()
-    return schema_dict
+def _explain_postgresql(connection, query):
+    plan = connection.execute(text(f"EXPLAIN (FORMAT JSON) {query}")).scalar()
+    root = (json.loads(plan) if isinstance(plan, str) else plan)[0]['Plan']
+    return {
+        'rows': float(root['Plan Rows']),
+        'cost': float(root['Total Cost']),
+        'full_scans': [node['Relation Name'] for node in _iter_dicts(root) if node.get('Node Type') == 'Seq Scan']
+    }
 
-# Query submission route (protected) with RBAC
-@app.route('/submit_sentence', methods=['POST'])
-@login_required
-def submit_sentence():
-    sentence = request.form['sentence']
-    uri = session.get('uri')
-    db_type = session.get('db_type')
-    db_credentials = session.get('db_credentials')
+def _explain_mysql(connection, query):
+    block = json.loads(connection.execute(text(f"EXPLAIN FORMAT=JSON {query}")).scalar())['query_block']
+    tables = [node for node in _iter_dicts(block) if 'table_name' in node and 'access_type' in node]
+    return {
+        # In a nested loop the last table's rows_produced_per_join is the join's output
+        'rows': max((float(table.get('rows_produced_per_join', table.get('rows_examined_per_scan', 0))) for table in tables), default=0.0),
+        'cost': float(block.get('cost_info', {}).get('query_cost', 0)),
+        'full_scans': [table['table_name'] for table in tables if table['access_type'] == 'ALL']
+    }
 
-    if not uri or not db_credentials or not db_type:
-        user = users_collection.find_one({'_id': ObjectId(session['user_id'])})
-        user_data = {
-            'name': user.get('name', 'User'),
-            'email': user['email'],
-            'role': user.get('role', 'user')
-        } if user else None
-        return render_template('index.html',
-                              status='error',
-                              message='No database connection found. Please connect to a database first.',
-                              user_data=user_data,
-                              db_configs=DB_CONFIGS)
+def _explain_sqlite(connection, query):
+    """EXPLAIN QUERY PLAN has no estimates; full scans are sized with MAX(rowid)
+    and multiplied together, which is what a nested-loop join visits"""
+    aliases = {alias.lower(): table for table, alias in SQLITE_TABLE_ALIAS_PATTERN.findall(query) if alias}
+    rows = 1.0
+    full_scans = []
+    for step in connection.execute(text(f"EXPLAIN QUERY PLAN {query}")).fetchall():
+        match = re.match(r'SCAN (?:TABLE )?([\w$]+)', step[-1])
+        if not match or match.group(1) == 'CONSTANT':
+            continue
+        table = aliases.get(match.group(1).lower(), match.group(1))
+        try:
+            table_rows = connection.execute(text(f'SELECT MAX(rowid) FROM "{table}"')).scalar() or 0
+        except Exception:
+            continue  # CTE, subquery or WITHOUT ROWID table
+        rows *= max(table_rows, 1)
+        full_scans.append(table)
+    return {'rows': rows if full_scans else 1.0, 'cost': None, 'full_scans': full_scans}
 
+def _explain_sqlserver(connection, query):
+    connection.exec_driver_sql("SET SHOWPLAN_XML ON")
     try:
-        # Get user role
-        user = users_collection.find_one({'_id': ObjectId(session['user_id'])})
-        user_role = user.get('role', 'user')
+        plan = ElementTree.fromstring(connection.exec_driver_sql(query).scalar())
+    finally:
+        connection.exec_driver_sql("SET SHOWPLAN_XML OFF")
+    statement = plan.find(f'.//{SHOWPLAN_NAMESPACE}StmtSimple')
+    full_scans = []
+    for operator in plan.iter(f'{SHOWPLAN_NAMESPACE}RelOp'):
+        if operator.get('PhysicalOp') in ('Table Scan', 'Clustered Index Scan', 'Index Scan'):
+            scanned = operator.find(f'.//{SHOWPLAN_NAMESPACE}Object')
+            if scanned is not None:
+                full_scans.append(scanned.get('Table', '').strip('[]'))
+    return {
+        'rows': float(statement.get('StatementEstRows', 0)),
+        'cost': float(statement.get('StatementSubTreeCost', 0)),
+        'full_scans': full_scans
+    }
 
-        # Get database schema
-        schema_dict = get_database_schema(db_type, db_credentials)
+def estimate_query_cost(db_type, uri, sql_query):
+    """Largest estimate over the SELECTs in sql_query, or None when none could be explained"""
+    explain = get_dialect(db_type).explain
+    if explain is None:
+        return None
+    estimates = []
+    with engine_connect(uri) as connection:
+        for query in split_statements(sql_query):
+            if not is_read_statement(query):
+                continue
+            try:
+                estimates.append(explain(connection, query))
+            except Exception as e:
+                logger.warning(f"EXPLAIN failed, skipping cost guard for statement: {str(e)}")
+                connection.rollback()
+    if not estimates:
+        return None
+    costs = [estimate['cost'] for estimate in estimates if estimate['cost'] is not None]
+    return {
+        'rows': max(estimate['rows'] for estimate in estimates),
+        'cost': max(costs) if costs else None,
+        'full_scans': sorted({table for estimate in estimates for table in estimate['full_scans']})
+    }
 
-        # Generate SQL query
-        sql_query = generate_sql_query(schema_dict, sentence, db_type, user_role)
+def add_row_limit(db_type, sql_query, limit):
+    """Cap every SELECT without its own limit, in the dialect's syntax"""
+    adapter = get_dialect(db_type)
+    limited = []
+    for query in split_statements(sql_query):
+        already_limited = re.search(
+            r'\bLIMIT\s+\d+(\s*(,|OFFSET)\s*\d+)?\s*$|\bFETCH\s+(FIRST|NEXT)\b|^\s*SELECT\s+(DISTINCT\s+)?TOP\b',
+            query, re.IGNORECASE
+        )
+        if not re.match(r'^\s*SELECT\b', query, re.IGNORECASE) or already_limited:
+            limited.append(query)
+        else:
+            limited.append(adapter.limit_query(query, limit))
+    return '; '.join(limited)
 
-        # Check if query generation failed
-        if sql_query.startswith("Error:"):
-            user_data = {
-                'name': user.get('name', 'User'),
-                'email': user['email'],
-                'role': user_role
-            }
-            return render_template('index.html',
-                                   status='error',
-                                   message=sql_query,
-                                   connected_db=session.get('database'),
-                                   connected_db_type=DB_CONFIGS[db_type]['name'],
-                                   sentence=sentence,
-                                   user_data=user_data,
-                                   db_configs=DB_CONFIGS)
+def describe_cost_estimate(estimate):
+    description = f"the planner estimates {estimate['rows']:,.0f} rows"
+    if estimate['cost'] is not None:
+        description += f" at cost {estimate['cost']:,.0f}"
+    if estimate['full_scans']:
+        description += f" with full scans of {', '.join(estimate['full_scans'])}"
+    return description
 
-        # Validate SQL query
-        if not re.match(r'^\s*(SELECT|INSERT|UPDATE|DELETE)\b', sql_query, re.IGNORECASE):
-            raise ValueError("Invalid SQL query: Query must start with SELECT, INSERT, UPDATE, or DELETE")
+def cost_guard_notice(estimate):
+    """Tells the user their results were cut by the cost guard"""
+    return f'A limit of {COST_GUARD_LIMIT} rows was added because {describe_cost_estimate(estimate)}.'
 
-        # Enforce RBAC: Block non-SELECT queries for 'user' role
-        if user_role == 'user' and not re.match(r'^\s*SELECT\b', sql_query, re.IGNORECASE):
-            user_data = {
-                'name': user.get('name', 'User'),
-                'email': user['email'],
-                'role': user_role
-            }
-            return render_template('index.html',
-                                   status='error',
-                                   message='You are not authorized to perform INSERT, UPDATE, or DELETE operations. Only SELECT queries are allowed for users.',
-                                   sql_query=sql_query,  # Show generated query
-                                   connected_db=session.get('database'),
-                                   connected_db_type=DB_CONFIGS[db_type]['name'],
-                                   sentence=sentence,
-                                   user_data=user_data,
-                                   db_configs=DB_CONFIGS)
+def apply_cost_guard(db_type, uri, sql_query, user_role=None, in_background=False):
+    """EXPLAIN the generated SQL and decide how to run it.
 
-        # Execute query using SQLAlchemy
-        engine = create_engine(uri)
-        connection = engine.connect()
+    Returns (action, sql_query, estimate) where action is 'run', 'limit'
+    (sql_query now carries a row limit), 'reject' or 'background'. Queries
+    that are already running in a background job are not sent there again.
+    """
+    if not COST_GUARD_ENABLED:
+        return 'run', sql_query, None
+    with timed_stage('explain', db_type, user_role):
+        estimate = estimate_query_cost(db_type, uri, sql_query)
+    if estimate is None:
+        return 'run', sql_query, None
+    over_limit = estimate['rows'] > COST_GUARD_MAX_ROWS or (
+        COST_GUARD_MAX_COST > 0 and estimate['cost'] is not None and estimate['cost'] > COST_GUARD_MAX_COST
+    )
+    if not over_limit or (COST_GUARD_ACTION == 'background' and in_background):
+        return 'run', sql_query, estimate
+    if COST_GUARD_ACTION == 'limit':
+        limited = add_row_limit(db_type, sql_query, COST_GUARD_LIMIT)
+        return ('limit' if limited != sql_query else 'run'), limited, estimate
+    if COST_GUARD_ACTION == 'background':
+        return 'background', sql_query, estimate
+    return 'reject', sql_query, estimate
 
-        queries = [q.strip() for q in sql_query.split(';') if q.strip()]
-        all_results = []
-        last_columns = []
+# Database dialect adapters. The base class covers a networked server reached
+# with host, port, database, username and password; subclasses bind the
+# per-engine queries and hooks defined above and tune their connections.
+class DialectAdapter:
+    """Connecting, introspection, EXPLAIN, cancellation and fetching for one engine"""
 
-        for query in queries:
-            result = connection.execute(text(query))
-            if result.returns_rows:
-                last_columns = list(result.keys())
-                rows = result.fetchall()
-                all_results = [list(row) for row in rows] if rows else []
-            else:
-                connection.commit()
+    db_type = None               # form value and session key
+    name = None
+    icon = 'fas fa-database'
+    backend = None               # SQLAlchemy backend name, e.g. 'mssql' for SQL Server
+    uri_scheme = None            # SQLAlchemy drivername of the pooled sync engine
+    uri_query = ''
+    async_driver = None          # drivername for /api/query; None runs it on a thread
+    sqlglot_dialect = None
+    default_port = None
+    fields = ['server', 'port', 'database', 'username', 'password']
+    prompt_notes = ''
+    schema_query = None          # rows in the shape build_schema_dict expects
+    schema_version_probe = None  # single-row query that changes with the schema
+    set_statement_timeout = None # (dbapi_connection, timeout_ms) setting the session's statement timeout
+    double_quoted_strings = False # "x" is a string literal when no column is named x
+    explain = None               # (connection, query) -> {'rows', 'cost', 'full_scans'}
+    cancel_target = None         # (connection) -> handle that cancel(uri, handle) takes
 
-        connection.close()
+    def config(self):
+        """What the connection form needs to know about the engine"""
+        return {'name': self.name, 'icon': self.icon, 'default_port': self.default_port, 'fields': self.fields}
+
+    def connect(self, form_data):
+        """Build the URI from the connection form and check it through the pool"""
+        server = form_data['server']
+        port = int(form_data.get('port') or self.default_port)
+        database = form_data['database']
+        username = form_data['username']
+        password = form_data['password']
+
+        password_encoded = urllib.parse.quote(password)
+        uri = f"{self.uri_scheme}://{username}:{password_encoded}@{server}:{port}/{database}{self.uri_query}"
+
+        test_connection(uri)
+
+        return {
+            'success': True,
+            'uri': uri,
+            'database': database,
+            'credentials': {
+                'host': server,
+                'port': port,
+                'user': username,
+                'password': password,
+                'database': database
+            }
+        }
+
+    def engine_options(self, url):
+        """create_engine/create_async_engine keyword arguments for a URL"""
+        return _pool_options()
+
+    def create_engine(self, url):
+        return create_engine(url, **self.engine_options(url))
+
+    def install_hooks(self, engine, asynchronous=False):
+        """Attach per-connection listeners; asynchronous is set for the sync_engine of an async engine"""
+        if STATEMENT_TIMEOUT_MS and self.set_statement_timeout is not None:
+            @event.listens_for(engine, 'connect')
+            def set_statement_timeout(dbapi_connection, connection_record):
+                self.set_statement_timeout(dbapi_connection, STATEMENT_TIMEOUT_MS)
+        return engine
+
+    def schema_cache_key(self, credentials):
+        return (self.db_type, credentials['host'].lower(), credentials['port'], credentials['database'])
+
+    def introspect(self, uri):
+        """The whole schema in one round trip on a pooled connection"""
+        with engine_connect(uri) as connection:
+            return build_schema_dict(connection.exec_driver_sql(self.schema_query).fetchall())
+
+    def stream_options(self):
+        """Execution options for reads whose rows are fetched in batches. yield_per
+        implies stream_results: a named cursor on psycopg2, an unbuffered SSCursor
+        on pymysql, plain fetchmany where the driver has neither"""
+        return {'yield_per': STREAM_BATCH_SIZE}
+
+    def limit_query(self, query, limit):
+        return f"{query} LIMIT {limit}"
+
+    def cancel(self, uri, handle):
+        pass
+
+def _kill_server_session(statement, uri, session_id):
+    with engine_connect(uri) as connection:
+        connection.execute(text(statement.format(int(session_id))))
+
+class FileDialectAdapter(DialectAdapter):
+    """An embedded engine opened from a path on the server"""
+
+    icon = 'fas fa-file-alt'
+    fields = ['database_path']
+    path_hint = '/path/to/your/database'
+
+    def config(self):
+        return {**super().config(), 'path_hint': self.path_hint}
+
+    def connect(self, form_data):
+        database_path = form_data['database_path']
+
+        uri = f"{self.uri_scheme}:///{database_path}"
+
+        test_connection(uri)
+
+        return {
+            'success': True,
+            'uri': uri,
+            'database': database_path.split('/')[-1],
+            'credentials': {
+                'database_path': database_path
+            }
+        }
+
+    def schema_cache_key(self, credentials):
+        return (self.db_type, None, None, credentials['database_path'])
+
+class MySQLDialect(DialectAdapter):
+    db_type = 'mysql'
+    name = 'MySQL'
+    backend = 'mysql'
+    uri_scheme = 'mysql+pymysql'
+    async_driver = 'mysql+aiomysql'
+    sqlglot_dialect = 'mysql'
+    default_port = 3306
+    prompt_notes = "Use MySQL syntax. Enclose table and column names with backticks (`) only if they contain special characters or are reserved keywords (e.g., `table_name`.`column_name`). Avoid backticks for standard identifiers."
+    schema_query = MYSQL_SCHEMA_QUERY
+    schema_version_probe = """
+        SELECT COUNT(*), MAX(CREATE_TIME),
+               (SELECT COUNT(*) FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE())
+        FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE()
+    """
+    set_statement_timeout = staticmethod(_set_mysql_timeout)
+    explain = staticmethod(_explain_mysql)
+
+    def cancel_target(self, connection):
+        return connection.connection.dbapi_connection.thread_id()
+
+    def cancel(self, uri, thread_id):
+        _kill_server_session("KILL QUERY {}", uri, thread_id)
+
+class PostgreSQLDialect(DialectAdapter):
+    db_type = 'postgresql'
+    name = 'PostgreSQL'
+    icon = 'fas fa-elephant'
+    backend = 'postgresql'
+    uri_scheme = 'postgresql'
+    async_driver = 'postgresql+asyncpg'
+    sqlglot_dialect = 'postgres'
+    default_port = 5432
+    prompt_notes = "Use PostgreSQL syntax. Enclose table and column names with double quotes (\"`) only if they contain special characters or are reserved keywords (e.g., \"table_name\".\"column_name\"). Avoid quotes for standard identifiers."
+    schema_query = POSTGRESQL_SCHEMA_QUERY
+    # PostgreSQL keeps no DDL timestamp, so the catalog row versions (xmin) of
+    # the public relations, their columns and their constraints are hashed
+    # instead. Renaming a column or changing its type only rewrites its
+    # pg_attribute row, and a new foreign key only adds a pg_constraint row.
+    schema_version_probe = """
+        SELECT COUNT(*), md5(string_agg(version, ',' ORDER BY version))
+        FROM (
+            SELECT 'r' || c.oid::text || ':' || c.xmin::text AS version
+            FROM pg_catalog.pg_class c
+            JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p', 'v', 'm')
+            UNION ALL
+            SELECT 'a' || a.attrelid::text || '.' || a.attnum::text || ':' || a.xmin::text
+            FROM pg_catalog.pg_attribute a
+            JOIN pg_catalog.pg_class c ON c.oid = a.attrelid
+            JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p', 'v', 'm') AND a.attnum > 0 AND NOT a.attisdropped
+            UNION ALL
+            SELECT 'c' || con.oid::text || ':' || con.xmin::text
+            FROM pg_catalog.pg_constraint con
+            JOIN pg_catalog.pg_namespace n ON n.oid = con.connamespace
+            WHERE n.nspname = 'public'
+        ) versions
+    """
+    set_statement_timeout = staticmethod(_set_postgresql_timeout)
+    explain = staticmethod(_explain_postgresql)
+
+    def engine_options(self, url):
+        options = super().engine_options(url)
+        # The timeout travels in the startup packet instead of a SET per new connection
+        if STATEMENT_TIMEOUT_MS and url.get_driver_name() == 'asyncpg':
+            options['connect_args'] = {'server_settings': {'statement_timeout': str(STATEMENT_TIMEOUT_MS)}}
+        elif STATEMENT_TIMEOUT_MS:
+            options['connect_args'] = {'options': f"-c statement_timeout={STATEMENT_TIMEOUT_MS}"}
+        return options
+
+    def install_hooks(self, engine, asynchronous=False):
+        # STATEMENT_TIMEOUT_MS already travels in the startup packet
+        return engine
+
+    def cancel_target(self, connection):
+        return connection.connection.dbapi_connection
+
+    def cancel(self, uri, dbapi_connection):
+        dbapi_connection.cancel()
+
+class SQLiteDialect(FileDialectAdapter):
+    db_type = 'sqlite'
+    name = 'SQLite'
+    backend = 'sqlite'
+    uri_scheme = 'sqlite'
+    async_driver = 'sqlite+aiosqlite'
+    sqlglot_dialect = 'sqlite'
+    path_hint = '/path/to/your/database.db'
+    prompt_notes = "Use SQLite syntax. Use simple, standard SQL without unnecessary escaping. Avoid enclosing identifiers unless absolutely required."
+    schema_query = SQLITE_SCHEMA_QUERY
+    schema_version_probe = "PRAGMA schema_version"
+    double_quoted_strings = True
+    explain = staticmethod(_explain_sqlite)
+
+    def engine_options(self, url):
+        options = super().engine_options(url)
+        # In-memory SQLite uses a singleton pool that takes no sizing arguments
+        if url.database in (None, '', ':memory:'):
+            for option in ('pool_size', 'max_overflow', 'pool_timeout'):
+                options.pop(option)
+        return options
+
+    def install_hooks(self, engine, asynchronous=False):
+        journal_mode = SQLITE_JOURNAL_MODE if sqlite_file_writable(engine.url) else ''
+
+        @event.listens_for(engine, 'connect')
+        def set_pragmas(dbapi_connection, connection_record):
+            _set_sqlite_pragmas(dbapi_connection, journal_mode)
+
+        # aiosqlite's adapter has no progress handler to enforce the timeout with
+        if (STATEMENT_TIMEOUT_MS or JOB_STATEMENT_TIMEOUT_MS) and not asynchronous:
+            event.listen(engine, 'connect', _set_sqlite_timeout)
+            event.listen(engine, 'before_cursor_execute', _start_sqlite_deadline)
+            event.listen(engine, 'checkin', _clear_sqlite_deadline)
+        return engine
+
+    def cancel_target(self, connection):
+        return connection.connection.dbapi_connection
+
+    def cancel(self, uri, dbapi_connection):
+        dbapi_connection.interrupt()
+
+class SQLServerDialect(DialectAdapter):
+    db_type = 'sqlserver'
+    name = 'SQL Server'
+    icon = 'fas fa-server'
+    backend = 'mssql'
+    uri_scheme = 'mssql+pyodbc'
+    uri_query = '?driver=ODBC+Driver+17+for+SQL+Server'
+    async_driver = 'mssql+aioodbc'
+    sqlglot_dialect = 'tsql'
+    default_port = 1433
+    prompt_notes = "Use SQL Server syntax. Enclose table and column names with square brackets ([]) only if they contain special characters or are reserved keywords (e.g., [table_name].[column_name]). Avoid brackets for standard identifiers."
+    schema_query = SQLSERVER_SCHEMA_QUERY
+    schema_version_probe = """
+        SELECT COUNT(*), MAX(modify_date)
+        FROM sys.objects
+        WHERE type IN ('U', 'V')
+    """
+    set_statement_timeout = staticmethod(_set_sqlserver_timeout)
+    explain = staticmethod(_explain_sqlserver)
+
+    def engine_options(self, url):
+        options = super().engine_options(url)
+        # Parameter arrays in one round trip for executemany (bulk INSERT ... VALUES)
+        if url.get_driver_name() == 'pyodbc':
+            options['fast_executemany'] = True
+        return options
+
+    def limit_query(self, query, limit):
+        return re.sub(r'^\s*SELECT(\s+DISTINCT)?\b', rf'SELECT\1 TOP ({limit})', query, count=1, flags=re.IGNORECASE)
+
+    def cancel_target(self, connection):
+        return connection.execute(text("SELECT @@SPID")).scalar()
+
+    def cancel(self, uri, session_id):
+        _kill_server_session("KILL {}", uri, session_id)
+
+_generic_dialect = DialectAdapter()
+
+register_dialect(MySQLDialect())
+register_dialect(PostgreSQLDialect())
+register_dialect(SQLiteDialect())
+register_dialect(SQLServerDialect())
+
+def load_dialect_plugins():
+    for module_name in DIALECT_PLUGINS:
+        try:
+            importlib.import_module(module_name).register_dialects(sys.modules[__name__])
+        except Exception as e:
+            logger.error(f"Failed to load dialect plugin {module_name}: {str(e)}")
+
+load_dialect_plugins()
+
+async def answer_question_async(sentence, db_type, uri, credentials, user_role, user_id=None):
+    """Schema lookup, SQL generation, RBAC check and execution for one question.
+
+    Returns (status, payload) where status is an HTTP status code.
+    """
+    loop = asyncio.get_running_loop()
+    # Schema introspection uses the blocking drivers; cache hits return immediately
+    started = time.perf_counter()
+    schema_dict = await loop.run_in_executor(None, get_cached_schema, db_type, uri, credentials)
+    record_stage('schema', time.perf_counter() - started, db_type, user_role)
+
+    sql_query = await generate_sql_query_async(schema_dict, sentence, db_type, user_role)
+    rejection = check_generated_sql(sql_query, user_role, db_type)
+    if rejection:
+        return rejection
+
+    guard_action, sql_query, estimate = await loop.run_in_executor(None, apply_cost_guard, db_type, uri, sql_query, user_role)
+    if guard_action == 'reject':
+        return 422, {'status': 'error', 'message': f'Query rejected: {describe_cost_estimate(estimate)}.', 'sql_query': sql_query}
+    if guard_action == 'background':
+        job = submit_question_job(user_id, sentence, db_type, uri, credentials, user_role, sql_query=sql_query)
+        return 202, {'status': 'queued', 'message': f'Moved to a background job: {describe_cost_estimate(estimate)}.', 'job': job}
+
+    started = time.perf_counter()
+    read_only = is_select_only(sql_query)
+    execution = result_cache.get(uri, sql_query) if result_cache is not None and read_only else None
+    if execution is None:
+        if get_dialect(db_type).async_driver:
+            execution = await execute_sql_async(uri, sql_query)
+        else:
+            # Dialects without an async driver run the blocking path on a thread
+            execution = await loop.run_in_executor(None, execute_sql, uri, sql_query)
+        store_cached_results(uri, sql_query, execution, read_only)
+    record_stage('execute', time.perf_counter() - started, db_type, user_role)
+    metrics.observe('querywhisper_result_rows', len(execution['rows']), db_type=db_type, role=user_role)
+    if guard_action == 'run':
+        await loop.run_in_executor(None, few_shot_store.add, schema_dict, db_type, sentence, sql_query)
+    message = 'Query executed successfully.'
+    if guard_action == 'limit':
+        message += ' ' + cost_guard_notice(estimate)
+    return 200, {
+        'status': 'success',
+        'message': message,
+        'sql_query': sql_query,
+        'columns': execution['columns'],
+        'rows': execution['rows'],
+        'truncated': execution['truncated']
+    }
+
+# Async JSON query route (protected). The LLM call and query execution run on
+# the worker's background event loop, so a waiting request holds no database
+# connection or HTTP client thread of its own.
+@app.route('/api/query', methods=['POST'])
+@login_required
+async def query_api():
+    payload = request.get_json(silent=True) or request.form
+    sentence = payload.get('sentence')
+    uri, db_type, db_credentials = get_connection_details()
+
+    if not sentence:
+        return jsonify({'status': 'error', 'message': 'A sentence is required.'}), 400
+    if not uri or not db_credentials or not db_type:
+        return jsonify({'status': 'error', 'message': 'No database connection found. Please connect to a database first.'}), 409
+
+    user_data = get_current_user()
+    user_role = user_data['role'] if user_data else 'user'
+
+    try:
+        future = run_async(answer_question_async(sentence, db_type, uri, db_credentials, user_role, session['user_id']))
+        status, body = await asyncio.wrap_future(future)
+        if 'job' in body:
+            body = {**job_links(body.pop('job')), **body}
+    except Exception as e:
+        logger.error(f"Error in query_api: {str(e)}")
+        return jsonify({'status': 'error', 'message': f'Error processing query: {str(e)}'}), 500
+    return jsonify(body), status
+
+# Batch settings: questions per request and concurrent LLM calls per batch
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", 50))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 4))
+
+def _elapsed_ms(started):
+    return round((time.perf_counter() - started) * 1000, 1)
+
+def prepare_batch_question(sentence, schema_dict, db_type, uri, user_role):
+    """Generate, check and cost-guard one question of a batch; returns its result
+    entry, which carries the error if any step failed"""
+    entry = {'question': sentence, 'timings': {}}
+    try:
+        started = time.perf_counter()
+        sql_query = generate_sql_query(schema_dict, sentence, db_type, user_role)
+        entry['timings']['generate_ms'] = _elapsed_ms(started)
+        if sql_query.startswith("Error"):
+            entry.update(status='error', message=sql_query)
+            return entry
+        rejection = check_generated_sql(sql_query, user_role, db_type)
+        if rejection:
+            entry.update(rejection[1])
+            return entry
+
+        started = time.perf_counter()
+        guard_action, sql_query, estimate = apply_cost_guard(db_type, uri, sql_query, user_role)
+        entry['timings']['explain_ms'] = _elapsed_ms(started)
+        entry.update(sql_query=sql_query, guard_action=guard_action, estimate=estimate)
+        if guard_action == 'reject':
+            entry.update(status='error', message=f'Query rejected: {describe_cost_estimate(estimate)}.')
+    except Exception as e:
+        logger.error(f"Error in batch question: {str(e)}")
+        entry.update(status='error', message=f'Error processing question: {str(e)}')
+    return entry
+
+def execute_batch_question(entry, uri, db_type, user_role):
+    started = time.perf_counter()
+    try:
+        execution = execute_sql_cached(uri, entry['sql_query'])
+    except Exception as e:
+        entry.update(status='error', message=f'Error executing query: {str(e)}')
+    else:
+        metrics.observe('querywhisper_result_rows', len(execution['rows']), db_type=db_type, role=user_role)
+        entry.update(status='success', columns=execution['columns'], rows=execution['rows'], truncated=execution['truncated'])
+    entry['timings']['execute_ms'] = _elapsed_ms(started)
+    record_stage('execute', time.perf_counter() - started, db_type, user_role)
+
+def answer_question_batch(sentences, db_type, uri, credentials, user_role, user_id):
+    """Answer several questions against one connection.
+
+    The schema is fetched and rendered once, SQL is generated for up to
+    BATCH_CONCURRENCY questions at a time, SELECTs then run in parallel and
+    writes run one after another in question order. Both phases use the
+    batch's own threads: execute_sql fans out on the shared statement
+    executor, which would deadlock if the batch held all of its threads.
+    A question that fails carries its error in its own entry.
+    """
+    started = time.perf_counter()
+    with timed_stage('schema', db_type, user_role):
+        schema_dict = get_cached_schema(db_type, uri, credentials)
+        render_full_schema(schema_dict)
+    schema_ms = _elapsed_ms(started)
+
+    with ThreadPoolExecutor(max_workers=max(1, BATCH_CONCURRENCY), thread_name_prefix='batch') as pool:
+        entries = list(pool.map(lambda sentence: prepare_batch_question(sentence, schema_dict, db_type, uri, user_role), sentences))
+
+        runnable = [entry for entry in entries if 'status' not in entry]
+        for entry in runnable:
+            if entry['guard_action'] == 'background':
+                try:
+                    job = submit_question_job(user_id, entry['question'], db_type, uri, credentials, user_role, sql_query=entry['sql_query'])
+                except Exception as e:
+                    logger.error(f"Error queueing batch question: {str(e)}")
+                    entry.update(status='error', message=f'Error queueing background job: {str(e)}')
+                    continue
+                entry.update(job_links(job), status='queued',
+                             message=f'Moved to a background job: {describe_cost_estimate(entry["estimate"])}.')
+        pending = [entry for entry in runnable if 'status' not in entry]
+        reads = [entry for entry in pending if is_select_only(entry['sql_query'])]
+        writes = [entry for entry in pending if not is_select_only(entry['sql_query'])]
+        list(pool.map(lambda entry: execute_batch_question(entry, uri, db_type, user_role), reads))
+    for entry in writes:
+        execute_batch_question(entry, uri, db_type, user_role)
+
+    for entry in entries:
+        if entry['status'] == 'success' and entry.get('guard_action') == 'run':
+            few_shot_store.add(schema_dict, db_type, entry['question'], entry['sql_query'])
+        if entry['status'] == 'success' and entry.get('guard_action') == 'limit':
+            entry['message'] = cost_guard_notice(entry['estimate'])
+        entry.pop('guard_action', None)
+        entry.pop('estimate', None)
+    return {
+        'status': 'success',
+        'questions': len(entries),
+        'succeeded': sum(entry['status'] == 'success' for entry in entries),
+        'timings': {'schema_ms': schema_ms, 'total_ms': _elapsed_ms(started)},
+        'results': entries
+    }
+
+# Batch JSON route (protected): {"questions": [...]} answered against the
+# session's connection in one request
+@app.route('/submit_batch', methods=['POST'])
+@login_required
+def submit_batch():
+    payload = request.get_json(silent=True) or {}
+    sentences = payload.get('questions')
+    uri, db_type, db_credentials = get_connection_details()
+
+    if not isinstance(sentences, list) or not sentences or not all(isinstance(sentence, str) and sentence.strip() for sentence in sentences):
+        return jsonify({'status': 'error', 'message': 'questions must be a non-empty list of strings.'}), 400
+    if len(sentences) > BATCH_MAX_QUESTIONS:
+        return jsonify({'status': 'error', 'message': f'At most {BATCH_MAX_QUESTIONS} questions per batch.'}), 413
+    if not uri or not db_credentials or not db_type:
+        return jsonify({'status': 'error', 'message': 'No database connection found. Please connect to a database first.'}), 409
+
+    user_data = get_current_user()
+    user_role = user_data['role'] if user_data else 'user'
+    set_metric_labels(db_type=db_type, role=user_role)
+    try:
+        body = answer_question_batch(sentences, db_type, uri, db_credentials, user_role, session['user_id'])
+    except Exception as e:
+        logger.error(f"Error in submit_batch: {str(e)}")
+        return jsonify({'status': 'error', 'message': f'Error processing batch: {str(e)}'}), 500
+    return compressed_json(body)
+
+# Background job settings
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 4))
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", 3600))
+JOB_FINISHED_STATES = ('succeeded', 'failed', 'cancelled')
+# Jobs run in the worker process that accepted them. With JOB_STORE=mongodb
+# their status, events and result are mirrored to MongoDB so /jobs requests
+# can reach any gunicorn worker, and a cancel posted to another worker is
+# picked up by the running one within JOB_POLL_INTERVAL seconds. With memory
+# they are only reachable through the accepting worker.
+JOB_STORE = os.getenv("JOB_STORE", "mongodb").lower()  # mongodb or memory
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 0.5))
+
+if JOB_STORE == 'memory' and WEB_CONCURRENCY > 1:
+    raise RuntimeError(f"JOB_STORE=memory needs a single worker, but WEB_CONCURRENCY={WEB_CONCURRENCY}. "
+                       f"Use JOB_STORE=mongodb, or WEB_CONCURRENCY=1.")
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+_job_executor = None
+_job_executor_pid = None
+_job_watcher_pid = None
+_job_indexes_ready = False
+
+class JobCancelled(Exception):
+    pass
+
+def get_job_collection():
+    global _job_indexes_ready
+    collection = get_mongo_db()['jobs']
+    if not _job_indexes_ready:
+        collection.create_index('updated_at', expireAfterSeconds=JOB_RETENTION_SECONDS)
+        _job_indexes_ready = True
+    return collection
+
+def get_job_executor():
+    global _job_executor, _job_executor_pid
+    with _jobs_lock:
+        if _job_executor is None or _job_executor_pid != os.getpid():
+            _job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='query-job')
+            _job_executor_pid = os.getpid()
+        return _job_executor
+
+def start_job_cancel_watcher():
+    """One watcher thread per worker process"""
+    global _job_watcher_pid
+    with _jobs_lock:
+        if _job_watcher_pid == os.getpid():
+            return
+        _job_watcher_pid = os.getpid()
+    threading.Thread(target=_watch_job_cancels, name='job-cancel-watcher', daemon=True).start()
+
+def _watch_job_cancels():
+    """Cancel this worker's running jobs once another worker flags them in MongoDB"""
+    while True:
+        time.sleep(JOB_POLL_INTERVAL)
+        with _jobs_lock:
+            running = {job_id: job for job_id, job in _jobs.items()
+                       if job['status'] not in JOB_FINISHED_STATES and not job['cancel_event'].is_set()}
+        if not running:
+            continue
+        try:
+            flagged = list(get_job_collection().find({'_id': {'$in': list(running)}, 'cancel_requested': True}, {'_id': 1}))
+        except PyMongoError as e:
+            logger.error(f"Could not check for cancelled jobs: {str(e)}")
+            continue
+        for record in flagged:
+            cancel_job(running[record['_id']])
+
+def _store_job_update(job, job_event=None, **fields):
+    """Mirror a job change to MongoDB for the other workers"""
+    if JOB_STORE != 'mongodb':
+        return
+    update = {'$set': {**fields, 'updated_at': datetime.utcnow()}}
+    if job_event is not None:
+        update['$push'] = {'events': job_event}
+    try:
+        get_job_collection().update_one({'_id': job['id']}, update)
+    except PyMongoError as e:
+        logger.error(f"Could not store job {job['id']}: {str(e)}")
+
+def publish_job_event(job, stage, **detail):
+    job_event = {'stage': stage, 'at': time.time(), **detail}
+    with job['condition']:
+        job['stage'] = stage
+        job['events'].append(job_event)
+        job['condition'].notify_all()
+    _store_job_update(job, job_event, stage=stage)
+
+def set_job_status(job, status):
+    with job['condition']:
+        job['status'] = status
+    _store_job_update(job, status=status)
+
+def finish_job(job, status, **fields):
+    with job['condition']:
+        job['status'] = status
+        job['finished_at'] = time.time()
+        job['cancel_target'] = None
+        job.update(fields)
+        job_event = {'stage': status, 'at': job['finished_at']}
+        job['events'].append(job_event)
+        job['condition'].notify_all()
+    if 'result' in fields:
+        # Rows may hold decimals and dates that BSON cannot store
+        fields['result'] = orjson.dumps(fields['result'], default=str)
+    _store_job_update(job, job_event, status=status, finished_at=job['finished_at'], **fields)
+
+def job_snapshot(job):
+    with job['condition']:
+        snapshot = {key: job[key] for key in ('id', 'status', 'stage', 'sql_query', 'error', 'created_at', 'finished_at')}
+        snapshot['events'] = list(job['events'])
+        if job['status'] == 'succeeded':
+            snapshot['result'] = job['result']
+        return snapshot
+
+def _stored_job_snapshot(record):
+    snapshot = {'id': record['_id']}
+    snapshot.update({key: record.get(key) for key in ('status', 'stage', 'sql_query', 'error', 'created_at', 'finished_at')})
+    snapshot['events'] = record['events']
+    if record['status'] == 'succeeded':
+        snapshot['result'] = orjson.loads(record['result'])
+    return snapshot
+
+def _local_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+def load_job_snapshot(job_id, user_id):
+    """The job's snapshot for its owner, from this worker or the job store; None if unknown"""
+    job = _local_job(job_id)
+    if job is not None:
+        return job_snapshot(job) if job['user_id'] == user_id else None
+    if JOB_STORE != 'mongodb':
+        return None
+    record = get_job_collection().find_one({'_id': job_id, 'user_id': user_id})
+    return _stored_job_snapshot(record) if record else None
+
+def wait_for_job_snapshot(job_id, user_id, seen_events, timeout):
+    """The job's snapshot once it has more than seen_events events or has
+    finished, or after timeout. A job running elsewhere is polled in MongoDB."""
+    job = _local_job(job_id)
+    if job is not None:
+        with job['condition']:
+            if len(job['events']) <= seen_events and job['status'] not in JOB_FINISHED_STATES:
+                job['condition'].wait(timeout=timeout)
+        return job_snapshot(job)
+    deadline = time.monotonic() + timeout
+    while True:
+        snapshot = load_job_snapshot(job_id, user_id)
+        if (snapshot is None or len(snapshot['events']) > seen_events
+                or snapshot['status'] in JOB_FINISHED_STATES or time.monotonic() >= deadline):
+            return snapshot
+        time.sleep(JOB_POLL_INTERVAL)
+
+def _check_cancelled(job):
+    if job['cancel_event'].is_set():
+        raise JobCancelled()
+
+def run_question_job(job, sentence, db_type, uri, credentials, user_role, sql_query=None):
+    """Generate and execute one question in the background, publishing each stage.
+
+    sql_query is set when the foreground request already generated the SQL
+    and handed it over, e.g. because the cost guard judged it too expensive.
+    """
+    set_job_status(job, 'running')
+    schema_dict = None
+    try:
+        if sql_query is None:
+            publish_job_event(job, 'schema')
+            with timed_stage('schema', db_type, user_role):
+                schema_dict = get_cached_schema(db_type, uri, credentials)
+            _check_cancelled(job)
+
+            publish_job_event(job, 'llm')
+            sql_query = generate_sql_query(schema_dict, sentence, db_type, user_role)
+            _check_cancelled(job)
+        rejection = check_generated_sql(sql_query, user_role, db_type)
+        if rejection:
+            finish_job(job, 'failed', error=rejection[1]['message'], sql_query=rejection[1].get('sql_query'))
+            return
+
+        publish_job_event(job, 'explain')
+        guard_action, sql_query, estimate = apply_cost_guard(db_type, uri, sql_query, user_role, in_background=True)
+        if guard_action == 'reject':
+            finish_job(job, 'failed', error=f'Query rejected: {describe_cost_estimate(estimate)}.', sql_query=sql_query)
+            return
+        if guard_action == 'limit':
+            publish_job_event(job, 'limit', message=cost_guard_notice(estimate))
+        job['sql_query'] = sql_query
+        _store_job_update(job, sql_query=sql_query)
+
+        publish_job_event(job, 'execute')
+        adapter = get_dialect(db_type)
+        result_set = {'columns': [], 'rows': [], 'truncated': False}
+        execute_started = time.perf_counter()
+        with engine_connect(uri) as connection:
+            override_statement_timeout(connection, JOB_STATEMENT_TIMEOUT_MS)
+            for query in split_statements(sql_query):
+                _check_cancelled(job)
+                if adapter.cancel_target is not None:
+                    job['cancel_target'] = (adapter.cancel, adapter.cancel_target(connection))
+                result = execute_streamed(connection, query)
+                if not result.returns_rows:
+                    connection.commit()
+                    continue
+
+                rows = []
+                streamed = 0
+                for batch in result.partitions(STREAM_BATCH_SIZE):
+                    _check_cancelled(job)
+                    streamed += len(batch)
+                    rows.extend(list(row) for row in batch[:RESULT_ROW_CAP - len(rows)])
+                    publish_job_event(job, 'rows', rows_streamed=streamed)
+                    if streamed > RESULT_ROW_CAP:
+                        break
+                result.close()
+                result_set = {'columns': list(result.keys()), 'rows': rows, 'truncated': streamed > RESULT_ROW_CAP}
+
+        record_stage('execute', time.perf_counter() - execute_started, db_type, user_role)
+        if not is_select_only(sql_query):
+            store_cached_results(uri, sql_query, None, False)
+        metrics.observe('querywhisper_result_rows', len(result_set['rows']), db_type=db_type, role=user_role)
+        _check_cancelled(job)
+        if schema_dict is not None and guard_action == 'run':
+            few_shot_store.add(schema_dict, db_type, sentence, sql_query)
+        finish_job(job, 'succeeded', result=result_set)
+
+    except JobCancelled:
+        finish_job(job, 'cancelled')
+    except Exception as e:
+        if job['cancel_event'].is_set():
+            finish_job(job, 'cancelled')
+        else:
+            logger.error(f"Error in background job {job['id']}: {str(e)}")
+            finish_job(job, 'failed', error=f'Error processing query: {str(e)}')
+
+def submit_question_job(user_id, sentence, db_type, uri, credentials, user_role, sql_query=None):
+    now = time.time()
+    job = {
+        'id': uuid.uuid4().hex,
+        'user_id': user_id,
+        'status': 'queued',
+        'stage': 'queued',
+        'sql_query': None,
+        'error': None,
+        'result': None,
+        'created_at': now,
+        'finished_at': None,
+        'events': [{'stage': 'queued', 'at': now}],
+        'condition': threading.Condition(),
+        'cancel_event': threading.Event(),
+        'cancel_target': None,
+        'uri': uri
+    }
+    if JOB_STORE == 'mongodb':
+        stored = {key: job[key] for key in ('user_id', 'status', 'stage', 'sql_query', 'error', 'result', 'created_at', 'finished_at', 'events')}
+        get_job_collection().insert_one({'_id': job['id'], **stored, 'cancel_requested': False, 'updated_at': datetime.utcnow()})
+        start_job_cancel_watcher()
+    with _jobs_lock:
+        for job_id, old_job in list(_jobs.items()):
+            if old_job['finished_at'] and now - old_job['finished_at'] > JOB_RETENTION_SECONDS:
+                del _jobs[job_id]
+        _jobs[job['id']] = job
+    get_job_executor().submit(run_question_job, job, sentence, db_type, uri, credentials, user_role, sql_query)
+    return job
+
+def job_links(job):
+    return {
+        'job_id': job['id'],
+        'status': job['status'],
+        'status_url': url_for('job_status', job_id=job['id']),
+        'events_url': url_for('job_events', job_id=job['id']),
+        'cancel_url': url_for('job_cancel', job_id=job['id'])
+    }
+
+def cancel_job(job):
+    """Flag the job and cancel its running statement on the database side"""
+    job['cancel_event'].set()
+    target = job['cancel_target']
+    if target:
+        cancel, handle = target
+        try:
+            cancel(job['uri'], handle)
+        except Exception as e:
+            logger.warning(f"Database-side cancel failed for job {job['id']}: {str(e)}")
+
+def request_job_cancel(job_id, user_id):
+    """Cancel a job for its owner and return its status, or None if unknown.
+    A job running in another worker is flagged in MongoDB for that worker."""
+    job = _local_job(job_id)
+    if job is not None:
+        if job['user_id'] != user_id:
+            return None
+        if job['status'] not in JOB_FINISHED_STATES:
+            cancel_job(job)
+        return job['status']
+    if JOB_STORE != 'mongodb':
+        return None
+    record = get_job_collection().find_one_and_update(
+        {'_id': job_id, 'user_id': user_id}, {'$set': {'cancel_requested': True}}, projection={'status': 1}
+    )
+    return record['status'] if record else None
+
+# Job status route (protected)
+@app.route('/jobs/<job_id>')
+@login_required
+def job_status(job_id):
+    snapshot = load_job_snapshot(job_id, session['user_id'])
+    if snapshot is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(snapshot)
+
+# Job progress route (protected): Server-Sent Events, one per stage, ending
+# with the final job snapshot
+@app.route('/jobs/<job_id>/events')
+@login_required
+def job_events(job_id):
+    user_id = session['user_id']
+    if load_job_snapshot(job_id, user_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    def event_stream():
+        sent = 0
+        while True:
+            snapshot = wait_for_job_snapshot(job_id, user_id, sent, timeout=15)
+            if snapshot is None:
+                return
+            events = snapshot['events'][sent:]
+            finished = snapshot['status'] in JOB_FINISHED_STATES
+            sent += len(events)
+            if not events and not finished:
+                yield ': keep-alive\n\n'
+            for job_event in events:
+                yield f"event: {job_event['stage']}\ndata: {json.dumps(job_event, default=str)}\n\n"
+            if finished:
+                yield f"event: result\ndata: {json.dumps(snapshot, default=str)}\n\n"
+                return
+
+    response = Response(stream_with_context(event_stream()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# Job cancellation route (protected)
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+@login_required
+def job_cancel(job_id):
+    status = request_job_cancel(job_id, session['user_id'])
+    if status is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({'id': job_id, 'status': status, 'cancel_requested': True})
+
+# Query submission route (protected) with RBAC
+@app.route('/submit_sentence', methods=['POST'])
+@login_required
+def submit_sentence():
+    sentence = request.form['sentence']
+    uri, db_type, db_credentials = get_connection_details()
+
+    # background=1 queues the question and returns a job id immediately
+    if request.form.get('background') == '1':
+        if not uri or not db_credentials or not db_type:
+            return jsonify({'status': 'error', 'message': 'No database connection found. Please connect to a database first.'}), 409
+        user_data = get_current_user()
+        user_role = user_data['role'] if user_data else 'user'
+        job = submit_question_job(session['user_id'], sentence, db_type, uri, db_credentials, user_role)
+        return jsonify(job_links(job)), 202
+
+    user_data = get_current_user()
+    if not uri or not db_credentials or not db_type:
+        return render_template('index.html',
+                              status='error',
+                              message='No database connection found. Please connect to a database first.',
+                              user_data=user_data,
+                              db_configs=DB_CONFIGS)
+
+    try:
+        # Get user role
+        user_role = user_data['role'] if user_data else 'user'
+        set_metric_labels(db_type=db_type, role=user_role)
+
+        # Get database schema
+        with timed_stage('schema'):
+            schema_dict = get_cached_schema(db_type, uri, db_credentials)
+
+        # Generate SQL query
+        sql_query = generate_sql_query(schema_dict, sentence, db_type, user_role)
+
+        # Check if query generation failed
+        if sql_query.startswith("Error:"):
+            return render_template('index.html',
+                                   status='error',
+                                   message=sql_query,
+                                   connected_db=session.get('database'),
+                                   connected_db_type=DB_CONFIGS[db_type]['name'],
+                                   sentence=sentence,
+                                   user_data=user_data,
+                                   db_configs=DB_CONFIGS)
+
+        # Validate SQL query and enforce RBAC: block non-SELECT queries for 'user' role
+        rejection = check_generated_sql(sql_query, user_role, db_type)
+        if rejection and rejection[0] == 422:
+            raise ValueError(rejection[1]['message'])
+        if rejection:
+            return render_template('index.html',
+                                   status='error',
+                                   message=rejection[1]['message'],
+                                   sql_query=sql_query,  # Show generated query
+                                   connected_db=session.get('database'),
+                                   connected_db_type=DB_CONFIGS[db_type]['name'],
+                                   sentence=sentence,
+                                   user_data=user_data,
+                                   db_configs=DB_CONFIGS)
+
+        # Pre-flight the SELECTs with EXPLAIN before they reach the database
+        guard_action, sql_query, estimate = apply_cost_guard(db_type, uri, sql_query, user_role)
+        if guard_action == 'reject':
+            return render_template('index.html',
+                                   status='error',
+                                   message=f'Query rejected: {describe_cost_estimate(estimate)}. Try a more specific question.',
+                                   sql_query=sql_query,
+                                   connected_db=session.get('database'),
+                                   connected_db_type=DB_CONFIGS[db_type]['name'],
+                                   sentence=sentence,
+                                   user_data=user_data,
+                                   db_configs=DB_CONFIGS)
+        if guard_action == 'background':
+            job = submit_question_job(session['user_id'], sentence, db_type, uri, db_credentials, user_role, sql_query=sql_query)
+            return render_template('index.html',
+                                   status='queued',
+                                   message=f'This query runs as a background job because {describe_cost_estimate(estimate)}.',
+                                   job_status_url=url_for('job_status', job_id=job['id']),
+                                   sql_query=sql_query,
+                                   connected_db=session.get('database'),
+                                   connected_db_type=DB_CONFIGS[db_type]['name'],
+                                   sentence=sentence,
+                                   user_data=user_data,
+                                   db_configs=DB_CONFIGS)
+
+        # Execute query on a pooled connection; the context manager returns
+        # it to the pool even when a statement fails
+        with timed_stage('execute'):
+            execution = execute_sql_cached(uri, sql_query)
+        metrics.observe('querywhisper_result_rows', len(execution['rows']), db_type=db_type, role=user_role)
+        all_results = execution['rows']
+        last_columns = execution['columns']
+        earlier_result_sets = execution['result_sets'][:-1]
+        truncated = execution['truncated']
+        last_select = execution['last_select']
+        if guard_action == 'run':
+            few_shot_store.add(schema_dict, db_type, sentence, sql_query)
+
+        # Only the first page is rendered; the table fetches the rest from
+        # /results. A truncated result is paged from one snapshot from the
+        # start, so no rows of the first run are shown next to it. Result sets
+        # of earlier statements are loaded from /results as well.
+        result_handle = None
+        set_last_query(last_select)
+        if last_select:
+            result_handle = register_result_handle(session['user_id'], last_select, execution)
+            session['result_handle'] = result_handle
+        else:
+            session.pop('result_handle', None)
+        first_page = [] if truncated and last_select else all_results[:RESULT_PAGE_SIZE]
+        earlier_result_sets = [{
+            'statement': result_set['statement'],
+            'columns': result_set['columns'],
+            'row_count': len(result_set['rows']),
+            'truncated': result_set['truncated'],
+            'page_url': url_for('result_page', handle=register_result_handle(session['user_id'], result_set['statement'], result_set))
+        } for result_set in earlier_result_sets]
+
+        message = 'Query executed successfully.'
+        if guard_action == 'limit':
+            message += ' ' + cost_guard_notice(estimate)
 
-        user_data = {
-            'name': user.get('name', 'User'),
-            'email': user['email'],
-            'role': user_role
-        }
         return render_template(
             'index.html',
             status='success',
-            message='Query executed successfully.',
+            message=message,
             sql_query=sql_query,
-            query_result=all_results,
+            query_result=json_rows(first_page),
             columns=last_columns,
+            truncated=truncated,
+            has_more_rows=len(all_results) > len(first_page) or truncated,
+            result_handle=result_handle,
+            result_page_url=url_for('result_page', handle=result_handle) if result_handle else None,
+            result_page_size=RESULT_PAGE_SIZE,
+            streamable=last_select is not None,
+            earlier_result_sets=earlier_result_sets,
             connected_db=session.get('database'),
             connected_db_type=DB_CONFIGS[db_type]['name'],
             sentence=sentence,
@@ -545,11 +2670,6 @@ def submit_sentence():
 
     except Exception as e:
         logger.error(f"Error in submit_sentence: {str(e)}")
-        user_data = {
-            'name': user.get('name', 'User'),
-            'email': user['email'],
-            'role': user.get('role', 'user')
-        } if user else None
         return render_template(
             'index.html',
             status='error',
@@ -562,74 +2682,1880 @@ def submit_sentence():
             db_configs=DB_CONFIGS
         )
 
+class ResultColumns(list):
+    """Column names of a streamed result; scales holds the scale each column
+    was declared with in the cursor description (None when not reported)"""
+
+    def __init__(self, names, description=None):
+        super().__init__(names)
+        self.scales = [entry[5] for entry in description] if description else [None] * len(names)
+
+def iter_result_batches(uri, query, offset=0, limit=None):
+    """Run a query on a server-side cursor and yield its column names, then row batches.
+
+    Memory stays bounded by STREAM_BATCH_SIZE regardless of the result size.
+    The first ``offset`` rows are read and discarded so paging works the same
+    on every dialect.
+    """
+    with engine_connect(uri) as connection:
+        result = execute_streamed(connection, query)
+        yield ResultColumns(list(result.keys()), result.cursor.description)
+
+        remaining = limit
+        for batch in result.partitions(STREAM_BATCH_SIZE):
+            if offset:
+                skipped = min(offset, len(batch))
+                batch = batch[skipped:]
+                offset -= skipped
+            if remaining is not None:
+                batch = batch[:remaining]
+                remaining -= len(batch)
+            if batch:
+                yield batch
+            if remaining == 0:
+                break
+        result.close()
+
+def format_ndjson(columns, batches):
+    yield json.dumps({'columns': columns}) + '\n'
+    for batch in batches:
+        yield ''.join(json.dumps(list(row), default=str) + '\n' for row in batch)
+
+def format_csv(columns, batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+STREAM_FORMATS = {
+    'ndjson': (format_ndjson, 'application/x-ndjson'),
+    'csv': (format_csv, 'text/csv')
+}
+
+# Paginated result settings: rows per page rendered with the page and fetched
+# per scroll step, and how long a result handle is kept per worker
+RESULT_PAGE_SIZE = int(os.getenv("RESULT_PAGE_SIZE", 100))
+RESULT_PAGE_MAX_SIZE = int(os.getenv("RESULT_PAGE_MAX_SIZE", 1000))
+RESULT_HANDLE_TTL = int(os.getenv("RESULT_HANDLE_TTL", 1800))
+RESULT_HANDLE_MAX_ENTRIES = int(os.getenv("RESULT_HANDLE_MAX_ENTRIES", 256))
+RESULT_SNAPSHOT_MAX_ROWS = int(os.getenv("RESULT_SNAPSHOT_MAX_ROWS", 1000000))  # rows a handle can page through
+RESULT_SNAPSHOT_WORKERS = int(os.getenv("RESULT_SNAPSHOT_WORKERS", 4))
+RESULT_PAGE_TIMEOUT = float(os.getenv("RESULT_PAGE_TIMEOUT", 60))  # seconds a page waits for its rows
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESSION_MIN_BYTES", 1024))
+
+# Result handles: a result set of a question plus the rows already fetched for
+# it (up to RESULT_ROW_CAP). When those are the whole result, pages come from
+# memory. Otherwise the first page request starts a snapshot: the query runs
+# once more on a server-side cursor and its rows are spooled to a temporary
+# file in the background, and every page is read from that one run, so pages
+# neither overlap nor skip rows and scrolling costs one query in total. A
+# worker that does not know a handle rebuilds it from the connection's last query.
+_result_handles = OrderedDict()
+_result_handles_lock = threading.Lock()
+_result_handles_pid = os.getpid()
+_snapshot_executor = None
+_snapshot_executor_pid = None
+_snapshot_executor_lock = threading.Lock()
+
+class ResultSnapshot:
+    """One run of a query, spooled as zstd-compressed row batches to a
+    temporary file. Pages wait until the rows they need have arrived."""
+
+    def __init__(self, uri, query):
+        self.file = tempfile.TemporaryFile()
+        self.frames = []  # (first row, file offset, length, rows)
+        self.row_count = 0
+        self.columns = None
+        self.complete = False
+        self.capped = False
+        self.closed = False
+        self.error = None
+        self.condition = threading.Condition()
+        get_snapshot_executor().submit(self._fill, uri, query)
+
+    def _fill(self, uri, query):
+        compressor = zstandard.ZstdCompressor(level=RESULT_CACHE_COMPRESSION_LEVEL)
+        batches = iter_result_batches(uri, query)
+        try:
+            columns = list(next(batches))
+            with self.condition:
+                self.columns = columns
+                self.condition.notify_all()
+            for batch in batches:
+                batch = batch[:RESULT_SNAPSHOT_MAX_ROWS - self.row_count]
+                payload = compressor.compress(orjson.dumps([list(row) for row in batch], default=str))
+                with self.condition:
+                    if self.closed:
+                        return
+                    offset = self.file.seek(0, io.SEEK_END)
+                    self.file.write(payload)
+                    self.frames.append((self.row_count, offset, len(payload), len(batch)))
+                    self.row_count += len(batch)
+                    self.condition.notify_all()
+                if self.row_count >= RESULT_SNAPSHOT_MAX_ROWS:
+                    self.capped = True
+                    break
+        except Exception as e:
+            logger.error(f"Error in result snapshot: {str(e)}")
+            self.error = e
+        finally:
+            batches.close()
+            with self.condition:
+                self.complete = True
+                self.condition.notify_all()
+
+    def page(self, offset, limit):
+        """Columns and rows [offset, offset + limit + 1) as they were spooled"""
+        end = offset + limit + 1
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.complete or self.row_count >= end, RESULT_PAGE_TIMEOUT):
+                raise TimeoutError('The result is still being read. Try again shortly.')
+            if self.error is not None and self.row_count < end:
+                raise self.error
+            chunks = []
+            for first_row, file_offset, length, rows in self.frames:
+                if first_row < end and first_row + rows > offset:
+                    self.file.seek(file_offset)
+                    chunks.append((first_row, self.file.read(length)))
+        decompressor = zstandard.ZstdDecompressor()
+        page = []
+        for first_row, payload in chunks:
+            rows = orjson.loads(decompressor.decompress(payload))
+            page.extend(rows[max(offset - first_row, 0):end - first_row])
+        return self.columns, page
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.file.close()
+
+def get_snapshot_executor():
+    global _snapshot_executor, _snapshot_executor_pid
+    with _snapshot_executor_lock:
+        if _snapshot_executor is None or _snapshot_executor_pid != os.getpid():
+            _snapshot_executor = ThreadPoolExecutor(max_workers=RESULT_SNAPSHOT_WORKERS, thread_name_prefix='result-snapshot')
+            _snapshot_executor_pid = os.getpid()
+        return _snapshot_executor
+
+def _drop_result_handle(handle):
+    entry = _result_handles.pop(handle)
+    if entry['snapshot'] is not None:
+        entry['snapshot'].close()
+
+def _result_handle_entries():
+    global _result_handles_pid
+    if _result_handles_pid != os.getpid():
+        _result_handles.clear()
+        _result_handles_pid = os.getpid()
+    now = time.monotonic()
+    for handle, entry in list(_result_handles.items()):
+        if now - entry['last_used'] > RESULT_HANDLE_TTL:
+            _drop_result_handle(handle)
+    return _result_handles
+
+def _store_result_handle(handle, user_id, query, columns, rows, truncated):
+    with _result_handles_lock:
+        entries = _result_handle_entries()
+        entries[handle] = {
+            'user_id': user_id,
+            'query': query,
+            'columns': columns,
+            'rows': rows,
+            'truncated': truncated,
+            'snapshot': None,
+            'last_used': time.monotonic()
+        }
+        while len(entries) > RESULT_HANDLE_MAX_ENTRIES:
+            _drop_result_handle(next(iter(entries)))
+        return entries[handle]
+
+def register_result_handle(user_id, query, result_set):
+    """A handle for a result set (the last one of an execution, or an earlier one)"""
+    handle = secrets.token_urlsafe(16)
+    _store_result_handle(handle, user_id, query, result_set['columns'], result_set['rows'], result_set['truncated'])
+    return handle
+
+def get_result_handle(handle, user_id):
+    with _result_handles_lock:
+        entry = _result_handle_entries().get(handle)
+        if entry is not None and entry['user_id'] == user_id:
+            entry['last_used'] = time.monotonic()
+            _result_handles.move_to_end(handle)
+            return entry
+    query = get_last_query() if handle and session.get('result_handle') == handle else None
+    if query:
+        return _store_result_handle(handle, user_id, query, None, None, True)
+    return None
+
+def fetch_result_page(entry, uri, offset, limit):
+    """One page of a result plus whether more rows follow, and the row total when it is known"""
+    # The rows a write returned cannot be fetched again, so they are all there is
+    if not entry['truncated'] or not is_read_statement(entry['query']):
+        page = entry['rows'][offset:offset + limit + 1]
+        columns = entry['columns']
+        total = len(entry['rows']) if not entry['truncated'] else None
+    else:
+        with _result_handles_lock:
+            if entry['snapshot'] is None:
+                entry['snapshot'] = ResultSnapshot(uri, entry['query'])
+            snapshot = entry['snapshot']
+        columns, page = snapshot.page(offset, limit)
+        total = snapshot.row_count if snapshot.complete and snapshot.error is None else None
+    return {
+        'columns': columns,
+        'rows': page[:limit],
+        'offset': offset,
+        'has_more': len(page) > limit,
+        'total': total
+    }
+
+def json_rows(rows):
+    """Rows as /results sends them (dates, decimals etc. as strings), for the first page embedded in the page"""
+    return orjson.loads(orjson.dumps(rows, default=str))
+
+def accepted_encodings():
+    encodings = set()
+    for token in request.headers.get('Accept-Encoding', '').split(','):
+        name, _, params = token.partition(';')
+        if not re.search(r'q=0(\.0*)?\s*$', params):
+            encodings.add(name.strip().lower())
+    return encodings
+
+def compressed_json(payload, status=200):
+    """JSON response compressed with zstd or gzip when the client accepts it"""
+    body = orjson.dumps(payload, default=str)
+    encoding = None
+    if len(body) >= RESPONSE_COMPRESSION_MIN_BYTES:
+        encodings = accepted_encodings()
+        if 'zstd' in encodings:
+            body, encoding = zstandard.ZstdCompressor(level=RESULT_CACHE_COMPRESSION_LEVEL).compress(body), 'zstd'
+        elif 'gzip' in encodings:
+            body, encoding = gzip.compress(body, compresslevel=6), 'gzip'
+    response = Response(body, status=status, mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+# Paginated result route (protected): one page of the result behind a handle,
+# as compressed JSON for the virtualized results table
+@app.route('/results/<handle>')
+@login_required
+def result_page(handle):
+    uri, db_type, _ = get_connection_details()
+    entry = get_result_handle(handle, session['user_id'])
+    if not uri or entry is None:
+        return jsonify({'error': 'This result is no longer available. Run the query again.'}), 404
+
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', RESULT_PAGE_SIZE, type=int), 1), RESULT_PAGE_MAX_SIZE)
+    try:
+        with timed_stage('execute', db_type):
+            page = fetch_result_page(entry, uri, offset, limit)
+    except Exception as e:
+        logger.error(f"Error in result_page: {str(e)}")
+        return jsonify({'error': f'Error processing query: {str(e)}'}), 500
+    return compressed_json(page)
+
+# Streaming result route (protected): re-runs the last SELECT and sends it in
+# chunks, either the whole result or an offset/limit page for "load more"
+@app.route('/stream_results')
+@login_required
+def stream_results():
+    uri = get_connection_details()[0]
+    query = get_last_query()
+    if not uri or not query:
+        return jsonify({'error': 'No query result to stream. Run a SELECT query first.'}), 404
+
+    output_format = request.args.get('format', 'ndjson')
+    if output_format not in STREAM_FORMATS:
+        return jsonify({'error': f'Unsupported format: {output_format}'}), 400
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = request.args.get('limit', type=int)
+
+    try:
+        batches = iter_result_batches(uri, query, offset, limit)
+        columns = next(batches)
+    except Exception as e:
+        logger.error(f"Error in stream_results: {str(e)}")
+        return jsonify({'error': f'Error processing query: {str(e)}'}), 500
+
+    formatter, mimetype = STREAM_FORMATS[output_format]
+    response = Response(stream_with_context(formatter(columns, batches)), mimetype=mimetype)
+    if output_format == 'csv':
+        response.headers['Content-Disposition'] = 'attachment; filename=query_result.csv'
+    return response
+
+class _ExportSink(io.RawIOBase):
+    """Write-only file object for Arrow writers that hands written bytes to a
+    generator instead of keeping them; tell() still reports the total so
+    Parquet footers get correct offsets"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def _arrow_field(name, array, scale):
+    """Field for a column from its first batch. All-NULL columns become
+    strings so later batches fit. Decimals take the declared scale at full
+    precision, since a later batch may need more digits than the first; a
+    decimal without a declared scale is exported as text rather than risk
+    failing half way through the download."""
+    import pyarrow as pa
+    if pa.types.is_null(array.type):
+        return pa.field(name, pa.string())
+    if pa.types.is_decimal(array.type):
+        if isinstance(scale, int) and 0 <= scale <= 38:
+            return pa.field(name, pa.decimal128(38, scale))
+        return pa.field(name, pa.string())
+    return pa.field(name, array.type)
+
+def _arrow_schema(columns, arrays):
+    """Schema from the first batch; see _arrow_field"""
+    import pyarrow as pa
+    scales = getattr(columns, 'scales', [None] * len(columns))
+    return pa.schema([_arrow_field(name, array, scale) for name, array, scale in zip(columns, arrays, scales)])
+
+def _arrow_column(values, field):
+    import pyarrow as pa
+    if pa.types.is_string(field.type):
+        values = [None if value is None or isinstance(value, str) else str(value) for value in values]
+    return pa.array(values, type=field.type)
+
+def iter_record_batches(columns, batches):
+    """Turn row batches into Arrow record batches one column at a time; only
+    one batch is held in memory"""
+    import pyarrow as pa
+    schema = None
+    for batch in batches:
+        column_values = list(zip(*batch))
+        if schema is None:
+            schema = _arrow_schema(columns, [pa.array(values) for values in column_values])
+        yield pa.RecordBatch.from_arrays(
+            [_arrow_column(values, field) for values, field in zip(column_values, schema)], schema=schema
+        )
+    if schema is None:
+        yield pa.RecordBatch.from_arrays([pa.array([], type=pa.string()) for _ in columns], names=columns)
+
+def format_arrow_file(open_writer):
+    def formatter(columns, batches):
+        sink = _ExportSink()
+        writer = None
+        for record_batch in iter_record_batches(columns, batches):
+            if writer is None:
+                writer = open_writer(sink, record_batch.schema)
+            writer.write_batch(record_batch)
+            yield sink.drain()
+        writer.close()
+        yield sink.drain()
+    return formatter
+
+def format_jsonl(columns, batches):
+    for batch in batches:
+        yield b''.join(orjson.dumps(dict(zip(columns, row)), default=str) + b'\n' for row in batch)
+
+# pyarrow is only imported once somebody exports Parquet or Arrow
+def open_parquet_writer(sink, schema):
+    import pyarrow.parquet as pq
+    return pq.ParquetWriter(sink, schema, compression='snappy')
+
+def open_arrow_stream_writer(sink, schema):
+    import pyarrow.ipc
+    return pyarrow.ipc.new_stream(sink, schema)
+
+# Export formats: formatter, mimetype and file extension
+EXPORT_FORMATS = {
+    'csv': (format_csv, 'text/csv', 'csv'),
+    'jsonl': (format_jsonl, 'application/jsonl', 'jsonl'),
+    'parquet': (format_arrow_file(open_parquet_writer),
+                'application/vnd.apache.parquet', 'parquet'),
+    'arrow': (format_arrow_file(open_arrow_stream_writer),
+              'application/vnd.apache.arrow.stream', 'arrows')
+}
+
+def iter_cached_batches(uri, query):
+    """Column names and row batches from the result cache when it holds the
+    complete result of query, else None"""
+    if result_cache is None:
+        return None
+    cached = result_cache.get(uri, query)
+    if cached is None or cached['truncated']:
+        return None
+
+    def batches():
+        yield cached['columns']
+        rows = cached['rows']
+        for start in range(0, len(rows), STREAM_BATCH_SIZE):
+            yield rows[start:start + STREAM_BATCH_SIZE]
+    return batches()
+
+# Export route (protected): the full result of the last SELECT as a download,
+# served from the result cache when possible, else re-run on a server-side cursor
+@app.route('/export')
+@login_required
+def export_results():
+    uri = get_connection_details()[0]
+    query = get_last_query()
+    if not uri or not query:
+        return jsonify({'error': 'No query result to export. Run a SELECT query first.'}), 404
+
+    output_format = request.args.get('format', 'csv')
+    if output_format not in EXPORT_FORMATS:
+        return jsonify({'error': f'Unsupported format: {output_format}'}), 400
+
+    try:
+        batches = iter_cached_batches(uri, query) or iter_result_batches(uri, query)
+        columns = next(batches)
+    except Exception as e:
+        logger.error(f"Error in export_results: {str(e)}")
+        return jsonify({'error': f'Error processing query: {str(e)}'}), 500
+
+    formatter, mimetype, extension = EXPORT_FORMATS[output_format]
+    response = Response(stream_with_context(formatter(columns, batches)), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=query_result.{extension}'
+    return response
+
+# Schema refresh route (protected)
+@app.route('/refresh_schema', methods=['POST'])
+@login_required
+def refresh_schema():
+    uri, db_type, db_credentials = get_connection_details()
+
+    user_data = get_current_user()
+
+    if not uri or not db_credentials or not db_type:
+        return render_template('index.html',
+                              status='error',
+                              message='No database connection found. Please connect to a database first.',
+                              user_data=user_data,
+                              db_configs=DB_CONFIGS)
+
+    try:
+        schema_dict = get_cached_schema(db_type, uri, db_credentials, force_refresh=True)
+        if result_cache is not None:
+            result_cache.invalidate(uri)
+        status = 'success'
+        message = f'Schema refreshed: {len(schema_dict)} tables found.'
+    except Exception as e:
+        logger.error(f"Error in refresh_schema: {str(e)}")
+        status = 'error'
+        message = f'Schema refresh failed: {str(e)}'
+
+    return render_template('index.html',
+                          status=status,
+                          message=message,
+                          connected_db=session.get('database'),
+                          connected_db_type=DB_CONFIGS[db_type]['name'],
+                          user_data=user_data,
+                          db_configs=DB_CONFIGS)
+
 # Disconnect route (protected)
 @app.route('/disconnect', methods=['POST'])
 @login_required
 def disconnect():
-    session.pop('uri', None)
-    session.pop('database', None)
-    session.pop('db_type', None)
-    session.pop('db_credentials', None)
+    clear_session_connection()
     return redirect(url_for('index'))
 
-# SQL query generation function (updated with Grok and improved prompt)
-def generate_sql_query(schema_dict, sentence, db_type, user_role):
-    # Validate API key configuration
-    if not API_KEY:
-        logger.error("GROQ_API_KEY is not set")
-        return "Error: Missing Groq API key configuration"
+# Pool statistics route (protected)
+@app.route('/pool_stats')
+@login_required
+def pool_stats_view():
+    return jsonify({**pool_stats(), 'connections': connection_stats()})
+
+# Prometheus metrics route; protected by a bearer token when METRICS_TOKEN is set
+@app.route('/metrics')
+def metrics_view():
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# Cache statistics route (protected)
+@app.route('/cache_stats')
+@login_required
+def cache_stats_view():
+    return jsonify({
+        'sql_cache': sql_cache.get_stats(),
+        'result_cache': result_cache.get_stats() if result_cache is not None else {'enabled': False},
+        'few_shot': few_shot_store.get_stats()
+    })
+
+# Schema relevance pruning settings
+SCHEMA_PRUNING_ENABLED = os.getenv("SCHEMA_PRUNING_ENABLED", "true").lower() == "true"
+SCHEMA_PRUNE_MIN_TABLES = int(os.getenv("SCHEMA_PRUNE_MIN_TABLES", 20))
+SCHEMA_TOP_K = int(os.getenv("SCHEMA_TOP_K", 12))
+SCHEMA_PRUNE_MIN_SCORE = float(os.getenv("SCHEMA_PRUNE_MIN_SCORE", 1.0))
+
+# Words that carry no schema signal in a question
+QUESTION_STOPWORDS = {
+    'a', 'all', 'an', 'and', 'any', 'are', 'as', 'at', 'be', 'by', 'can', 'did', 'do', 'does',
+    'each', 'find', 'for', 'from', 'get', 'give', 'have', 'has', 'how', 'i', 'in', 'is', 'it',
+    'list', 'many', 'me', 'much', 'my', 'of', 'on', 'or', 'our', 'show', 'than', 'that', 'the',
+    'their', 'there', 'these', 'this', 'to', 'us', 'was', 'we', 'were', 'what', 'when', 'where',
+    'which', 'who', 'whose', 'why', 'with', 'would', 'you'
+}
+
+def tokenize_text(value):
+    """Split identifiers and prose into lowercase terms (snake_case, camelCase, plurals)"""
+    value = re.sub(r'([a-z0-9])([A-Z])', r'\1 \2', str(value))
+    terms = []
+    for term in re.findall(r'[a-z0-9]+', value.lower()):
+        if len(term) > 3 and term.endswith('ies'):
+            term = term[:-3] + 'y'
+        elif len(term) > 3 and term.endswith('s') and not term.endswith('ss'):
+            term = term[:-1]
+        terms.append(term)
+    return terms
+
+def estimate_tokens(value):
+    """Rough LLM token estimate (~4 characters per token) used for logging"""
+    return len(value) // 4
+
+# Schema fingerprints memoized by object identity; cached schemas are reused
+# as the same dict until they are re-introspected
+_schema_fingerprints = OrderedDict()
+_schema_fingerprints_lock = threading.Lock()
+
+def schema_fingerprint(schema_dict):
+    """Stable hash of a schema's content"""
+    with _schema_fingerprints_lock:
+        entry = _schema_fingerprints.get(id(schema_dict))
+        if entry and entry[0] is schema_dict:
+            return entry[1]
+    fingerprint = hashlib.sha256(
+        json.dumps(schema_dict, sort_keys=True, default=str).encode('utf-8')
+    ).hexdigest()
+    with _schema_fingerprints_lock:
+        _schema_fingerprints[id(schema_dict)] = (schema_dict, fingerprint)
+        while len(_schema_fingerprints) > SCHEMA_CACHE_MAX_ENTRIES:
+            _schema_fingerprints.popitem(last=False)
+    return fingerprint
+
+class SchemaIndex:
+    """Okapi BM25 index with one document per table (table, column and referenced names)"""
+
+    def __init__(self, schema_dict, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.tables = list(schema_dict)
+        self.postings = {}
+        self.doc_lengths = []
+        for doc_id, table in enumerate(self.tables):
+            # Table names are weighted twice so "orders" prefers the orders table
+            terms = tokenize_text(table) * 2
+            for column in schema_dict[table]:
+                terms += tokenize_text(column['name'])
+                if column.get('foreign_key'):
+                    terms += tokenize_text(column['foreign_key'].split('.')[0])
+            self.doc_lengths.append(len(terms))
+            for term, frequency in Counter(terms).items():
+                self.postings.setdefault(term, []).append((doc_id, frequency))
+        self.avg_length = sum(self.doc_lengths) / len(self.doc_lengths) if self.doc_lengths else 0.0
+
+    def score(self, question):
+        """Return [(table, score), ...] for tables matching any question term, best first"""
+        scores = {}
+        doc_count = len(self.tables)
+        for term in set(tokenize_text(question)) - QUESTION_STOPWORDS:
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, frequency in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / self.avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [(self.tables[doc_id], score) for doc_id, score in ranked]
+
+_schema_indexes = OrderedDict()
+_schema_indexes_lock = threading.Lock()
+
+def get_schema_index(schema_dict):
+    fingerprint = schema_fingerprint(schema_dict)
+    with _schema_indexes_lock:
+        index = _schema_indexes.get(fingerprint)
+        if index:
+            _schema_indexes.move_to_end(fingerprint)
+            return index
+    index = SchemaIndex(schema_dict)
+    with _schema_indexes_lock:
+        _schema_indexes[fingerprint] = index
+        while len(_schema_indexes) > SCHEMA_CACHE_MAX_ENTRIES:
+            _schema_indexes.popitem(last=False)
+    return index
+
+def prune_schema(schema_dict, sentence):
+    """Keep only the tables relevant to the question plus their foreign-key neighbours.
+
+    Falls back to the full schema when pruning is disabled, the schema is small,
+    or no table scores above SCHEMA_PRUNE_MIN_SCORE.
+    """
+    if not SCHEMA_PRUNING_ENABLED or len(schema_dict) <= SCHEMA_PRUNE_MIN_TABLES:
+        return schema_dict
+
+    ranked = get_schema_index(schema_dict).score(sentence)
+    if not ranked or ranked[0][1] < SCHEMA_PRUNE_MIN_SCORE:
+        logger.debug("Schema pruning confidence too low; sending full schema")
+        return schema_dict
+
+    selected = [table for table, _ in ranked[:SCHEMA_TOP_K]]
+    keep = set(selected)
+    for table in selected:
+        for column in schema_dict[table]:
+            referenced = (column.get('foreign_key') or '').split('.')[0]
+            if referenced in schema_dict:
+                keep.add(referenced)
+    for table, columns in schema_dict.items():
+        if len(keep) >= SCHEMA_TOP_K * 2:
+            break
+        if any((column.get('foreign_key') or '').split('.')[0] in selected for column in columns):
+            keep.add(table)
+
+    return {table: columns for table, columns in schema_dict.items() if table in keep}
+
+def render_schema(schema_dict):
+    """Render a schema as one line per table, e.g. ``orders(id INT PK, customer_id INT FK->customers.id)``.
+
+    Tables are sorted and columns keep their ordinal order, so the same schema
+    always renders to the same bytes and the prompt prefix stays cacheable.
+    """
+    lines = []
+    for table in sorted(schema_dict):
+        columns = []
+        for column in schema_dict[table]:
+            parts = [column['name']]
+            if column.get('type'):
+                parts.append(str(column['type']).upper())
+            if column.get('primary_key'):
+                parts.append('PK')
+            if column.get('foreign_key'):
+                parts.append(f"FK->{column['foreign_key']}")
+            columns.append(' '.join(parts))
+        lines.append(f"{table}({', '.join(columns)})")
+    return '\n'.join(lines)
+
+# Rendered full schemas keyed by fingerprint: every question against an
+# unpruned schema sends the same text, and pruned prompts log its token count
+_rendered_schemas = OrderedDict()
+_rendered_schemas_lock = threading.Lock()
+
+def render_full_schema(schema_dict):
+    """(text, estimated tokens) of the whole schema, rendered once per schema"""
+    fingerprint = schema_fingerprint(schema_dict)
+    with _rendered_schemas_lock:
+        rendered = _rendered_schemas.get(fingerprint)
+        if rendered:
+            _rendered_schemas.move_to_end(fingerprint)
+            return rendered
+    schema_text = render_schema(schema_dict)
+    rendered = (schema_text, estimate_tokens(schema_text))
+    with _rendered_schemas_lock:
+        _rendered_schemas[fingerprint] = rendered
+        while len(_rendered_schemas) > SCHEMA_CACHE_MAX_ENTRIES:
+            _rendered_schemas.popitem(last=False)
+    return rendered
+
+# Generated-SQL cache settings
+SQL_CACHE_BACKEND = os.getenv("SQL_CACHE_BACKEND", "memory").lower()  # memory, mongodb or none
+SQL_CACHE_TTL = int(os.getenv("SQL_CACHE_TTL", 3600))
+SQL_CACHE_MAX_ENTRIES = int(os.getenv("SQL_CACHE_MAX_ENTRIES", 5000))
+SQL_CACHE_FUZZY_THRESHOLD = float(os.getenv("SQL_CACHE_FUZZY_THRESHOLD", 0))  # 0 disables fuzzy matching
+
+# Filler words dropped when normalizing a question for the SQL cache. Kept
+# deliberately small: words like "any", "all" or "not" change the answer.
+SQL_CACHE_STOPWORDS = {
+    'a', 'an', 'the', 'please', 'me', 'us', 'i', 'we', 'you', 'can', 'could', 'would', 'want',
+    'to', 'see', 'show', 'list', 'give', 'get', 'find', 'display', 'tell', 'fetch', 'return'
+}
+
+def normalize_question(sentence):
+    """Lowercase, strip punctuation and filler words, collapse whitespace"""
+    words = re.findall(r"[a-z0-9]+(?:\.[0-9]+)?", sentence.lower())
+    return ' '.join(word for word in words if word not in SQL_CACHE_STOPWORDS)
+
+def question_similarity(left, right):
+    """Jaccard similarity of character trigrams; questions quoting different numbers never match"""
+    if re.findall(r'\d+(?:\.\d+)?', left) != re.findall(r'\d+(?:\.\d+)?', right):
+        return 0.0
+    left_grams = {left[i:i + 3] for i in range(max(len(left) - 2, 1))}
+    right_grams = {right[i:i + 3] for i in range(max(len(right) - 2, 1))}
+    return len(left_grams & right_grams) / len(left_grams | right_grams)
+
+class InMemorySQLCacheBackend:
+    """Per-process LRU with TTL"""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry['stored_at'] > self.ttl:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry['sql']
+
+    def set(self, key, scope, normalized, sql):
+        with self.lock:
+            self.entries[key] = {'scope': scope, 'normalized': normalized, 'sql': sql, 'stored_at': time.monotonic()}
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def candidates(self, scope):
+        now = time.monotonic()
+        with self.lock:
+            return [(key, entry['normalized'], entry['sql']) for key, entry in self.entries.items()
+                    if entry['scope'] == scope and now - entry['stored_at'] <= self.ttl]
+
+class MongoSQLCacheBackend:
+    """Shared across workers in the application's MongoDB; a TTL index on
+    last_used expires entries nobody has asked for recently"""
+
+    def __init__(self, collection_name, ttl):
+        self.collection_name = collection_name
+        self.ttl = ttl
+        self.indexed = False
+
+    @property
+    def collection(self):
+        return get_mongo_db()[self.collection_name]
+
+    def _ensure_indexes(self):
+        if not self.indexed:
+            self.collection.create_index('last_used', expireAfterSeconds=self.ttl)
+            self.collection.create_index('scope')
+            self.indexed = True
+
+    def get(self, key):
+        self._ensure_indexes()
+        entry = self.collection.find_one_and_update(
+            {'_id': key}, {'$set': {'last_used': datetime.utcnow()}}, projection={'sql': 1}
+        )
+        return entry['sql'] if entry else None
+
+    def set(self, key, scope, normalized, sql):
+        self._ensure_indexes()
+        self.collection.update_one(
+            {'_id': key},
+            {'$set': {'scope': scope, 'normalized': normalized, 'sql': sql, 'last_used': datetime.utcnow()}},
+            upsert=True
+        )
+
+    def candidates(self, scope):
+        self._ensure_indexes()
+        cursor = self.collection.find({'scope': scope}, {'normalized': 1, 'sql': 1}).limit(SQL_CACHE_MAX_ENTRIES)
+        return [(entry['_id'], entry['normalized'], entry['sql']) for entry in cursor]
+
+class SQLCache:
+    """Generated-SQL cache keyed by (schema fingerprint, db_type, role, normalized question).
+
+    The schema fingerprint is part of every key, so a schema change makes the
+    old entries unreachable and they age out of the backend on their own.
+    """
+
+    def __init__(self, backend, fuzzy_threshold=0.0):
+        self.backend = backend
+        self.fuzzy_threshold = fuzzy_threshold
+        self.stats = Counter()
+        self.lock = threading.Lock()
+
+    def _scope_and_key(self, schema_dict, db_type, user_role, sentence):
+        scope = hashlib.sha256(f"{schema_fingerprint(schema_dict)}\x1f{db_type}\x1f{user_role}".encode('utf-8')).hexdigest()
+        normalized = normalize_question(sentence)
+        key = hashlib.sha256(f"{scope}\x1f{normalized}".encode('utf-8')).hexdigest()
+        return scope, key, normalized
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def get(self, schema_dict, db_type, user_role, sentence):
+        if self.backend is None:
+            return None
+        try:
+            scope, key, normalized = self._scope_and_key(schema_dict, db_type, user_role, sentence)
+            sql_query = self.backend.get(key)
+            if sql_query is not None:
+                self._count('hits')
+                return sql_query
+            if self.fuzzy_threshold > 0:
+                best = max(
+                    ((question_similarity(normalized, candidate), sql) for _, candidate, sql in self.backend.candidates(scope)),
+                    default=(0.0, None)
+                )
+                if best[0] >= self.fuzzy_threshold:
+                    self._count('fuzzy_hits')
+                    return best[1]
+        except Exception as e:
+            logger.warning(f"SQL cache lookup failed: {str(e)}")
+        self._count('misses')
+        return None
+
+    def set(self, schema_dict, db_type, user_role, sentence, sql_query):
+        if self.backend is None:
+            return
+        try:
+            scope, key, normalized = self._scope_and_key(schema_dict, db_type, user_role, sentence)
+            self.backend.set(key, scope, normalized, sql_query)
+            self._count('stores')
+        except Exception as e:
+            logger.warning(f"SQL cache store failed: {str(e)}")
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+        lookups = stats.get('hits', 0) + stats.get('fuzzy_hits', 0) + stats.get('misses', 0)
+        stats['hit_ratio'] = round((lookups - stats.get('misses', 0)) / lookups, 3) if lookups else 0.0
+        stats['backend'] = SQL_CACHE_BACKEND
+        return stats
+
+def create_sql_cache():
+    if SQL_CACHE_BACKEND == 'mongodb':
+        backend = MongoSQLCacheBackend('sql_cache', SQL_CACHE_TTL)
+    elif SQL_CACHE_BACKEND == 'memory':
+        backend = InMemorySQLCacheBackend(SQL_CACHE_MAX_ENTRIES, SQL_CACHE_TTL)
+    else:
+        backend = None
+    return SQLCache(backend, SQL_CACHE_FUZZY_THRESHOLD)
+
+sql_cache = create_sql_cache()
+
+# Few-shot example store settings. Validated (question, SQL) pairs are kept per
+# schema fingerprint; the most similar ones are shown to the LLM, and question
+# shapes that keep producing the same SQL are answered without it.
+FEW_SHOT_BACKEND = os.getenv("FEW_SHOT_BACKEND", "mongodb").lower()  # mongodb, disk or none
+FEW_SHOT_PATH = os.getenv("FEW_SHOT_PATH", "few_shot_examples")
+FEW_SHOT_EXAMPLES = int(os.getenv("FEW_SHOT_EXAMPLES", 3))
+FEW_SHOT_MIN_SIMILARITY = float(os.getenv("FEW_SHOT_MIN_SIMILARITY", 0.35))
+FEW_SHOT_MAX_EXAMPLES = int(os.getenv("FEW_SHOT_MAX_EXAMPLES", 200))
+FEW_SHOT_TEMPLATE_MIN_USES = int(os.getenv("FEW_SHOT_TEMPLATE_MIN_USES", 2))  # 0 disables templated answers
+FEW_SHOT_RELOAD_SECONDS = int(os.getenv("FEW_SHOT_RELOAD_SECONDS", 300))
+
+# Values a question can carry into its SQL: quoted strings, ISO dates, numbers
+QUESTION_LITERAL_PATTERN = re.compile(r"'([^']+)'|\"([^\"]+)\"|\b(\d{4}-\d{2}-\d{2}|\d+(?:\.\d+)?)\b")
+TEMPLATE_SLOT = 'qwslot'
+
+def question_template(sentence):
+    """The question with its literal values replaced by slots, and those values"""
+    values = []
+
+    def slot(match):
+        values.append(next(group for group in match.groups() if group is not None))
+        return f' {TEMPLATE_SLOT} '
+    return normalize_question(QUESTION_LITERAL_PATTERN.sub(slot, sentence)), values
+
+def _literal_matches(literal, value):
+    if literal.is_string:
+        return literal.this.lower() == value.lower()
+    try:
+        return float(literal.this) == float(value)
+    except ValueError:
+        return False
+
+def sql_template(sql_query, values, db_type):
+    """SQL shape with the question's values as numbered placeholders, or None
+    when a value does not appear in the SQL exactly once"""
+    try:
+        expression = parse_sql(sql_query, db_type)[0]
+    except (SqlglotError, IndexError):
+        return None
+    literals = list(expression.find_all(exp.Literal))
+    slots = {}
+    for index, value in enumerate(values):
+        matches = [literal for literal in literals if _literal_matches(literal, value)]
+        if len(matches) != 1 or id(matches[0]) in slots:
+            return None
+        slots[id(matches[0])] = index
+    shape = expression.transform(
+        lambda node: exp.Placeholder(this=f"p{slots[id(node)]}") if id(node) in slots else node, copy=False
+    )
+    return shape.sql(dialect=sqlglot_dialect(db_type))
+
+def fill_sql_template(sql_query, old_values, new_values, db_type):
+    """Swap the literals of a stored example for the new question's values"""
+    expression = parse_sql(sql_query, db_type)[0]
+
+    def substitute(node):
+        if isinstance(node, exp.Literal):
+            for old_value, new_value in zip(old_values, new_values):
+                if _literal_matches(node, old_value):
+                    if node.is_string:
+                        return exp.Literal.string(new_value)
+                    float(new_value)  # a number slot only takes a number
+                    return exp.Literal.number(new_value)
+        return node
+    return expression.transform(substitute).sql(dialect=sqlglot_dialect(db_type))
+
+class ExampleIndex:
+    """TF-IDF over character 3- and 4-grams of the examples of one schema,
+    plus the question templates seen so far"""
+
+    def __init__(self, examples):
+        self.examples = []
+        self.normalized = set()
+        self.templates = {}
+        self.matrix = None
+        for example in examples:
+            self.add(example)
+
+    @staticmethod
+    def _ngrams(text):
+        padded = f" {text} "
+        return Counter(padded[i:i + n] for n in (3, 4) for i in range(len(padded) - n + 1))
+
+    def add(self, example):
+        """Index an example unless the same question is already known"""
+        if example['normalized'] in self.normalized:
+            return False
+        self.normalized.add(example['normalized'])
+        self.examples.append(example)
+        if example.get('template'):
+            shapes = self.templates.setdefault(example['template'], {})
+            shapes.setdefault(example['sql_template'], []).append(example)
+        self.matrix = None
+        return True
+
+    def _build(self):
+        import numpy as np
+
+        counts = [self._ngrams(example['normalized']) for example in self.examples]
+        self.vocabulary = {gram: column for column, gram in enumerate({gram for grams in counts for gram in grams})}
+        matrix = np.zeros((len(counts), len(self.vocabulary)), dtype=np.float32)
+        for row, grams in enumerate(counts):
+            for gram, count in grams.items():
+                matrix[row, self.vocabulary[gram]] = 1 + math.log(count)
+        document_frequency = np.count_nonzero(matrix, axis=0)
+        self.idf = (np.log((1 + len(counts)) / (1 + document_frequency)) + 1).astype(np.float32)
+        matrix *= self.idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        self.matrix = matrix / np.where(norms == 0, 1, norms)
+
+    def similar(self, normalized, count, min_similarity):
+        import numpy as np
+
+        if not self.examples:
+            return []
+        if self.matrix is None:
+            self._build()
+        vector = np.zeros(len(self.vocabulary), dtype=np.float32)
+        for gram, frequency in self._ngrams(normalized).items():
+            column = self.vocabulary.get(gram)
+            if column is not None:
+                vector[column] = 1 + math.log(frequency)
+        vector *= self.idf
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return []
+        scores = self.matrix @ (vector / norm)
+        best = np.argsort(-scores)[:count]
+        return [self.examples[row] for row in best if scores[row] >= min_similarity]
+
+    def template_example(self, template):
+        """An example for the template when all examples of it agree on one SQL
+        shape and there are at least FEW_SHOT_TEMPLATE_MIN_USES of them"""
+        shapes = self.templates.get(template)
+        if not shapes or len(shapes) != 1:
+            return None
+        examples = next(iter(shapes.values()))
+        return examples[-1] if len(examples) >= FEW_SHOT_TEMPLATE_MIN_USES else None
+
+class MongoFewShotBackend:
+    """Examples in the application's MongoDB, shared by every worker"""
+
+    def __init__(self, collection_name):
+        self.collection_name = collection_name
+        self.indexed = False
+
+    @property
+    def collection(self):
+        collection = get_mongo_db()[self.collection_name]
+        if not self.indexed:
+            collection.create_index([('scope', 1), ('created_at', -1)])
+            self.indexed = True
+        return collection
+
+    def load(self, scope):
+        cursor = self.collection.find({'scope': scope}, {'_id': 0, 'scope': 0}).sort('created_at', -1).limit(FEW_SHOT_MAX_EXAMPLES)
+        return list(cursor)[::-1]
+
+    def add(self, scope, example):
+        key = hashlib.sha256(f"{scope}\x1f{example['normalized']}".encode('utf-8')).hexdigest()
+        self.collection.update_one({'_id': key}, {'$setOnInsert': {**example, 'scope': scope}}, upsert=True)
+
+class DiskFewShotBackend:
+    """Examples as JSON lines, one file per schema scope under FEW_SHOT_PATH"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+
+    def _path(self, scope):
+        return os.path.join(self.directory, f"{scope}.jsonl")
+
+    def load(self, scope):
+        try:
+            with open(self._path(scope), 'rb') as examples_file:
+                return [orjson.loads(line) for line in examples_file if line.strip()][-FEW_SHOT_MAX_EXAMPLES:]
+        except FileNotFoundError:
+            return []
+
+    def add(self, scope, example):
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self._path(scope), 'ab') as examples_file:
+                examples_file.write(orjson.dumps(example, default=str) + b'\n')
+
+class FewShotStore:
+    """Validated question -> SQL pairs per (schema fingerprint, db_type).
+
+    Each worker keeps an ExampleIndex per scope, loaded from the backend on
+    first use and reloaded every FEW_SHOT_RELOAD_SECONDS to pick up examples
+    other workers added. Only read-only SQL that ran successfully is stored.
+    """
 
-    # Database-specific prompt notes
-    db_specific_notes = {
-        'mysql': "Use MySQL syntax. Enclose table and column names with backticks (`) only if they contain special characters or are reserved keywords (e.g., `table_name`.`column_name`). Avoid backticks for standard identifiers.",
-        'postgresql': "Use PostgreSQL syntax. Enclose table and column names with double quotes (\"`) only if they contain special characters or are reserved keywords (e.g., \"table_name\".\"column_name\"). Avoid quotes for standard identifiers.",
-        'sqlite': "Use SQLite syntax. Use simple, standard SQL without unnecessary escaping. Avoid enclosing identifiers unless absolutely required.",
-        'sqlserver': "Use SQL Server syntax. Enclose table and column names with square brackets ([]) only if they contain special characters or are reserved keywords (e.g., [table_name].[column_name]). Avoid brackets for standard identifiers."
+    def __init__(self, backend):
+        self.backend = backend
+        self.indexes = OrderedDict()
+        self.stats = Counter()
+        self.lock = threading.Lock()
+
+    def _scope(self, schema_dict, db_type):
+        return hashlib.sha256(f"{schema_fingerprint(schema_dict)}\x1f{db_type}".encode('utf-8')).hexdigest()
+
+    def _index(self, scope):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.indexes.get(scope)
+            if entry and now - entry[1] < FEW_SHOT_RELOAD_SECONDS:
+                self.indexes.move_to_end(scope)
+                return entry[0]
+        index = ExampleIndex(self.backend.load(scope))
+        with self.lock:
+            self.indexes[scope] = (index, now)
+            self.indexes.move_to_end(scope)
+            while len(self.indexes) > SCHEMA_CACHE_MAX_ENTRIES:
+                self.indexes.popitem(last=False)
+        return index
+
+    def similar(self, schema_dict, db_type, sentence):
+        """Up to FEW_SHOT_EXAMPLES stored examples closest to the question"""
+        if self.backend is None or FEW_SHOT_EXAMPLES <= 0:
+            return []
+        try:
+            index = self._index(self._scope(schema_dict, db_type))
+            with self.lock:
+                examples = index.similar(normalize_question(sentence), FEW_SHOT_EXAMPLES, FEW_SHOT_MIN_SIMILARITY)
+        except Exception as e:
+            logger.warning(f"Few-shot lookup failed: {str(e)}")
+            return []
+        if examples:
+            self.stats['prompts_with_examples'] += 1
+        return examples
+
+    def from_template(self, schema_dict, db_type, sentence):
+        """SQL for a question whose shape is known, with its values filled in, or None"""
+        if self.backend is None or FEW_SHOT_TEMPLATE_MIN_USES <= 0:
+            return None
+        template, values = question_template(sentence)
+        if not values:
+            return None
+        try:
+            index = self._index(self._scope(schema_dict, db_type))
+            with self.lock:
+                example = index.template_example(template)
+            if example is None:
+                return None
+            sql_query = fill_sql_template(example['sql'], example['values'], values, db_type)
+        except Exception as e:
+            logger.debug(f"Few-shot template not applicable: {str(e)}")
+            return None
+        self.stats['template_hits'] += 1
+        return sql_query
+
+    def add(self, schema_dict, db_type, sentence, sql_query):
+        if self.backend is None or not is_select_only(sql_query):
+            return
+        template, values = question_template(sentence)
+        shape = sql_template(sql_query, values, db_type) if values else None
+        example = {
+            'question': sentence,
+            'normalized': normalize_question(sentence),
+            'sql': sql_query,
+            'template': template if shape else None,
+            'sql_template': shape,
+            'values': values,
+            'created_at': datetime.utcnow()
+        }
+        try:
+            scope = self._scope(schema_dict, db_type)
+            index = self._index(scope)
+            with self.lock:
+                added = index.add(example)
+                if len(index.examples) > FEW_SHOT_MAX_EXAMPLES:
+                    self.indexes[scope] = (ExampleIndex(index.examples[-FEW_SHOT_MAX_EXAMPLES:]), self.indexes[scope][1])
+            if added:
+                self.backend.add(scope, example)
+                self.stats['stores'] += 1
+        except Exception as e:
+            logger.warning(f"Few-shot store failed: {str(e)}")
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['scopes'] = len(self.indexes)
+            stats['examples'] = sum(len(index.examples) for index, _ in self.indexes.values())
+        stats['backend'] = FEW_SHOT_BACKEND
+        return stats
+
+def create_few_shot_store():
+    if FEW_SHOT_BACKEND == 'mongodb':
+        return FewShotStore(MongoFewShotBackend('few_shot_examples'))
+    if FEW_SHOT_BACKEND == 'disk':
+        return FewShotStore(DiskFewShotBackend(FEW_SHOT_PATH))
+    return FewShotStore(None)
+
+few_shot_store = create_few_shot_store()
+
+# Query-result cache settings. Off by default: cached rows can be up to
+# RESULT_CACHE_TTL seconds stale when the data changes outside this app.
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "false").lower() == "true"
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+RESULT_CACHE_MAX_ENTRY_BYTES = int(os.getenv("RESULT_CACHE_MAX_ENTRY_BYTES", 4 * 1024 * 1024))
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", 60))
+RESULT_CACHE_COMPRESSION_LEVEL = int(os.getenv("RESULT_CACHE_COMPRESSION_LEVEL", 3))
+
+def normalize_sql(sql_query):
+    """Collapse whitespace and drop trailing semicolons; literals keep their case"""
+    return ' '.join(sql_query.split()).rstrip('; ')
+
+def extract_table_names(uri, sql_query):
+    """Lowercased, unqualified names of every table the statements read or
+    write, or None when the SQL does not parse in the connection's dialect"""
+    try:
+        expressions = parse_sql(sql_query, dialect_for_url(make_url(uri)).db_type)
+    except SqlglotError:
+        return None
+    return {table.name.lower() for expression in expressions for table in expression.find_all(exp.Table) if table.name}
+
+def encode_result_set(result_set):
+    """Store rows column by column; orjson handles dates natively and falls back
+    to str for Decimal and other driver types"""
+    columnar = {
+        'statement': result_set['statement'],
+        'columns': result_set['columns'],
+        'data': [list(column) for column in zip(*result_set['rows'])] if result_set['rows'] else [],
+        'row_count': len(result_set['rows']),
+        'truncated': result_set['truncated']
     }
+    return columnar
+
+def decode_result_set(columnar):
+    rows = [list(row) for row in zip(*columnar['data'])] if columnar['data'] else [[] for _ in range(columnar['row_count'])]
+    return {
+        'statement': columnar['statement'],
+        'columns': columnar['columns'],
+        'rows': rows,
+        'truncated': columnar['truncated']
+    }
+
+class ResultCache:
+    """Per-process LRU of SELECT results bounded by compressed size.
+
+    Keys are (connection fingerprint, normalized SQL). Each entry remembers the
+    tables it read, so writes made through this app drop the affected entries
+    straight away; writes made elsewhere are only picked up after the TTL.
+    """
+
+    def __init__(self, max_bytes, max_entry_bytes, ttl, compression_level):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl
+        self.compressor = zstandard.ZstdCompressor(level=compression_level)
+        self.decompressor = zstandard.ZstdDecompressor()
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.stats = Counter()
+        self.lock = threading.Lock()
+
+    def _key(self, uri, sql_query):
+        return hashlib.sha256(f"{engine_fingerprint(uri)}\x1f{normalize_sql(sql_query)}".encode('utf-8')).hexdigest()
+
+    def _drop(self, key):
+        entry = self.entries.pop(key)
+        self.total_bytes -= entry['size']
+
+    def get(self, uri, sql_query):
+        key = self._key(uri, sql_query)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and time.monotonic() > entry['expires_at']:
+                self._drop(key)
+                self.stats['expired'] += 1
+                entry = None
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            payload = entry['payload']
+        result_sets = [decode_result_set(columnar) for columnar in orjson.loads(self.decompressor.decompress(payload))]
+        last = result_sets[-1]
+        return {
+            'columns': last['columns'],
+            'rows': last['rows'],
+            'truncated': last['truncated'],
+            'last_select': last['statement'],
+            'result_sets': result_sets
+        }
+
+    def set(self, uri, sql_query, execution):
+        if not execution['result_sets']:
+            return
+        payload = self.compressor.compress(orjson.dumps(
+            [encode_result_set(result_set) for result_set in execution['result_sets']], default=str
+        ))
+        if len(payload) > self.max_entry_bytes:
+            with self.lock:
+                self.stats['oversized'] += 1
+            return
+        # Without its tables an entry could not be invalidated by writes
+        tables = extract_table_names(uri, sql_query)
+        if tables is None:
+            return
+        key = self._key(uri, sql_query)
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = {
+                'payload': payload,
+                'size': len(payload),
+                'fingerprint': engine_fingerprint(uri),
+                'tables': tables,
+                'expires_at': time.monotonic() + self.ttl
+            }
+            self.total_bytes += len(payload)
+            self.stats['stores'] += 1
+            while self.total_bytes > self.max_bytes:
+                self._drop(next(iter(self.entries)))
+                self.stats['evictions'] += 1
+
+    def invalidate(self, uri, tables=None):
+        """Drop the connection's entries that read any of tables (all of them when tables is None)"""
+        fingerprint = engine_fingerprint(uri)
+        with self.lock:
+            stale = [key for key, entry in self.entries.items()
+                     if entry['fingerprint'] == fingerprint and (tables is None or entry['tables'] & tables)]
+            for key in stale:
+                self._drop(key)
+            self.stats['invalidations'] += len(stale)
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self.entries)
+            stats['bytes'] = self.total_bytes
+        lookups = stats.get('hits', 0) + stats.get('misses', 0)
+        stats['hit_ratio'] = round(stats.get('hits', 0) / lookups, 3) if lookups else 0.0
+        stats['max_bytes'] = self.max_bytes
+        return stats
+
+result_cache = ResultCache(RESULT_CACHE_MAX_BYTES, RESULT_CACHE_MAX_ENTRY_BYTES, RESULT_CACHE_TTL, RESULT_CACHE_COMPRESSION_LEVEL) if RESULT_CACHE_ENABLED else None
+
+def execute_sql_cached(uri, sql_query):
+    """execute_sql behind the result cache.
 
+    Only plain SELECT batches are served from or stored in the cache; any
+    other statement runs as usual and then invalidates the cached results of
+    the tables it touched.
+    """
+    if result_cache is None:
+        return execute_sql(uri, sql_query)
+    read_only = is_select_only(sql_query)
+    if read_only:
+        cached = result_cache.get(uri, sql_query)
+        if cached is not None:
+            return cached
+    execution = execute_sql(uri, sql_query)
+    store_cached_results(uri, sql_query, execution, read_only)
+    return execution
+
+def is_select_only(sql_query):
+    """True when every statement only reads, including WITH queries"""
+    return all(is_read_statement(query) for query in split_statements(sql_query))
+
+def store_cached_results(uri, sql_query, execution, read_only):
+    """Cache a SELECT batch, or drop cached results of the tables a write touched"""
+    if result_cache is None:
+        return
+    if read_only:
+        result_cache.set(uri, sql_query, execution)
+    else:
+        result_cache.invalidate(uri, extract_table_names(uri, sql_query))
+
+# SQL parsing and validation settings. Generated SQL is parsed locally, so
+# malformed queries and unknown identifiers never reach the database.
+SQL_REPAIR_ENABLED = os.getenv("SQL_REPAIR_ENABLED", "true").lower() == "true"
+
+def sqlglot_dialect(db_type):
+    """sqlglot dialect name for a database type; None parses generic SQL"""
+    adapter = DIALECTS.get(db_type)
+    return adapter.sqlglot_dialect if adapter else None
+
+# Catalogs the LLM may query although they are not part of the introspected schema
+SYSTEM_SCHEMAS = {'information_schema', 'pg_catalog', 'sys', 'mysql', 'performance_schema'}
+SYSTEM_TABLE_PREFIXES = ('sqlite_', 'pg_')
+
+class SQLValidationError(ValueError):
+    """Generated SQL that does not parse or does not match the schema"""
+
+def parse_sql(sql_query, db_type=None):
+    return [expression for expression in sqlglot.parse(sql_query, read=sqlglot_dialect(db_type)) if expression is not None]
+
+def statement_kind(expression):
+    """'select', 'insert', 'update', 'delete' or 'other' for a parsed statement.
+
+    A data-modifying CTE makes the whole statement a write, so
+    WITH d AS (DELETE ... RETURNING *) SELECT ... counts as a delete.
+    """
+    if isinstance(expression, (exp.Insert, exp.Update, exp.Delete)):
+        return expression.key
+    if isinstance(expression, exp.Query):
+        write = expression.find(exp.Insert, exp.Update, exp.Delete)
+        return write.key if write else 'select'
+    return 'other'
+
+def sql_statement_kinds(sql_query, db_type=None):
+    try:
+        return [statement_kind(expression) for expression in parse_sql(sql_query, db_type)] or ['other']
+    except SqlglotError:
+        return ['other']
+
+def unescape_identifiers(sql_query, schema_dict):
+    """Undo the \\_ escapes some models put in identifiers, in one pass over the query"""
+    names = {col['name'] for columns in schema_dict.values() for col in columns}
+    names.update(schema_dict)
+
+    def unescape(match):
+        name = match.group(0).replace('\\_', '_')
+        return name if name in names else match.group(0)
+
+    return re.sub(r'\w*(?:\\_\w*)+', unescape, sql_query)
+
+def check_identifiers(expression, schema_dict, double_quoted_strings=False):
+    """Raise SQLValidationError for tables or columns that are not in the schema.
+
+    Names defined by the query itself (CTEs, table and column aliases) and
+    stars, qualified or not, are accepted; queries against system catalogs
+    skip the column check. With double_quoted_strings (SQLite) a
+    double-quoted name that is no column is read as the string it stands for
+    and rewritten into a string literal.
+    """
+    tables = {name.lower() for name in schema_dict}
+    columns = {col['name'].lower() for cols in schema_dict.values() for col in cols}
+    derived = {alias.alias.lower() for alias in expression.find_all(exp.Alias)}
+    for table_alias in expression.find_all(exp.TableAlias):
+        derived.add(table_alias.name.lower())
+        derived.update(column.name.lower() for column in table_alias.columns)
+
+    system_query = False
+    for table in expression.find_all(exp.Table):
+        name = table.name.lower()
+        if not name or name in tables or name in derived:
+            continue
+        if table.db.lower() in SYSTEM_SCHEMAS or name.startswith(SYSTEM_TABLE_PREFIXES):
+            system_query = True
+            continue
+        raise SQLValidationError(f"Unknown table '{table.name}'")
+    if system_query:
+        return
+
+    for column in list(expression.find_all(exp.Column)):
+        name = column.name.lower()
+        if column.is_star or not name or name in columns or name in derived:
+            continue
+        if double_quoted_strings and not column.table and column.this.quoted:
+            column.replace(exp.Literal.string(column.name))
+            continue
+        raise SQLValidationError(f"Unknown column '{column.sql()}'")
+
+def check_table_functions(expression):
+    """Raise SQLValidationError for table-valued functions in FROM. They read
+    files, URLs or other databases (read_csv_auto, glob, sqlite_scan, ...)
+    rather than the schema the user connected to."""
+    for table in expression.find_all(exp.Table):
+        if isinstance(table.this, exp.Func):
+            raise SQLValidationError(f"Table function '{table.this.sql()}' is not allowed; query the tables in the schema")
+
+def validate_sql(raw_sql, schema_dict, db_type):
+    """Parse generated SQL, check it against the schema and render it in the target dialect.
+
+    Returns the rewritten query or raises SQLValidationError with a message
+    that is shown to the user and fed back to the LLM for a repair.
+    """
+    sql_query = unescape_identifiers(raw_sql.strip(), schema_dict)
+    sql_query = re.sub(r'^```\w*\s*|\s*```$', '', sql_query)
+    if not sql_query:
+        raise SQLValidationError("Could not generate a valid SQL query from the input.")
+
+    try:
+        expressions = parse_sql(sql_query, db_type)
+    except SqlglotError as e:
+        # sqlglot underlines the offending token with terminal escape codes
+        message = re.sub(r'\x1b\[[0-9;]*m', '', str(e))
+        raise SQLValidationError(f"Generated SQL does not parse: {message}")
+    if not expressions or any(statement_kind(expression) == 'other' for expression in expressions):
+        raise SQLValidationError("Generated query is not a valid SELECT, INSERT, UPDATE, or DELETE statement.")
+
+    for expression in expressions:
+        check_table_functions(expression)
+        if schema_dict:
+            check_identifiers(expression, schema_dict, getattr(DIALECTS.get(db_type), 'double_quoted_strings', False))
+    return '; '.join(expression.sql(dialect=sqlglot_dialect(db_type)) for expression in expressions)
+
+def build_repair_prompt(prompt, sql_query, error):
+    return f"""{prompt}
+
+Your previous answer was:
+{sql_query}
+
+It was rejected before running because: {error}
+Output only the corrected SQL query."""
+
+# Prompt construction shared by the sync and async SQL generators (improved prompt)
+def build_sql_prompt(schema_dict, sentence, db_type, user_role):
     # Role-specific constraint
     role_constraint = "Generate only a SELECT query, as the user is restricted to read-only operations." if user_role == 'user' else "Generate a SELECT, INSERT, UPDATE, or DELETE query as appropriate."
 
+    # A streamed answer is cut at the first semicolon, so ask for one
+    terminator_rule = "End the query with a semicolon." if LLM_STREAMING_ENABLED else "Do not add semicolons unless required by the database."
+
+    # Send only the tables relevant to the question on wide databases
+    prompt_schema = prune_schema(schema_dict, sentence)
+    if prompt_schema is schema_dict:
+        schema_text = render_full_schema(schema_dict)[0]
+    else:
+        schema_text = render_schema(prompt_schema)
+        full_tokens = render_full_schema(schema_dict)[1]
+        pruned_tokens = estimate_tokens(schema_text)
+        logger.info(f"Schema pruning kept {len(prompt_schema)}/{len(schema_dict)} tables; "
+                    f"schema prompt ~{full_tokens} -> ~{pruned_tokens} tokens "
+                    f"(saved ~{full_tokens - pruned_tokens})")
+
+    # Past questions answered correctly against this schema
+    examples = few_shot_store.similar(schema_dict, db_type, sentence)
+    examples_text = ''.join(f"Question: {example['question']}\nSQL: {example['sql']}\n\n" for example in examples)
+    if examples_text:
+        examples_text = f"Examples of questions answered correctly on this database:\n\n{examples_text}"
+
     # Improved system prompt
     prompt = f"""You are an expert SQL assistant for {DB_CONFIGS[db_type]['name']}. Your task is to convert the following natural language question into a single, valid SQL query based on the provided database schema. Follow these strict guidelines:
 
 1. Use the exact table and column names from the schema without modification or unnecessary escaping.
-2. {db_specific_notes.get(db_type, '')}
+2. {get_dialect(db_type).prompt_notes}
 3. {role_constraint}
 4. Output only the SQL query itself, without explanations, comments, or markdown code blocks (e.g., ```sql).
 5. Ensure the query is syntactically correct and executable.
 6. Handle complex queries (e.g., joins, aggregates, subqueries) accurately, matching the intent of the question.
-7. Do not add semicolons unless required by the database.
+7. {terminator_rule}
 8. If the question is ambiguous or cannot be translated into a valid query, return an empty string.
 
-Schema: {schema_dict}
-Question: {sentence}
+Schema (one table per line, PK = primary key, FK->table.column = foreign key):
+{schema_text}
+
+{examples_text}Question: {sentence}
 
 Output a single SQL query or an empty string if the query cannot be generated."""
+    return prompt
+
+# Streaming generation settings. The completion is read as it is produced and
+# the request is closed as soon as a whole statement has arrived, so trailing
+# prose and code fences are neither waited for nor paid for.
+LLM_STREAMING_ENABLED = os.getenv("LLM_STREAMING_ENABLED", "false").lower() == "true"
+
+# Words that can open the line after a blank line inside a single statement,
+# e.g. the main SELECT after a CTE; anything else after a blank line is prose
+SQL_CONTINUATION_WORDS = {
+    'SELECT', 'FROM', 'WHERE', 'JOIN', 'INNER', 'LEFT', 'RIGHT', 'FULL', 'CROSS', 'OUTER', 'ON', 'USING',
+    'AND', 'OR', 'NOT', 'IN', 'EXISTS', 'GROUP', 'ORDER', 'HAVING', 'LIMIT', 'OFFSET', 'FETCH', 'WINDOW',
+    'UNION', 'INTERSECT', 'EXCEPT', 'WITH', 'AS', 'VALUES', 'SET', 'INTO', 'RETURNING', 'CASE', 'WHEN',
+    'THEN', 'ELSE', 'END', '(', ')', ',', '-', '/', '*'
+}
+
+class SQLStreamExtractor:
+    """Finds the first SQL statement in a completion while it streams in.
+
+    The statement starts after an optional opening code fence and ends at
+    a semicolon outside quotes and comments, a closing fence, or a blank
+    line that is outside parentheses and not followed by more SQL. Text is
+    scanned once; each feed only looks at the characters it added.
+    """
+
+    def __init__(self):
+        self.text = ''
+        self.start = None
+        self.end = None
+        self.position = 0
+        self.quote = None
+        self.comment = None
+        self.depth = 0
+
+    def feed(self, chunk):
+        """Add streamed text; returns True once a complete statement is available"""
+        self.text += chunk
+        if self.start is None:
+            stripped = self.text.lstrip()
+            # An opening fence is only recognizable once its line has ended
+            if not stripped or (stripped.startswith('`') and '\n' not in stripped):
+                return False
+            fence = re.match(r'\s*```[\w-]*[ \t]*\n', self.text)
+            self.start = self.position = fence.end() if fence else len(self.text) - len(stripped)
+        while self.end is None and self.position < len(self.text):
+            char = self.text[self.position]
+            # Fences, newlines and comment markers are ambiguous at the end of a chunk: wait for more
+            if char in '`\n-/*' and self.position + 3 > len(self.text):
+                break
+            if self.comment:
+                if self.text.startswith(self.comment, self.position):
+                    self.comment = None
+                    # The newline closing a line comment may also open a blank line
+                    if char == '\n':
+                        continue
+                    self.position += 1
+            elif self.quote:
+                if char == self.quote:
+                    self.quote = None
+            elif self.text.startswith('```', self.position) or char == ';':
+                self.end = self.position
+            elif self.text.startswith('\n\n', self.position) and not self.depth:
+                ends = self._blank_line_ends(self.position)
+                if ends is None:
+                    break
+                if ends:
+                    self.end = self.position
+            elif self.text.startswith('--', self.position):
+                self.comment = '\n'
+            elif self.text.startswith('/*', self.position):
+                self.comment = '*/'
+                self.position += 1
+            elif char in '\'"`':
+                self.quote = char
+            elif char == '(':
+                self.depth += 1
+            elif char == ')':
+                self.depth = max(self.depth - 1, 0)
+            self.position += 1
+        return self.end is not None
+
+    def _blank_line_ends(self, position, final=False):
+        """Whether the blank line at position ends the statement; None while the next word is still streaming"""
+        word, after = re.match(r'\s*([A-Za-z_]+|[^\w\s])?(.)?', self.text[position:], re.S).groups()
+        if after is None and not final:
+            return None
+        return word is None or word.upper() not in SQL_CONTINUATION_WORDS
+
+    def sql(self):
+        if self.start is None:
+            return self.text.strip()
+        end = self.end
+        # A stream that stopped right after a blank line is decided on what arrived
+        if end is None and self.text.startswith('\n\n', self.position) and not (self.quote or self.comment or self.depth):
+            if self._blank_line_ends(self.position, final=True):
+                end = self.position
+        body = self.text[self.start:end] if end is not None else self.text[self.start:]
+        return re.sub(r'\s*```\s*$', '', body).strip()
+
+def _streamed_response(messages, extractor, final_chunk):
+    """AIMessage for a stream that may have been cut short. Providers report
+    usage in the last chunk only, so a closed stream falls back to estimates
+    of what was actually generated."""
+    usage = getattr(final_chunk, 'usage_metadata', None) if final_chunk is not None else None
+    if not usage:
+        prompt_tokens = sum(estimate_tokens(message.content) for message in messages)
+        completion_tokens = estimate_tokens(extractor.text)
+        usage = {
+            'input_tokens': prompt_tokens,
+            'output_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens
+        }
+    return ai_message(extractor.sql(), usage)
+
+# Rate-limit backoff for LLM calls: a 429 is retried after the provider's
+# Retry-After when it sends one, else after a jittered exponential wait
+LLM_RATE_LIMIT_RETRIES = int(os.getenv("LLM_RATE_LIMIT_RETRIES", 4))
+LLM_RATE_LIMIT_MAX_WAIT = float(os.getenv("LLM_RATE_LIMIT_MAX_WAIT", 30))
+
+def is_rate_limit_error(error):
+    status = getattr(error, 'status_code', None) or getattr(getattr(error, 'response', None), 'status_code', None)
+    return status == 429 or type(error).__name__ == 'RateLimitError'
+
+_rate_limit_backoff = wait_random_exponential(multiplier=0.5, max=LLM_RATE_LIMIT_MAX_WAIT)
+
+def wait_for_rate_limit(retry_state):
+    headers = getattr(getattr(retry_state.outcome.exception(), 'response', None), 'headers', None) or {}
+    try:
+        return min(float(headers.get('retry-after')), LLM_RATE_LIMIT_MAX_WAIT)
+    except (TypeError, ValueError):
+        return _rate_limit_backoff(retry_state)
+
+def _log_rate_limit(retry_state):
+    logger.warning(f"LLM rate limited, retry {retry_state.attempt_number} of {LLM_RATE_LIMIT_RETRIES} "
+                   f"in {retry_state.next_action.sleep:.1f}s")
+
+def llm_retry_options():
+    return {
+        'retry': retry_if_exception(is_rate_limit_error),
+        'wait': wait_for_rate_limit,
+        'stop': stop_after_attempt(LLM_RATE_LIMIT_RETRIES + 1),
+        'before_sleep': _log_rate_limit,
+        'reraise': True
+    }
+
+def collect_sql(model, messages):
+    """One LLM answer reduced to its first SQL statement; rate-limited calls are retried"""
+    return Retrying(**llm_retry_options())(_collect_sql, model, messages)
+
+async def acollect_sql(model, messages):
+    """Async counterpart of collect_sql"""
+    return await AsyncRetrying(**llm_retry_options())(_acollect_sql, model, messages)
+
+def _collect_sql(model, messages):
+    """Streams with early stop when enabled"""
+    if not LLM_STREAMING_ENABLED:
+        # validate_sql strips fences from complete answers
+        return model.invoke(messages)
+    extractor = SQLStreamExtractor()
+    final_chunk = None
+    stream = model.stream(messages)
+    try:
+        for chunk in stream:
+            final_chunk = chunk
+            if extractor.feed(chunk.content):
+                final_chunk = None
+                break
+    finally:
+        # Closing the generator closes the HTTP response, which stops generation
+        stream.close()
+    return _streamed_response(messages, extractor, final_chunk)
+
+async def _acollect_sql(model, messages):
+    if not LLM_STREAMING_ENABLED:
+        # validate_sql strips fences from complete answers
+        return await model.ainvoke(messages)
+    extractor = SQLStreamExtractor()
+    final_chunk = None
+    stream = model.astream(messages)
+    try:
+        async for chunk in stream:
+            final_chunk = chunk
+            if extractor.feed(chunk.content):
+                final_chunk = None
+                break
+    finally:
+        await stream.aclose()
+    return _streamed_response(messages, extractor, final_chunk)
+
+# Hedged generation settings. "hedged" fires another request whenever no
+# valid SQL has arrived within LLM_HEDGE_DELAY_MS; "parallel" fires all
+# LLM_HEDGE_CANDIDATES at once. The first candidate that passes validation
+# wins and the requests still in flight are cancelled.
+LLM_HEDGE_MODE = os.getenv("LLM_HEDGE_MODE", "off").lower()  # off, hedged or parallel
+LLM_HEDGE_CANDIDATES = int(os.getenv("LLM_HEDGE_CANDIDATES", 2))
+LLM_HEDGE_DELAY_MS = float(os.getenv("LLM_HEDGE_DELAY_MS", 1500))
+# Optional comma-separated temperature per candidate, e.g. "0,0.3,0.7"; the last one repeats
+LLM_HEDGE_TEMPERATURES = [float(value) for value in os.getenv("LLM_HEDGE_TEMPERATURES", "").split(',') if value.strip()]
+
+def candidate_llm(index):
+    if not LLM_HEDGE_TEMPERATURES:
+        return get_llm()
+    return get_llm().bind(temperature=LLM_HEDGE_TEMPERATURES[min(index, len(LLM_HEDGE_TEMPERATURES) - 1)])
 
+async def race_sql_candidates(prompt, schema_dict, sentence, db_type, user_role):
+    """Run hedged LLM requests on the background loop; returns (sql_query, error).
+
+    A candidate that fails validation immediately triggers the next one
+    instead of waiting out the hedge delay. When every candidate fails, the
+    last validation error is returned (or the last exception raised).
+    """
+    count = max(1, LLM_HEDGE_CANDIDATES)
+    messages = human_messages(prompt)
+    pending = set()
+    launched = 0
+    result = (None, "Could not generate a valid SQL query from the input.")
+    failure = None
+
+    def launch():
+        nonlocal launched
+        task = asyncio.ensure_future(acollect_sql(candidate_llm(launched), messages))
+        task.candidate_index = launched
+        pending.add(task)
+        launched += 1
+
+    launch()
+    while LLM_HEDGE_MODE == 'parallel' and launched < count:
+        launch()
+    try:
+        while pending:
+            timeout = LLM_HEDGE_DELAY_MS / 1000 if launched < count else None
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                try:
+                    response = task.result()
+                except Exception as e:
+                    logger.warning(f"LLM candidate {task.candidate_index} failed: {str(e)}")
+                    failure = e
+                    continue
+                record_llm_usage(response, db_type, user_role)
+                sql_query, error = finalize_sql_query(response.content, schema_dict, sentence, db_type, user_role)
+                if error is None:
+                    logger.debug(f"LLM candidate {task.candidate_index} of {launched} won")
+                    metrics.observe('querywhisper_llm_winning_candidate', task.candidate_index,
+                                    mode=LLM_HEDGE_MODE, db_type=db_type, role=user_role)
+                    return sql_query, None
+                result = (sql_query, error)
+                failure = None
+            # Hedge after the delay, or right away when a candidate came back unusable
+            if launched < count:
+                launch()
+    finally:
+        for task in pending:
+            task.cancel()
+        metrics.observe('querywhisper_llm_candidates_launched', launched, mode=LLM_HEDGE_MODE, db_type=db_type, role=user_role)
+    if failure is not None:
+        raise failure
+    return result
+
+def finalize_sql_query(raw_sql, schema_dict, sentence, db_type, user_role):
+    """Validate the LLM output; returns (sql_query, error) with error None when usable"""
+    try:
+        sql_query = validate_sql(raw_sql, schema_dict, db_type)
+    except SQLValidationError as e:
+        logger.debug(f"Generated SQL failed validation ({str(e)}): {raw_sql}")
+        return raw_sql.strip(), str(e)
+    logger.debug(f"Generated SQL query: {sql_query}")
+    return sql_query, None
+
+def accept_sql_query(sql_query, error, schema_dict, sentence, db_type, user_role):
+    """Cache usable SQL; turn a validation failure into the "Error:" result callers expect"""
+    if error:
+        logger.error(f"Invalid SQL query: {error}: {sql_query}")
+        return f"Error: {error}"
+    sql_cache.set(schema_dict, db_type, user_role, sentence, sql_query)
+    return sql_query
+
+def templated_sql_query(schema_dict, sentence, db_type, user_role):
+    """Answer a known question shape from the few-shot store; the SQL is validated like an LLM answer"""
+    with timed_stage('template', db_type, user_role):
+        sql_query = few_shot_store.from_template(schema_dict, db_type, sentence)
+        if sql_query is None:
+            return None
+        sql_query, error = finalize_sql_query(sql_query, schema_dict, sentence, db_type, user_role)
+    if error:
+        logger.debug(f"Templated SQL rejected: {error}")
+        return None
+    logger.debug(f"Answered from a few-shot template: {sentence}")
+    return accept_sql_query(sql_query, None, schema_dict, sentence, db_type, user_role)
+
+# SQL query generation function (updated with Grok and improved prompt)
+def generate_sql_query(schema_dict, sentence, db_type, user_role):
+    # Validate API key configuration
+    if LLM_PROVIDER == 'groq' and not API_KEY:
+        logger.error("GROQ_API_KEY is not set")
+        return "Error: Missing Groq API key configuration"
+
+    # Repeated questions against an unchanged schema skip the LLM entirely
+    cached_sql = sql_cache.get(schema_dict, db_type, user_role, sentence) or templated_sql_query(schema_dict, sentence, db_type, user_role)
+    if cached_sql:
+        logger.debug(f"SQL cache hit for question: {sentence}")
+        return cached_sql
+
+    with timed_stage('prompt', db_type, user_role):
+        prompt = build_sql_prompt(schema_dict, sentence, db_type, user_role)
     try:
         logger.debug(f"Generating SQL query with prompt: {prompt}")
-        response = llm.invoke([HumanMessage(content=prompt)])
-        sql_query = response.content.strip()
-        logger.debug(f"Generated SQL query: {sql_query}")
-
-        if not sql_query:
-            return "Error: Could not generate a valid SQL query from the input."
-
-        # Validate query format
-        match = re.match(r'^\s*(SELECT|INSERT|UPDATE|DELETE)\b', sql_query, re.IGNORECASE)
-        if not match:
-            logger.error(f"Invalid SQL query format: {sql_query}")
-            return "Error: Generated query is not a valid SELECT, INSERT, UPDATE, or DELETE statement."
-
-        # Clean up column names (handle underscores)
-        correct_column_names = [col['name'] for table in schema_dict.values() for col in table]
-        for col in correct_column_names:
-            if '_' in col:
-                escaped_col = col.replace('_', '\\_')
-                sql_query = sql_query.replace(escaped_col, col)
+        if LLM_HEDGE_MODE in ('hedged', 'parallel'):
+            # asyncio tasks can be cancelled, so the race runs on the background loop
+            with timed_stage('llm', db_type, user_role):
+                sql_query, error = run_async(race_sql_candidates(prompt, schema_dict, sentence, db_type, user_role)).result()
+        else:
+            with timed_stage('llm', db_type, user_role):
+                response = collect_sql(get_llm(), human_messages(prompt))
+            record_llm_usage(response, db_type, user_role)
+            sql_query, error = finalize_sql_query(response.content, schema_dict, sentence, db_type, user_role)
 
-        return sql_query
+        # One repair round trip with the parse/validation error, never more
+        if error and SQL_REPAIR_ENABLED:
+            with timed_stage('repair', db_type, user_role):
+                response = collect_sql(get_llm(), human_messages(build_repair_prompt(prompt, sql_query, error)))
+            record_llm_usage(response, db_type, user_role)
+            sql_query, error = finalize_sql_query(response.content, schema_dict, sentence, db_type, user_role)
+        return accept_sql_query(sql_query, error, schema_dict, sentence, db_type, user_role)
+
+    except Exception as e:
+        logger.error(f"Error generating SQL query with Grok: {str(e)}")
+        return f"Error generating SQL query: {str(e)}"
+
+# Async counterpart of generate_sql_query, awaited on the background event loop
+async def generate_sql_query_async(schema_dict, sentence, db_type, user_role):
+    if LLM_PROVIDER == 'groq' and not API_KEY:
+        logger.error("GROQ_API_KEY is not set")
+        return "Error: Missing Groq API key configuration"
+
+    # The SQL cache and the few-shot store may be backed by MongoDB, whose
+    # driver blocks; keep those lookups off the shared event loop
+    loop = asyncio.get_running_loop()
+    cached_sql = (await loop.run_in_executor(None, sql_cache.get, schema_dict, db_type, user_role, sentence)
+                  or await loop.run_in_executor(None, templated_sql_query, schema_dict, sentence, db_type, user_role))
+    if cached_sql:
+        logger.debug(f"SQL cache hit for question: {sentence}")
+        return cached_sql
+
+    prompt = await loop.run_in_executor(None, build_sql_prompt, schema_dict, sentence, db_type, user_role)
+    try:
+        logger.debug(f"Generating SQL query with prompt: {prompt}")
+        started = time.perf_counter()
+        if LLM_HEDGE_MODE in ('hedged', 'parallel'):
+            sql_query, error = await race_sql_candidates(prompt, schema_dict, sentence, db_type, user_role)
+            record_stage('llm', time.perf_counter() - started, db_type, user_role)
+        else:
+            response = await acollect_sql(get_llm(), human_messages(prompt))
+            record_stage('llm', time.perf_counter() - started, db_type, user_role)
+            record_llm_usage(response, db_type, user_role)
+            sql_query, error = finalize_sql_query(response.content, schema_dict, sentence, db_type, user_role)
+
+        if error and SQL_REPAIR_ENABLED:
+            started = time.perf_counter()
+            response = await acollect_sql(get_llm(), human_messages(build_repair_prompt(prompt, sql_query, error)))
+            record_stage('repair', time.perf_counter() - started, db_type, user_role)
+            record_llm_usage(response, db_type, user_role)
+            sql_query, error = finalize_sql_query(response.content, schema_dict, sentence, db_type, user_role)
+        return await loop.run_in_executor(None, accept_sql_query, sql_query, error, schema_dict, sentence, db_type, user_role)
 
     except Exception as e:
         logger.error(f"Error generating SQL query with Grok: {str(e)}")
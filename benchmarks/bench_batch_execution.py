@@ -0,0 +1,59 @@
+"""Admin DML throughput: per-statement commits against batched execution.
+
+Generates a script of single-row INSERTs like the LLM produces for bulk
+requests and runs it through ``execute_sql`` in both EXECUTION_MODE
+settings on a file-backed SQLite database. Sequential mode commits after
+every statement (the default); batched mode merges the INSERTs
+into multi-row VALUES and commits once.
+
+    python benchmarks/bench_batch_execution.py --rows 100 1000 5000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+# app.py reads these at import time; the benchmark never talks to either service
+os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017/")
+os.environ.setdefault("MONGODB_DATABASE", "benchmark")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import app  # noqa: E402
+
+
+def build_script(row_count):
+    return "; ".join(
+        f"INSERT INTO orders (id, customer, amount) VALUES ({n}, 'customer_{n % 97}', {n * 1.5})"
+        for n in range(row_count)
+    )
+
+
+def run(uri, mode, script):
+    app.EXECUTION_MODE = mode
+    app.execute_sql(uri, "DELETE FROM orders")
+    started = time.perf_counter()
+    app.execute_sql(uri, script)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 1000, 5000])
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'sequential rows/s':>18} {'batched rows/s':>16} {'speedup':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        uri = f"sqlite:///{os.path.join(tmp, 'orders.db')}"
+        app.execute_sql(uri, "CREATE TABLE orders (id INTEGER PRIMARY KEY, customer TEXT, amount REAL)")
+        for row_count in args.rows:
+            script = build_script(row_count)
+            sequential = run(uri, "sequential", script)
+            batched = run(uri, "batched", script)
+            print(f"{row_count:>8} {row_count / sequential:>18.0f} {row_count / batched:>16.0f} "
+                  f"{sequential / batched:>8.1f}x")
+        app.dispose_engine(uri)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""End-to-end /submit_sentence benchmark with a stub LLM and seeded databases.
+
+Drives the Flask app through its test client: a user is registered in
+mongomock, connects through ``/getinput`` and asks distinct questions through
+``/submit_sentence``, so every request runs the full pipeline (user lookup,
+schema, prompt, LLM, validation, cost guard, execution and rendering). The LLM
+is the deterministic StubLLM with ``--llm-latency-ms`` of latency and canned
+SQL. For each fixture size and concurrency it reports throughput, request
+latency, the mean of every pipeline stage from the app's metrics and the
+process's peak RSS so far.
+
+SQLite fixtures are generated once per size under ``--fixture-dir``. With
+``--postgres-uri`` the same fixtures are seeded into that PostgreSQL database
+as well; its ``orders`` and ``table_*`` tables are dropped and recreated, so
+point it at a scratch database.
+
+Results are compared with ``baselines/e2e.json`` (p95 latency and throughput
+within ``--tolerance``); ``--record`` rewrites it. Requires mongomock.
+
+    python benchmarks/bench_e2e.py --tables 10 500 2000 --rows 1000 1000000 --concurrency 1 8
+"""
+import argparse
+import json
+import os
+import queue
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "e2e.json")
+sys.path.insert(0, ROOT)
+
+STUB_SQL = "SELECT customer, SUM(amount) AS total FROM orders GROUP BY customer ORDER BY total DESC LIMIT 10"
+STAGE_HISTOGRAM = "querywhisper_stage_duration_seconds"
+
+# Row generators that stay inside the database, so 10M rows seed in seconds
+SQLITE_ROWS = """
+    WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < {rows})
+    INSERT INTO orders (customer, amount) SELECT 'customer_' || (n % 97), n * 1.5 FROM seq
+"""
+POSTGRESQL_ROWS = """
+    INSERT INTO orders (customer, amount)
+    SELECT 'customer_' || (n % 97), n * 1.5 FROM generate_series(1, {rows}) AS n
+"""
+
+
+def fixture_ddl(table_count, columns_per_table=8):
+    """``orders`` plus filler tables chained by foreign keys, like a real schema"""
+    statements = ["CREATE TABLE orders (id INTEGER PRIMARY KEY, customer TEXT, amount REAL)"]
+    for index in range(1, table_count):
+        columns = ["id INTEGER PRIMARY KEY"]
+        columns += [f"col_{n} TEXT" for n in range(columns_per_table - 2)]
+        parent = "orders" if index == 1 else f"table_{index - 1}"
+        columns.append(f"parent_id INTEGER REFERENCES {parent}(id)")
+        statements.append(f"CREATE TABLE table_{index} ({', '.join(columns)})")
+    return statements
+
+
+def build_sqlite_fixture(fixture_dir, table_count, row_count):
+    import sqlite3
+
+    path = os.path.join(fixture_dir, f"e2e_{table_count}t_{row_count}r.db")
+    if os.path.exists(path):
+        return path
+    partial = f"{path}.partial"
+    if os.path.exists(partial):
+        os.remove(partial)
+    connection = sqlite3.connect(partial)
+    for statement in fixture_ddl(table_count):
+        connection.execute(statement)
+    connection.execute(SQLITE_ROWS.format(rows=row_count))
+    connection.commit()
+    connection.close()
+    os.replace(partial, path)
+    return path
+
+
+def seed_postgresql_fixture(uri, table_count, row_count):
+    from sqlalchemy import create_engine, text
+
+    engine = create_engine(uri)
+    with engine.begin() as connection:
+        existing = connection.execute(text(
+            "SELECT tablename FROM pg_tables WHERE schemaname = 'public' "
+            "AND (tablename = 'orders' OR tablename LIKE 'table\\_%')"
+        )).scalars().all()
+        for table in existing:
+            connection.execute(text(f'DROP TABLE IF EXISTS "{table}" CASCADE'))
+        for statement in fixture_ddl(table_count):
+            connection.execute(text(statement.replace("INTEGER PRIMARY KEY", "SERIAL PRIMARY KEY", 1)
+                                    if statement.startswith("CREATE TABLE orders") else statement))
+        connection.execute(text(POSTGRESQL_ROWS.format(rows=row_count)))
+    engine.dispose()
+
+
+def postgresql_form(uri):
+    from sqlalchemy.engine import make_url
+
+    url = make_url(uri)
+    return {
+        "db_type": "postgresql",
+        "server": url.host or "localhost",
+        "port": url.port or 5432,
+        "database": url.database,
+        "username": url.username or "",
+        "password": url.password or ""
+    }
+
+
+def stage_totals(app):
+    """(sum, count) per stage across all label combinations"""
+    totals = {}
+    for key, series in app.metrics.histograms[STAGE_HISTOGRAM]["series"].items():
+        stage_sum, stage_count = totals.get(key[0], (0.0, 0))
+        totals[key[0]] = (stage_sum + series["sum"], stage_count + series["count"])
+    return totals
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def percentile(ordered, fraction):
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def run_scenario(app, user_ids, form, questions, concurrency, label):
+    # One logged-in test client (cookie jar, connection handle) per concurrent
+    # user; a question borrows an idle client for the length of its request
+    clients = queue.Queue()
+    for user_id in user_ids[:concurrency]:
+        client = app.app.test_client()
+        with client.session_transaction() as session:
+            session["user_id"] = user_id
+        response = client.post("/getinput", data=form)
+        assert b"Successfully connected" in response.data, response.data[:500]
+        clients.put(client)
+
+    def ask(question):
+        client = clients.get()
+        try:
+            started = time.perf_counter()
+            response = client.post("/submit_sentence", data={"sentence": question})
+            elapsed = time.perf_counter() - started
+        finally:
+            clients.put(client)
+        assert response.status_code == 200 and b"customer_" in response.data, response.data[:500]
+        return elapsed
+
+    # Warm up the engine pool and the schema cache
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(ask, [f"{label} warm up {n}" for n in range(concurrency)]))
+
+    stages_before = stage_totals(app)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = sorted(pool.map(ask, questions))
+    wall = time.perf_counter() - started
+
+    stages = {}
+    for stage, (stage_sum, stage_count) in stage_totals(app).items():
+        before_sum, before_count = stages_before.get(stage, (0.0, 0))
+        if stage_count > before_count:
+            stages[stage] = round((stage_sum - before_sum) / (stage_count - before_count) * 1000, 2)
+    return {
+        "throughput_qps": round(len(questions) / wall, 2),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "max_ms": round(latencies[-1] * 1000, 1),
+        "stages_ms": stages,
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+
+def scenario_key(result):
+    return f"{result['db_type']}/{result['tables']}t/{result['rows']}r/c{result['concurrency']}"
+
+
+def compare_with_baseline(results, tolerance):
+    """Print regressions against the recorded baseline; True if there were any"""
+    with open(BASELINE_PATH) as baseline_file:
+        baseline = {scenario_key(result): result for result in json.load(baseline_file)["scenarios"]}
+    print(f"\nbaseline from commit {baseline and next(iter(baseline.values())).get('commit', '?')}")
+    regressed = False
+    for result in results:
+        previous = baseline.get(scenario_key(result))
+        if previous is None:
+            continue
+        p95_change = result["p95_ms"] / previous["p95_ms"] - 1
+        throughput_change = result["throughput_qps"] / previous["throughput_qps"] - 1
+        flag = ""
+        if p95_change > tolerance or throughput_change < -tolerance:
+            flag = "  REGRESSION"
+            regressed = True
+        print(f"{scenario_key(result):>28}  p95 {p95_change:+.0%}  throughput {throughput_change:+.0%}{flag}")
+    return regressed
+
+
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tables", type=int, nargs="+", default=[10, 500, 2000])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 100000])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--questions", type=int, default=40, help="questions per scenario")
+    parser.add_argument("--llm-latency-ms", type=float, default=100)
+    parser.add_argument("--fixture-dir", default=os.path.join(tempfile.gettempdir(), "querywhisper-bench"))
+    parser.add_argument("--postgres-uri", help="scratch PostgreSQL database to seed and benchmark as well")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95/throughput change")
+    parser.add_argument("--record", action="store_true", help="write the results as the new baseline")
+    args = parser.parse_args()
+
+    try:
+        import mongomock
+    except ImportError:
+        sys.exit("bench_e2e.py needs mongomock: pip install mongomock")
+
+    # Configure the app before importing it: stub LLM with a fixed latency, no
+    # SQL, result or few-shot cache so every question runs the whole pipeline,
+    # and mongomock in place of MongoDB
+    os.environ.update({
+        "LLM_PROVIDER": "stub",
+        "STUB_LLM_SQL": STUB_SQL,
+        "STUB_LLM_LATENCY_MS": str(args.llm_latency_ms),
+        "STUB_LLM_SEED": "42",
+        "SQL_CACHE_BACKEND": "none",
+        "RESULT_CACHE_ENABLED": "false",
+        "FEW_SHOT_BACKEND": "none"
+    })
+    os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017/")
+    os.environ.setdefault("MONGODB_DATABASE", "benchmark")
+    import logging
+    logging.disable(logging.INFO)
+    import pymongo
+    pymongo.MongoClient = mongomock.MongoClient
+    import app
+
+    password = app.bcrypt.generate_password_hash("benchmark").decode("utf-8")
+    user_ids = [str(app.get_users_collection().insert_one({
+        "name": f"Benchmark {n}", "email": f"bench{n}@example.com", "role": "user", "password": password
+    }).inserted_id) for n in range(max(args.concurrency))]
+
+    os.makedirs(args.fixture_dir, exist_ok=True)
+    commit = current_commit()
+    results = []
+    print(f"{'database':>28} {'q/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'RSS MB':>7}  mean stage ms")
+    for table_count in args.tables:
+        for row_count in args.rows:
+            path = build_sqlite_fixture(args.fixture_dir, table_count, row_count)
+            targets = [("sqlite", {"db_type": "sqlite", "database_path": path})]
+            if args.postgres_uri:
+                seed_postgresql_fixture(args.postgres_uri, table_count, row_count)
+                targets.append(("postgresql", postgresql_form(args.postgres_uri)))
+            for db_type, form in targets:
+                for concurrency in args.concurrency:
+                    label = f"{db_type}/{table_count}t/{row_count}r/c{concurrency}"
+                    questions = [f"top customers by revenue {label} #{n}" for n in range(args.questions)]
+                    result = {"db_type": db_type, "tables": table_count, "rows": row_count,
+                              "concurrency": concurrency, "commit": commit}
+                    result.update(run_scenario(app, user_ids, form, questions, concurrency, label))
+                    results.append(result)
+                    stages = " ".join(f"{stage}={ms:g}" for stage, ms in result["stages_ms"].items())
+                    print(f"{scenario_key(result):>28} {result['throughput_qps']:>7.1f} {result['p50_ms']:>8.0f} "
+                          f"{result['p95_ms']:>8.0f} {result['peak_rss_mb']:>7.0f}  {stages}")
+                # A fresh schema per fixture: drop this one's engine and cached schema
+                app.dispose_engine(f"sqlite:///{path}")
+
+    regressed = False
+    if args.record:
+        os.makedirs(os.path.dirname(BASELINE_PATH), exist_ok=True)
+        with open(BASELINE_PATH, "w") as baseline_file:
+            json.dump({"llm_latency_ms": args.llm_latency_ms, "questions": args.questions, "scenarios": results},
+                      baseline_file, indent=2)
+            baseline_file.write("\n")
+        print(f"\nbaseline written to {BASELINE_PATH}")
+    elif os.path.exists(BASELINE_PATH):
+        regressed = compare_with_baseline(results, args.tolerance)
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
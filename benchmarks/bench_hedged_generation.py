@@ -0,0 +1,79 @@
+"""Tail latency of SQL generation with and without hedged LLM requests.
+
+Runs ``generate_sql_query`` against the stub LLM with a lognormal latency
+distribution, a slow tail and a share of invalid answers, once per
+LLM_HEDGE_MODE. Every question is distinct and the SQL cache is off, so each
+one pays for the LLM.
+
+    python benchmarks/bench_hedged_generation.py --questions 200 --latency-ms 300 --tail-probability 0.05
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+SCHEMA = {
+    "orders": [
+        {"name": "id", "type": "INTEGER", "primary_key": True},
+        {"name": "customer", "type": "TEXT"},
+        {"name": "amount", "type": "REAL"}
+    ]
+}
+
+
+def percentile(ordered, fraction):
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=300, help="median stub LLM latency")
+    parser.add_argument("--jitter", type=float, default=0.3, help="lognormal sigma")
+    parser.add_argument("--tail-probability", type=float, default=0.05)
+    parser.add_argument("--tail-ms", type=float, default=3000)
+    parser.add_argument("--invalid-rate", type=float, default=0.05)
+    parser.add_argument("--candidates", type=int, default=2)
+    parser.add_argument("--hedge-delay-ms", type=float, default=600)
+    args = parser.parse_args()
+
+    os.environ.update({"LLM_PROVIDER": "stub", "SQL_CACHE_BACKEND": "none", "FEW_SHOT_BACKEND": "none", "SQL_REPAIR_ENABLED": "false"})
+    os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017/")
+    os.environ.setdefault("MONGODB_DATABASE", "benchmark")
+    import app
+
+    app.set_llm(app.StubLLM(
+        "SELECT customer, SUM(amount) FROM orders GROUP BY customer",
+        args.latency_ms,
+        distribution="lognormal",
+        jitter=args.jitter,
+        tail_probability=args.tail_probability,
+        tail_ms=args.tail_ms,
+        invalid_rate=args.invalid_rate,
+        seed=42
+    ))
+    app.LLM_HEDGE_CANDIDATES = args.candidates
+    app.LLM_HEDGE_DELAY_MS = args.hedge_delay_ms
+
+    print(f"{'mode':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'errors':>7} {'requests':>9}")
+    for mode in ("off", "hedged", "parallel"):
+        app.LLM_HEDGE_MODE = mode
+        latencies = []
+        errors = 0
+        for n in range(args.questions):
+            started = time.perf_counter()
+            sql_query = app.generate_sql_query(SCHEMA, f"total amount per customer #{n}", "sqlite", "user")
+            latencies.append(time.perf_counter() - started)
+            errors += sql_query.startswith("Error")
+        launched = app.metrics.histograms["querywhisper_llm_candidates_launched"]["series"]
+        requests = sum(series["sum"] for key, series in launched.items() if key[0] == mode) or args.questions
+        ordered = sorted(latencies)
+        print(f"{mode:>9} {statistics.median(ordered) * 1000:>8.0f} {percentile(ordered, 0.95) * 1000:>8.0f} "
+              f"{percentile(ordered, 0.99) * 1000:>8.0f} {ordered[-1] * 1000:>8.0f} {errors:>7} {requests:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Import time of app.py and the modules it pulls in at startup.
+
+Runs ``python -X importtime -c "import app"`` in fresh interpreters, reports
+the best cumulative time and the slowest top-level imports, and fails if a
+module that should only be loaded on first use (LLM client, DB drivers,
+pyarrow) is imported at startup. Results are compared with
+``baselines/import_time.json``; ``--record`` rewrites that file.
+
+    python benchmarks/bench_import_time.py --runs 5 --top 10
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "import_time.json")
+
+# Loaded on first use only; importing any of these at startup is a regression
+DEFERRED_MODULES = [
+    "langchain_groq", "langchain_core", "groq", "pyarrow", "numpy", "sqlalchemy.ext.asyncio",
+    "pymysql", "psycopg2", "pyodbc", "sqlite3"
+]
+
+CHECK_DEFERRED = (
+    "import sys, app; "
+    f"print(','.join(name for name in {DEFERRED_MODULES!r} if name in sys.modules))"
+)
+
+
+def app_env():
+    # app.py reads these at import time; nothing connects during the import
+    env = dict(os.environ)
+    env.setdefault("MONGODB_URI", "mongodb://localhost:27017/")
+    env.setdefault("MONGODB_DATABASE", "benchmark")
+    return env
+
+
+def measure_once():
+    """Cumulative microseconds per top-level import of app, plus app itself"""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=ROOT, env=app_env(), capture_output=True, text=True, check=True
+    )
+    timings = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        # app's direct imports are indented by exactly three spaces
+        if name.strip() == "app" or (name.startswith("   ") and not name.startswith("    ")):
+            timings[name.strip()] = int(cumulative)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown against the baseline")
+    parser.add_argument("--record", action="store_true", help="write the result as the new baseline")
+    args = parser.parse_args()
+
+    runs = [measure_once() for _ in range(args.runs)]
+    best = {name: min(run.get(name, 0) for run in runs) for name in runs[0]}
+    total_ms = best.pop("app") / 1000
+
+    print(f"import app: {total_ms:.0f} ms (best of {args.runs})")
+    print(f"{'module':>28} {'ms':>8}")
+    for name, micros in sorted(best.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"{name:>28} {micros / 1000:>8.1f}")
+
+    loaded = subprocess.run(
+        [sys.executable, "-c", CHECK_DEFERRED], cwd=ROOT, env=app_env(), capture_output=True, text=True, check=True
+    ).stdout.strip()
+    failed = False
+    if loaded:
+        print(f"FAIL: imported at startup: {loaded}")
+        failed = True
+
+    if args.record:
+        os.makedirs(os.path.dirname(BASELINE_PATH), exist_ok=True)
+        with open(BASELINE_PATH, "w") as baseline_file:
+            json.dump({"import_ms": round(total_ms, 1)}, baseline_file, indent=2)
+            baseline_file.write("\n")
+        print(f"baseline written to {BASELINE_PATH}")
+    elif os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as baseline_file:
+            baseline_ms = json.load(baseline_file)["import_ms"]
+        change = total_ms / baseline_ms - 1
+        print(f"baseline: {baseline_ms:.0f} ms ({change:+.0%})")
+        if change > args.tolerance:
+            print(f"FAIL: import time regressed by more than {args.tolerance:.0%}")
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
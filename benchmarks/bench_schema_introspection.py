@@ -0,0 +1,96 @@
+"""Schema introspection time against table count.
+
+Compares the set-based ``get_sqlite_schema`` with the previous one
+``PRAGMA table_info`` per table approach on generated SQLite databases.
+SQLite runs in-process, so the measured time has no network component; the
+projected columns add ``--rtt-ms`` per round trip to approximate a remote
+MySQL/PostgreSQL/SQL Server where each query pays network latency.
+
+    python benchmarks/bench_schema_introspection.py --tables 10 100 600 2000 --rtt-ms 1
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+# app.py reads these at import time; the benchmark never talks to either service
+os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017/")
+os.environ.setdefault("MONGODB_DATABASE", "benchmark")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app import get_sqlite_schema  # noqa: E402
+
+
+def build_database(path, table_count, columns_per_table=8):
+    connection = sqlite3.connect(path)
+    cursor = connection.cursor()
+    for index in range(table_count):
+        columns = ["id INTEGER PRIMARY KEY"]
+        columns += [f"col_{n} TEXT" for n in range(columns_per_table - 2)]
+        if index:
+            columns.append(f"parent_id INTEGER REFERENCES table_{index - 1}(id)")
+        cursor.execute(f"CREATE TABLE table_{index} ({', '.join(columns)})")
+        cursor.execute(f"CREATE INDEX idx_table_{index}_col_0 ON table_{index} (col_0)")
+    connection.commit()
+    connection.close()
+
+
+def per_table_schema(database_path):
+    """The previous N+1 implementation, kept here as the baseline"""
+    connection = sqlite3.connect(database_path)
+    cursor = connection.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    table_names = [row[0] for row in cursor.fetchall()]
+
+    schema_dict = {}
+    for table in table_names:
+        cursor.execute(f"PRAGMA table_info({table})")
+        schema_dict[table] = [{
+            "name": col[1],
+            "type": col[2],
+            "nullable": not col[3],
+            "default": col[4],
+            "primary_key": col[5]
+        } for col in cursor.fetchall()]
+
+    connection.close()
+    return schema_dict
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tables", type=int, nargs="+", default=[10, 100, 600, 2000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--rtt-ms", type=float, default=1.0, help="network round trip to project with")
+    args = parser.parse_args()
+
+    print(f"{'tables':>8} {'per-table ms':>14} {'set-based ms':>14} "
+          f"{'round trips':>13} {'projected ms':>20}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for table_count in args.tables:
+            path = os.path.join(tmp, f"schema_{table_count}.db")
+            build_database(path, table_count)
+            credentials = {"database_path": path}
+
+            baseline = best_of(lambda: per_table_schema(path), args.repeat)
+            bulk = best_of(lambda: get_sqlite_schema(credentials), args.repeat)
+            baseline_trips = table_count + 1
+            projected_baseline = baseline * 1000 + baseline_trips * args.rtt_ms
+            projected_bulk = bulk * 1000 + args.rtt_ms
+            print(f"{table_count:>8} {baseline * 1000:>14.2f} {bulk * 1000:>14.2f} "
+                  f"{baseline_trips:>8} vs 1 {projected_baseline:>9.1f} vs {projected_bulk:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Prompt tokens spent on the schema: Python repr versus ``render_schema``.
+
+Builds synthetic 10/100/1000-table schemas in the shape returned by the
+introspection functions and counts tokens with tiktoken's cl100k_base when it
+is installed, or a word/punctuation split otherwise.
+
+    python benchmarks/bench_schema_tokens.py --tables 10 100 1000
+"""
+import argparse
+import hashlib
+import os
+import random
+import re
+import sys
+
+os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017/")
+os.environ.setdefault("MONGODB_DATABASE", "benchmark")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app import render_schema  # noqa: E402
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+COLUMN_TYPES = ["integer", "character varying(255)", "numeric(12,2)", "timestamp without time zone", "boolean", "text"]
+
+
+def count_tokens(value):
+    if tiktoken:
+        return len(tiktoken.get_encoding("cl100k_base").encode(value))
+    return len(re.findall(r"\w+|[^\w\s]", value))
+
+
+def synthetic_schema(table_count, seed=0):
+    rng = random.Random(seed)
+    schema_dict = {}
+    for index in range(table_count):
+        columns = [{
+            "name": "id", "type": "integer", "nullable": False, "default": None,
+            "primary_key": True, "foreign_key": None, "indexed": True
+        }]
+        for n in range(rng.randint(4, 14)):
+            columns.append({
+                "name": f"attribute_{n}", "type": rng.choice(COLUMN_TYPES), "nullable": rng.random() < 0.5,
+                "default": None, "primary_key": False, "foreign_key": None, "indexed": False
+            })
+        if index:
+            columns.append({
+                "name": "parent_id", "type": "integer", "nullable": True, "default": None,
+                "primary_key": False, "foreign_key": f"table_{rng.randrange(index)}.id", "indexed": True
+            })
+        schema_dict[f"table_{index}"] = columns
+    return schema_dict
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tables", type=int, nargs="+", default=[10, 100, 1000])
+    args = parser.parse_args()
+
+    counter = "cl100k_base" if tiktoken else "regex approximation"
+    print(f"token counter: {counter}")
+    print(f"{'tables':>8} {'repr tokens':>12} {'compact tokens':>15} {'saved':>7} {'deterministic':>14}")
+    for table_count in args.tables:
+        schema_dict = synthetic_schema(table_count)
+        shuffled = dict(sorted(schema_dict.items(), key=lambda item: hash(item[0])))
+        repr_tokens = count_tokens(str(schema_dict))
+        compact = render_schema(schema_dict)
+        compact_tokens = count_tokens(compact)
+        same_bytes = (hashlib.sha256(compact.encode()).digest()
+                      == hashlib.sha256(render_schema(shuffled).encode()).digest())
+        print(f"{table_count:>8} {repr_tokens:>12} {compact_tokens:>15} "
+              f"{1 - compact_tokens / repr_tokens:>6.0%} {str(same_bytes):>14}")
+
+
+if __name__ == "__main__":
+    main()
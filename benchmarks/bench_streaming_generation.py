@@ -0,0 +1,72 @@
+"""Time to usable SQL and completion tokens with and without streaming.
+
+The stub LLM plays a streaming model: a time to first token, then one word
+every ``--token-latency-ms``. Its answer is a fenced SQL statement followed
+by an explanation, as chat models often produce. Without streaming the whole
+answer is awaited; with LLM_STREAMING_ENABLED the stream is closed at the end
+of the statement.
+
+    python benchmarks/bench_streaming_generation.py --questions 20 --first-token-ms 200 --token-latency-ms 15
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+SCHEMA = {
+    "orders": [
+        {"name": "id", "type": "INTEGER", "primary_key": True},
+        {"name": "customer", "type": "TEXT"},
+        {"name": "amount", "type": "REAL"}
+    ]
+}
+
+ANSWER = (
+    "```sql\n"
+    "SELECT customer, SUM(amount) AS total FROM orders GROUP BY customer ORDER BY total DESC LIMIT 10;\n"
+    "```\n"
+    "This query groups the orders by customer, adds up the amount of each order and sorts the customers "
+    "by that total in descending order, so the ten customers who spent the most are listed first. "
+    "If you also want customers without any orders, join the customers table with a LEFT JOIN instead."
+)
+
+
+def completion_tokens(app):
+    series = app.metrics.histograms["querywhisper_llm_completion_tokens"]["series"].values()
+    return sum(entry["sum"] for entry in series)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--questions", type=int, default=20)
+    parser.add_argument("--first-token-ms", type=float, default=200)
+    parser.add_argument("--token-latency-ms", type=float, default=15)
+    args = parser.parse_args()
+
+    os.environ.update({"LLM_PROVIDER": "stub", "SQL_CACHE_BACKEND": "none", "FEW_SHOT_BACKEND": "none"})
+    os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017/")
+    os.environ.setdefault("MONGODB_DATABASE", "benchmark")
+    import app
+
+    app.set_llm(app.StubLLM(ANSWER, args.first_token_ms, token_latency_ms=args.token_latency_ms))
+
+    print(f"{'mode':>10} {'p50 ms':>8} {'max ms':>8} {'completion tokens/question':>27}")
+    for streaming in (False, True):
+        app.LLM_STREAMING_ENABLED = streaming
+        tokens_before = completion_tokens(app)
+        latencies = []
+        for n in range(args.questions):
+            started = time.perf_counter()
+            sql_query = app.generate_sql_query(SCHEMA, f"top customers by spend #{n}", "sqlite", "user")
+            latencies.append(time.perf_counter() - started)
+            assert not sql_query.startswith("Error"), sql_query
+        tokens = (completion_tokens(app) - tokens_before) / args.questions
+        print(f"{'stream' if streaming else 'invoke':>10} {statistics.median(latencies) * 1000:>8.0f} "
+              f"{max(latencies) * 1000:>8.0f} {tokens:>27.0f}")
+
+
+if __name__ == "__main__":
+    main()
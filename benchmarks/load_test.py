@@ -0,0 +1,105 @@
+"""Concurrency of the sync and async query paths with a stub LLM and SQLite.
+
+The sync path mirrors a sync gunicorn worker pool: at most ``--sync-workers``
+questions are in flight, each blocking its worker through the LLM call and the
+query. The async path schedules every question on the worker's background
+event loop at once (``answer_question_async``), as ``/api/query`` does.
+
+    python benchmarks/load_test.py --questions 200 --llm-latency-ms 250 --sync-workers 2
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def build_database(path, rows):
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE orders (id INTEGER PRIMARY KEY, customer TEXT, amount REAL)")
+    connection.executemany(
+        "INSERT INTO orders (customer, amount) VALUES (?, ?)",
+        ((f"customer_{n % 97}", n * 1.5) for n in range(rows))
+    )
+    connection.commit()
+    connection.close()
+
+
+def summarize(label, latencies, wall):
+    """Latencies are measured from the moment all questions were submitted, so
+    time spent queued behind busy workers counts, as it would for a user"""
+    ordered = sorted(latencies)
+    p95 = ordered[max(int(len(ordered) * 0.95) - 1, 0)]
+    print(f"{label:>6}: {len(latencies)} questions in {wall:.2f}s "
+          f"({len(latencies) / wall:.1f} q/s), p50 {statistics.median(ordered) * 1000:.0f} ms, "
+          f"p95 {p95 * 1000:.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--llm-latency-ms", type=float, default=250)
+    parser.add_argument("--sync-workers", type=int, default=2, help="sync gunicorn workers to emulate")
+    parser.add_argument("--rows", type=int, default=10000)
+    args = parser.parse_args()
+
+    # Configure the app before importing it: stub LLM, no SQL cache or few-shot
+    # templates so every question pays the LLM latency, and services it never
+    # contacts
+    os.environ.update({
+        "LLM_PROVIDER": "stub",
+        "STUB_LLM_SQL": "SELECT customer, SUM(amount) FROM orders GROUP BY customer ORDER BY 2 DESC LIMIT 10",
+        "STUB_LLM_LATENCY_MS": str(args.llm_latency_ms),
+        "SQL_CACHE_BACKEND": "none",
+        "FEW_SHOT_BACKEND": "none"
+    })
+    os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017/")
+    os.environ.setdefault("MONGODB_DATABASE", "benchmark")
+    import logging
+    logging.disable(logging.INFO)
+    import app
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "load_test.db")
+        build_database(path, args.rows)
+        uri = f"sqlite:///{path}"
+        credentials = {"database_path": path}
+        questions = [f"top customers by revenue #{n}" for n in range(args.questions)]
+
+        submitted = {"at": time.perf_counter()}
+
+        def answer_sync(question):
+            schema_dict = app.get_cached_schema("sqlite", uri, credentials)
+            sql_query = app.generate_sql_query(schema_dict, question, "sqlite", "user")
+            app.execute_sql(uri, sql_query)
+            return time.perf_counter() - submitted["at"]
+
+        async def answer_async(question):
+            status, _ = await app.answer_question_async(question, "sqlite", uri, credentials, "user")
+            assert status == 200
+            return time.perf_counter() - submitted["at"]
+
+        async def answer_all():
+            return await app.asyncio.gather(*(answer_async(question) for question in questions))
+
+        # Warm the schema cache and both engines so neither path pays setup costs
+        answer_sync("warm up")
+        app.run_async(answer_async("warm up")).result()
+
+        submitted["at"] = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.sync_workers) as pool:
+            sync_latencies = list(pool.map(answer_sync, questions))
+        summarize("sync", sync_latencies, time.perf_counter() - submitted["at"])
+
+        submitted["at"] = time.perf_counter()
+        async_latencies = app.run_async(answer_all()).result()
+        summarize("async", async_latencies, time.perf_counter() - submitted["at"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+"""Optional database dialects, enabled through DIALECT_PLUGINS."""
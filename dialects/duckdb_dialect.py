@@ -0,0 +1,152 @@
+"""DuckDB dialect plugin for local analytics over DuckDB, Parquet and CSV files.
+
+Install ``duckdb`` and ``duckdb-engine``, then enable it with
+``DIALECT_PLUGINS=dialects.duckdb_dialect``. The database path is either a
+DuckDB database file or a directory: every ``*.parquet`` and ``*.csv`` file in
+a directory is exposed as a view named after the file, so questions can be
+asked about exports without loading them anywhere first.
+"""
+import glob
+import json
+import os
+
+from sqlalchemy import create_engine, event
+
+# Open database files read-only so every gunicorn worker can attach the same
+# file; DuckDB allows only one read-write process per file
+DUCKDB_READ_ONLY = os.getenv("DUCKDB_READ_ONLY", "true").lower() == "true"
+DUCKDB_THREADS = int(os.getenv("DUCKDB_THREADS", 0))  # per connection; 0 = one per core
+
+FILE_READERS = {
+    '.parquet': 'read_parquet',
+    '.csv': 'read_csv_auto'
+}
+
+SCHEMA_QUERY = """
+    SELECT c.table_name, c.column_name, c.data_type, c.is_nullable, c.column_default,
+           EXISTS (SELECT 1 FROM duckdb_constraints() k
+                   WHERE k.schema_name = c.schema_name AND k.table_name = c.table_name
+                     AND k.constraint_type = 'PRIMARY KEY'
+                     AND list_contains(k.constraint_column_names, c.column_name)),
+           (SELECT k.referenced_table || '.' || k.referenced_column_names[list_position(k.constraint_column_names, c.column_name)]
+              FROM duckdb_constraints() k
+             WHERE k.schema_name = c.schema_name AND k.table_name = c.table_name
+               AND k.constraint_type = 'FOREIGN KEY'
+               AND list_contains(k.constraint_column_names, c.column_name)
+             LIMIT 1),
+           EXISTS (SELECT 1 FROM duckdb_constraints() k
+                   WHERE k.schema_name = c.schema_name AND k.table_name = c.table_name
+                     AND k.constraint_type IN ('PRIMARY KEY', 'UNIQUE')
+                     AND list_contains(k.constraint_column_names, c.column_name))
+    FROM duckdb_columns() c
+    WHERE c.database_name = current_database() AND c.schema_name = current_schema() AND NOT c.internal
+    ORDER BY c.table_name, c.column_index
+"""
+
+# DuckDB keeps no DDL timestamp; the column list is small enough to hash
+SCHEMA_VERSION_PROBE = """
+    SELECT COUNT(*), md5(string_agg(table_name || '.' || column_name || ':' || data_type, ',' ORDER BY table_name, column_index))
+    FROM duckdb_columns()
+    WHERE database_name = current_database() AND schema_name = current_schema() AND NOT internal
+"""
+
+def _plan_nodes(node):
+    if isinstance(node, list):
+        for child in node:
+            yield from _plan_nodes(child)
+    elif isinstance(node, dict):
+        yield node
+        yield from _plan_nodes(node.get('children', []))
+
+def explain_duckdb(connection, query):
+    """Largest cardinality estimate in the plan (DuckDB reports 0 above operators
+    it cannot estimate, such as ORDER BY); table scans and file readers count
+    as full scans"""
+    plan = json.loads(connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {query}").fetchall()[0][1])
+    nodes = list(_plan_nodes(plan))
+    estimates = [float(node['extra_info']['Estimated Cardinality']) for node in nodes
+                 if 'Estimated Cardinality' in node.get('extra_info', {})]
+    full_scans = []
+    for node in nodes:
+        extra_info = node.get('extra_info', {})
+        if node['name'].strip() in ('SEQ_SCAN', 'TABLE_SCAN') and 'Table' in extra_info:
+            full_scans.append(extra_info['Table'].split('.')[-1])
+        elif node['name'].strip().startswith('READ_'):
+            full_scans.append(extra_info.get('Function', node['name'].strip()).lower())
+    return {'rows': max(estimates, default=0.0), 'cost': None, 'full_scans': full_scans}
+
+def _quote(value):
+    return "'" + value.replace("'", "''") + "'"
+
+def data_files(directory):
+    """(view name, reader, absolute path) for the Parquet and CSV files in a directory"""
+    files = []
+    for path in sorted(glob.glob(os.path.join(os.path.abspath(directory), '*'))):
+        name, extension = os.path.splitext(os.path.basename(path))
+        reader = FILE_READERS.get(extension.lower())
+        if reader:
+            files.append((name, reader, path))
+    return files
+
+def file_views(files):
+    """CREATE VIEW statements exposing each data file as a view named after it"""
+    return [
+        f"""CREATE OR REPLACE VIEW "{name.replace('"', '""')}" AS SELECT * FROM {reader}({_quote(path)})"""
+        for name, reader, path in files
+    ]
+
+def lockdown_statements(paths=()):
+    """Turn off file system access except for the given files, then freeze the
+    settings so a query cannot turn it back on. Without this any query could
+    read arbitrary server files with read_csv_auto() or glob()."""
+    statements = [f"SET allowed_paths = [{', '.join(_quote(path) for path in paths)}]"] if paths else []
+    return statements + ["SET enable_external_access = false", "SET lock_configuration = true"]
+
+def register_dialects(app):
+    class DuckDBDialect(app.FileDialectAdapter):
+        db_type = 'duckdb'
+        name = 'DuckDB'
+        icon = 'fas fa-feather'
+        backend = 'duckdb'
+        uri_scheme = 'duckdb'
+        sqlglot_dialect = 'duckdb'
+        path_hint = '/path/to/analytics.duckdb or a folder of Parquet/CSV files'
+        prompt_notes = "Use DuckDB syntax. Use simple, standard SQL and enclose identifiers in double quotes only if they contain special characters or are reserved keywords."
+        schema_query = SCHEMA_QUERY
+        schema_version_probe = SCHEMA_VERSION_PROBE
+        explain = staticmethod(explain_duckdb)
+
+        def engine_options(self, url):
+            options = super().engine_options(url)
+            config = {'threads': DUCKDB_THREADS} if DUCKDB_THREADS else {}
+            if os.path.isdir(url.database or ''):
+                # Each pooled connection is its own in-memory database holding the views
+                options.pop('max_overflow')
+                options.pop('pool_timeout')
+                options['connect_args'] = {'config': config}
+            else:
+                options['connect_args'] = {'read_only': DUCKDB_READ_ONLY, 'config': config}
+            return options
+
+        def create_engine(self, url):
+            if os.path.isdir(url.database or ''):
+                files = data_files(url.database)
+                statements = file_views(files) + lockdown_statements([path for _, _, path in files])
+                engine = create_engine(url.set(database=':memory:'), **self.engine_options(url))
+            else:
+                statements = lockdown_statements()
+                engine = super().create_engine(url)
+
+            @event.listens_for(engine, 'connect')
+            def prepare_connection(dbapi_connection, connection_record):
+                for statement in statements:
+                    dbapi_connection.execute(statement)
+            return engine
+
+        def cancel_target(self, connection):
+            return connection.connection.dbapi_connection
+
+        def cancel(self, uri, dbapi_connection):
+            dbapi_connection.interrupt()
+
+    app.register_dialect(DuckDBDialect())
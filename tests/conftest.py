@@ -0,0 +1,87 @@
+"""Shared fixtures. app.py is imported offline: the stub LLM answers every
+question, MongoDB is replaced by mongomock and the stores that would
+otherwise default to MongoDB are kept in memory."""
+import os
+import sqlite3
+
+import mongomock
+import pytest
+
+os.environ.update({
+    "MONGODB_URI": "mongodb://localhost:27017/",
+    "MONGODB_DATABASE": "querywhisper_test",
+    "SECRET_KEY": "test-secret-key",
+    "LLM_PROVIDER": "stub",
+    "SQL_CACHE_BACKEND": "none",
+    "RESULT_CACHE_ENABLED": "false",
+    "FEW_SHOT_BACKEND": "none",
+    "CONNECTION_STORE": "memory",
+    "DIALECT_PLUGINS": "dialects.duckdb_dialect",
+    "JOB_STORE": "memory"
+})
+
+import app as querywhisper  # noqa: E402
+
+querywhisper.MongoClient = mongomock.MongoClient
+
+
+def connect(client, sqlite_uri):
+    """Connect a logged-in test client to a SQLite database through the form"""
+    response = client.post("/getinput", data={"db_type": "sqlite", "database_path": sqlite_uri.removeprefix("sqlite:///")})
+    assert b"Successfully connected" in response.data
+    return client
+
+
+@pytest.fixture
+def sqlite_uri(tmp_path):
+    """A file-backed SQLite database with customers and orders"""
+    path = tmp_path / "shop.db"
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE customers (id INTEGER PRIMARY KEY, name TEXT, city TEXT);
+        CREATE TABLE orders (id INTEGER PRIMARY KEY, customer_id INTEGER REFERENCES customers(id),
+                             status TEXT, amount REAL);
+    """)
+    connection.executemany("INSERT INTO customers VALUES (?, ?, ?)",
+                           [(n, f"customer_{n}", "Paris" if n % 2 else "Berlin") for n in range(1, 51)])
+    connection.executemany("INSERT INTO orders VALUES (?, ?, ?, ?)",
+                           [(n, n % 50 + 1, "paid" if n % 3 else "open", n * 1.5) for n in range(1, 2501)])
+    connection.commit()
+    connection.close()
+    uri = f"sqlite:///{path}"
+    yield uri
+    querywhisper.dispose_engine(uri)
+
+
+@pytest.fixture
+def schema(sqlite_uri):
+    return querywhisper.get_dialect("sqlite").introspect(sqlite_uri)
+
+
+@pytest.fixture
+def login():
+    """Flask test client factory logged in as a new user with the given role"""
+    querywhisper.app.config["TESTING"] = True
+
+    def make_client(role="user"):
+        user_id = querywhisper.get_users_collection().insert_one(
+            {"name": role, "email": f"{role}-{os.urandom(4).hex()}@example.com", "role": role, "password": "x"}
+        ).inserted_id
+        client = querywhisper.app.test_client()
+        with client.session_transaction() as session:
+            session["user_id"] = str(user_id)
+        return client
+
+    return make_client
+
+
+@pytest.fixture
+def stub_llm():
+    """Answer every question with the given SQL; the default client is restored afterwards"""
+    def use(sql, latency_ms=0, **options):
+        model = querywhisper.StubLLM(sql, latency_ms, **options)
+        querywhisper.set_llm(model)
+        return model
+
+    yield use
+    querywhisper.set_llm(None)
@@ -0,0 +1,51 @@
+"""/submit_batch: one schema fetch, concurrent generation, per-question results"""
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from conftest import querywhisper
+
+TWO_READS = "SELECT COUNT(*) FROM orders; SELECT COUNT(*) FROM customers"
+
+
+@pytest.fixture
+def connected(login, sqlite_uri):
+    client = login()
+    client.post("/getinput", data={"db_type": "sqlite", "database_path": sqlite_uri.removeprefix("sqlite:///")})
+    return client
+
+
+def test_batch_reads_do_not_wait_on_the_statement_executor(connected, stub_llm, monkeypatch):
+    # Multi-statement reads fan out on the statement executor; a batch of
+    # them must not occupy its threads too
+    monkeypatch.setattr(querywhisper, "EXECUTION_MODE", "batched")
+    monkeypatch.setattr(querywhisper, "_statement_executor", ThreadPoolExecutor(max_workers=1))
+    monkeypatch.setattr(querywhisper, "_statement_executor_pid", querywhisper.os.getpid())
+    stub_llm(TWO_READS)
+    runner = ThreadPoolExecutor(max_workers=1)
+    try:
+        body = runner.submit(connected.post, "/submit_batch", json={"questions": ["a", "b", "c"]}).result(timeout=30).get_json()
+    finally:
+        runner.shutdown(wait=False)
+    assert body["succeeded"] == 3
+    assert [result["rows"] for result in body["results"]] == [[[50]]] * 3
+
+
+def test_one_failing_question_does_not_fail_the_batch(connected, stub_llm, monkeypatch):
+    stub_llm("SELECT name FROM customers WHERE id = 1")
+    apply_cost_guard = querywhisper.apply_cost_guard
+
+    def flaky_cost_guard(db_type, uri, sql_query, user_role=None, in_background=False):
+        if flaky_cost_guard.calls == 0:
+            flaky_cost_guard.calls += 1
+            raise RuntimeError("EXPLAIN exploded")
+        return apply_cost_guard(db_type, uri, sql_query, user_role, in_background)
+    flaky_cost_guard.calls = 0
+    monkeypatch.setattr(querywhisper, "apply_cost_guard", flaky_cost_guard)
+    monkeypatch.setattr(querywhisper, "BATCH_CONCURRENCY", 1)
+
+    response = connected.post("/submit_batch", json={"questions": ["first", "second"]})
+    assert response.status_code == 200
+    first, second = response.get_json()["results"]
+    assert first["status"] == "error" and "EXPLAIN exploded" in first["message"]
+    assert second["status"] == "success" and second["rows"] == [["customer_1"]]
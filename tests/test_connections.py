@@ -0,0 +1,83 @@
+"""Server-side connection handles and the engines behind them"""
+import pytest
+
+from conftest import connect, querywhisper
+
+
+def engine_registered(uri):
+    with querywhisper._engine_registry_lock:
+        return querywhisper.engine_fingerprint(uri) in querywhisper._engine_registry
+
+
+def test_engine_outlives_a_handle_that_shares_it(login, sqlite_uri, stub_llm):
+    first, second = connect(login(), sqlite_uri), connect(login(), sqlite_uri)
+    engine = querywhisper.get_engine(sqlite_uri)
+
+    first.post("/disconnect")
+    assert querywhisper.get_engine(sqlite_uri) is engine
+    stub_llm("SELECT COUNT(*) FROM customers")
+    assert second.post("/api/query", json={"sentence": "how many customers"}).get_json()["rows"] == [[50]]
+
+    second.post("/disconnect")
+    assert not engine_registered(sqlite_uri)
+
+
+def test_handles_are_private(login, sqlite_uri):
+    owner = connect(login(), sqlite_uri)
+    with owner.session_transaction() as session:
+        handle = session["connection"]
+    assert querywhisper.get_connection(handle, "someone-else") is None
+
+
+def test_last_query_stays_on_the_server(login, sqlite_uri, stub_llm, monkeypatch):
+    monkeypatch.setattr(querywhisper, "CONNECTION_STORE", "mongodb")
+    client = connect(login(), sqlite_uri)
+    stub_llm("SELECT name FROM customers ORDER BY id")
+    client.post("/submit_sentence", data={"sentence": "customer names"})
+    with client.session_transaction() as session:
+        assert "last_query" not in session
+        handle = session["connection"]
+    record = querywhisper.get_connection_collection().find_one({"_id": handle})
+    assert b"customers" not in record["last_query"]
+
+    # Another worker only has the stored copy
+    with querywhisper._connection_registry_lock:
+        querywhisper._connection_registry.pop(handle)
+    export = client.get("/export?format=jsonl").get_data(as_text=True).splitlines()
+    assert len(export) == 50 and export[0] == '{"name":"customer_1"}'
+
+
+def fresh_import(monkeypatch, **environment):
+    """Import a second copy of the app with the given settings"""
+    import importlib
+    import sys
+
+    for name, value in environment.items():
+        if value is None:
+            monkeypatch.delenv(name, raising=False)
+        else:
+            monkeypatch.setenv(name, value)
+    monkeypatch.setattr(sys, "modules", dict(sys.modules))
+    sys.modules.pop("app")
+    return importlib.import_module("app")
+
+
+def test_default_secret_key_keeps_credentials_out_of_mongodb(monkeypatch):
+    fresh = fresh_import(monkeypatch, SECRET_KEY=None, CONNECTION_STORE="mongodb")
+    assert fresh.app.secret_key == fresh.DEFAULT_SECRET_KEY
+    assert fresh.CONNECTION_STORE == "memory"
+
+
+@pytest.mark.parametrize("environment", [
+    {"SECRET_KEY": None, "CONNECTION_STORE": "mongodb", "JOB_STORE": "mongodb"},
+    {"CONNECTION_STORE": "memory", "JOB_STORE": "mongodb"},
+    {"CONNECTION_STORE": "mongodb", "JOB_STORE": "memory"},
+])
+def test_in_memory_stores_refuse_several_workers(monkeypatch, environment):
+    with pytest.raises(RuntimeError, match="WEB_CONCURRENCY=2"):
+        fresh_import(monkeypatch, WEB_CONCURRENCY="2", **environment)
+
+
+def test_shared_stores_allow_several_workers(monkeypatch):
+    fresh = fresh_import(monkeypatch, WEB_CONCURRENCY="2", CONNECTION_STORE="mongodb", JOB_STORE="mongodb")
+    assert fresh.CONNECTION_STORE == "mongodb" and fresh.WEB_CONCURRENCY == 2
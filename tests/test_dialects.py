@@ -0,0 +1,118 @@
+"""Dialect adapters and the DuckDB plugin"""
+import os
+import sqlite3
+
+import pytest
+from sqlalchemy.engine import make_url
+
+from conftest import querywhisper
+
+try:
+    import duckdb
+    import duckdb_engine  # noqa: F401
+except ImportError:
+    duckdb = None
+
+needs_duckdb = pytest.mark.skipif(duckdb is None, reason="duckdb and duckdb-engine are not installed")
+
+
+@pytest.fixture
+def duckdb_dir(tmp_path):
+    """A folder of CSV exports, connected through the DuckDB plugin"""
+    data = tmp_path / "exports"
+    data.mkdir()
+    (data / "orders.csv").write_text("id,status,amount\n1,paid,10.5\n2,open,3\n3,paid,7\n")
+    (tmp_path / "secret.csv").write_text("token\nhunter2\n")
+    uri = querywhisper.get_dialect("duckdb").connect({"database_path": str(data)})["uri"]
+    yield uri
+    querywhisper.dispose_engine(uri)
+
+
+def test_unknown_database_type_is_rejected():
+    with pytest.raises(ValueError, match="Unsupported database type: oracle"):
+        querywhisper.get_dialect("oracle")
+
+
+def test_urls_resolve_to_their_adapter():
+    assert querywhisper.dialect_for_url(make_url("mssql+pyodbc://u:p@h/d")).db_type == "sqlserver"
+    assert querywhisper.dialect_for_url(make_url("duckdb:///x.duckdb")).db_type == "duckdb"
+    assert querywhisper.dialect_for_url(make_url("oracle://u:p@h/d")) is querywhisper._generic_dialect
+
+
+def test_row_limits_use_the_dialect_syntax():
+    assert querywhisper.add_row_limit("sqlserver", "SELECT a FROM t", 5) == "SELECT TOP (5) a FROM t"
+    assert querywhisper.add_row_limit("sqlite", "SELECT a FROM t", 5) == "SELECT a FROM t LIMIT 5"
+
+
+@needs_duckdb
+def test_csv_files_are_exposed_as_views(duckdb_dir):
+    schema = querywhisper.get_dialect("duckdb").introspect(duckdb_dir)
+    assert [column["name"] for column in schema["orders"]] == ["id", "status", "amount"]
+    result = querywhisper.execute_sql(duckdb_dir, "SELECT SUM(amount) FROM orders WHERE status = 'paid'")
+    assert result["rows"] == [[17.5]]
+
+
+@needs_duckdb
+@pytest.mark.parametrize("query", [
+    "SELECT * FROM read_csv_auto('{secret}')",
+    "SELECT * FROM '{secret}'",
+    "SET enable_external_access = true",
+])
+def test_duckdb_cannot_reach_other_files(duckdb_dir, tmp_path, query):
+    with pytest.raises(Exception, match="Permission Error|Cannot change configuration|does not exist"):
+        querywhisper.execute_sql(duckdb_dir, query.format(secret=tmp_path / "secret.csv"))
+
+
+@needs_duckdb
+def test_duckdb_database_files_are_locked_down(tmp_path):
+    path = tmp_path / "analytics.duckdb"
+    connection = duckdb.connect(str(path))
+    connection.execute("CREATE TABLE t AS SELECT 1 AS a")
+    connection.close()
+    uri = querywhisper.get_dialect("duckdb").connect({"database_path": str(path)})["uri"]
+    try:
+        assert querywhisper.execute_sql(uri, "SELECT a FROM t")["rows"] == [[1]]
+        with pytest.raises(Exception, match="Permission Error"):
+            querywhisper.execute_sql(uri, "SELECT * FROM read_csv_auto('/etc/passwd')")
+    finally:
+        querywhisper.dispose_engine(uri)
+
+
+@pytest.mark.parametrize("function", ["read_csv_auto('/etc/passwd')", "glob('/etc/*')", "read_parquet('x.parquet') AS p"])
+def test_validator_rejects_table_functions(function, schema):
+    for schema_dict in (schema, {}):
+        with pytest.raises(querywhisper.SQLValidationError, match="Table function"):
+            querywhisper.validate_sql(f"SELECT * FROM {function}", schema_dict, "duckdb")
+
+
+def journal_mode(path):
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute("PRAGMA journal_mode").fetchone()[0]
+    finally:
+        connection.close()
+
+
+def test_sqlite_journal_mode_is_left_alone_by_default(sqlite_uri):
+    querywhisper.execute_sql(sqlite_uri, "SELECT COUNT(*) FROM orders")
+    path = make_url(sqlite_uri).database
+    assert journal_mode(path) == "delete"
+    assert not os.path.exists(path + "-wal")
+
+
+def test_sqlite_journal_mode_is_opt_in(sqlite_uri, monkeypatch):
+    monkeypatch.setattr(querywhisper, "SQLITE_JOURNAL_MODE", "wal")
+    querywhisper.execute_sql(sqlite_uri, "SELECT COUNT(*) FROM orders")
+    assert journal_mode(make_url(sqlite_uri).database) == "wal"
+
+
+def test_sqlite_journal_mode_skips_read_only_files(sqlite_uri, monkeypatch):
+    monkeypatch.setattr(querywhisper, "SQLITE_JOURNAL_MODE", "wal")
+    path = make_url(sqlite_uri).database
+    read_only = f"sqlite:///file:{path}?mode=ro&uri=true"
+    assert not querywhisper.sqlite_file_writable(make_url(read_only))
+    try:
+        assert querywhisper.execute_sql(read_only, "SELECT COUNT(*) FROM orders")["rows"] == [[2500]]
+    finally:
+        querywhisper.dispose_engine(read_only)
+    assert journal_mode(path) == "delete"
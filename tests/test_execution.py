@@ -0,0 +1,125 @@
+"""Multi-statement execution and INSERT merging"""
+import sqlite3
+
+import pytest
+from sqlalchemy.engine import make_url
+
+from conftest import querywhisper
+
+
+def inserts(count, table="orders"):
+    return [f"INSERT INTO {table} (id, status) VALUES ({n}, 'new')" for n in range(count)]
+
+
+def row_counts(statements):
+    return [len(querywhisper.split_values_rows(statement.split("VALUES", 1)[1])) for statement in statements]
+
+
+def test_merged_statements_count_row_tuples(monkeypatch):
+    monkeypatch.setattr(querywhisper, "BATCH_INSERT_MAX_ROWS", 3)
+    statements = ["INSERT INTO orders (id, status) VALUES (1, 'a'), (2, 'b')"] + inserts(5)
+    assert row_counts(querywhisper.merge_insert_statements(statements)) == [3, 3, 1]
+
+
+def test_one_statement_over_the_limit_is_split(monkeypatch):
+    monkeypatch.setattr(querywhisper, "BATCH_INSERT_MAX_ROWS", 1000)
+    values = ", ".join(f"({n}, 'x')" for n in range(2500))
+    merged = querywhisper.merge_insert_statements([f"INSERT INTO orders (id, status) VALUES {values}"])
+    assert row_counts(merged) == [1000, 1000, 500]
+
+
+def test_values_with_quotes_and_parentheses():
+    values = "(1, 'a, (b)'), (2, \"it's\"), (3, lower('X'))"
+    assert querywhisper.split_values_rows(values) == ["(1, 'a, (b)')", "(2, \"it's\")", "(3, lower('X'))"]
+
+
+@pytest.mark.parametrize("values", ["(1) RETURNING id", "(1), , (2)", "(1, 'open)", "(1))"])
+def test_unusual_values_are_not_split(values):
+    assert querywhisper.split_values_rows(values) is None
+
+
+def test_only_runs_of_the_same_table_merge():
+    statements = inserts(2) + ["UPDATE orders SET status = 'x' WHERE id = 1"] + inserts(2) + inserts(2, "customers")
+    merged = querywhisper.merge_insert_statements(statements)
+    assert [statement.split()[0] for statement in merged] == ["INSERT", "UPDATE", "INSERT", "INSERT"]
+    assert row_counts([merged[0], merged[2], merged[3]]) == [2, 2, 2]
+
+
+def test_batched_inserts_run_in_one_transaction(sqlite_uri, monkeypatch):
+    monkeypatch.setattr(querywhisper, "EXECUTION_MODE", "batched")
+    monkeypatch.setattr(querywhisper, "BATCH_INSERT_MAX_ROWS", 100)
+    statements = [f"INSERT INTO orders (id, customer_id, status, amount) VALUES ({n}, 1, 'new', 1.0)" for n in range(3000, 3250)]
+    querywhisper.execute_sql(sqlite_uri, "; ".join(statements))
+    connection = sqlite3.connect(make_url(sqlite_uri).database)
+    assert connection.execute("SELECT COUNT(*) FROM orders WHERE status = 'new'").fetchone() == (250,)
+    connection.close()
+
+    # A failing statement rolls the whole batch back
+    with pytest.raises(Exception):
+        querywhisper.execute_sql(sqlite_uri, "INSERT INTO orders (id, status) VALUES (9000, 'x'); "
+                                             "UPDATE orders SET status = 'y' WHERE id = 2; "
+                                             "INSERT INTO orders (id, status) VALUES (1, 'dup')")
+    connection = sqlite3.connect(make_url(sqlite_uri).database)
+    assert connection.execute("SELECT COUNT(*) FROM orders WHERE id = 9000").fetchone() == (0,)
+    connection.close()
+
+
+def test_independent_selects_run_separately(sqlite_uri, monkeypatch):
+    monkeypatch.setattr(querywhisper, "EXECUTION_MODE", "batched")
+    execution = querywhisper.execute_sql(sqlite_uri, "SELECT COUNT(*) FROM orders; SELECT COUNT(*) FROM customers")
+    assert [result_set["rows"] for result_set in execution["result_sets"]] == [[[2500]], [[50]]]
+    assert execution["last_select"] == "SELECT COUNT(*) FROM customers"
+
+
+def run_sync(uri, sql_query):
+    return querywhisper.execute_sql(uri, sql_query)
+
+
+def run_async(uri, sql_query):
+    return querywhisper.run_async(querywhisper.execute_sql_async(uri, sql_query)).result(timeout=30)
+
+
+def count_orders(uri, where):
+    connection = sqlite3.connect(make_url(uri).database)
+    count = connection.execute(f"SELECT COUNT(*) FROM orders WHERE {where}").fetchone()[0]
+    connection.close()
+    return count
+
+
+FAILING_BATCH = ("INSERT INTO orders (id, status) VALUES (9000, 'x'); "
+                 "INSERT INTO orders (id, status) VALUES (9001, 'x'); "
+                 "INSERT INTO orders (id, status) VALUES (1, 'dup')")
+
+
+def test_sequential_is_the_default():
+    assert querywhisper.EXECUTION_MODE == "sequential"
+
+
+@pytest.mark.parametrize("execute", [run_sync, run_async])
+def test_sequential_mode_commits_each_statement(sqlite_uri, monkeypatch, execute):
+    monkeypatch.setattr(querywhisper, "EXECUTION_MODE", "sequential")
+    with pytest.raises(Exception):
+        execute(sqlite_uri, FAILING_BATCH)
+    assert count_orders(sqlite_uri, "id IN (9000, 9001)") == 2
+
+
+@pytest.mark.parametrize("execute", [run_sync, run_async])
+def test_batched_mode_is_atomic_on_both_paths(sqlite_uri, monkeypatch, execute):
+    monkeypatch.setattr(querywhisper, "EXECUTION_MODE", "batched")
+    with pytest.raises(Exception):
+        execute(sqlite_uri, FAILING_BATCH)
+    assert count_orders(sqlite_uri, "id IN (9000, 9001)") == 0
+
+    execute(sqlite_uri, FAILING_BATCH.rsplit(";", 1)[0])
+    assert count_orders(sqlite_uri, "id IN (9000, 9001)") == 2
+
+
+@pytest.mark.parametrize("execute", [run_sync, run_async])
+def test_both_paths_return_the_same_result_sets(sqlite_uri, monkeypatch, execute):
+    monkeypatch.setattr(querywhisper, "EXECUTION_MODE", "batched")
+    execution = execute(sqlite_uri, "SELECT COUNT(*) FROM orders; SELECT COUNT(*) FROM customers")
+    assert [result_set["rows"] for result_set in execution["result_sets"]] == [[[2500]], [[50]]]
+    assert execution["last_select"] == "SELECT COUNT(*) FROM customers"
+
+    execution = execute(sqlite_uri, "UPDATE orders SET status = 'x' WHERE id = 1 RETURNING id")
+    assert execution["rows"] == [[1]] and execution["last_select"] is None
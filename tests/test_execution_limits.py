@@ -0,0 +1,83 @@
+"""Statement timeouts and the cost guard"""
+import time
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from conftest import querywhisper
+
+# About a second of work on SQLite
+SLOW_COUNT = ("WITH RECURSIVE c AS (SELECT 1 AS x UNION ALL SELECT x + 1 FROM c WHERE x < 3000000) "
+              "SELECT COUNT(*) FROM c")
+# The first row is ready at once; the second only after the same work, while fetching
+SLOW_SECOND_ROW = ("WITH RECURSIVE c AS (SELECT 1 AS x UNION ALL SELECT x + 1 FROM c WHERE x < 3000000) "
+                   "SELECT x FROM c WHERE x = 1 OR x = 3000000")
+
+
+@pytest.fixture
+def short_timeout(monkeypatch):
+    monkeypatch.setattr(querywhisper, "STATEMENT_TIMEOUT_MS", 100)
+
+
+def test_sqlite_timeout_interrupts_a_statement(sqlite_uri, short_timeout):
+    with pytest.raises(OperationalError, match="interrupted"):
+        querywhisper.execute_sql(sqlite_uri, SLOW_COUNT)
+
+
+def test_sqlite_timeout_covers_fetching(sqlite_uri, short_timeout):
+    with pytest.raises(OperationalError, match="interrupted"):
+        querywhisper.execute_sql(sqlite_uri, SLOW_SECOND_ROW)
+
+
+def test_jobs_get_their_own_timeout(sqlite_uri, short_timeout, monkeypatch):
+    monkeypatch.setattr(querywhisper, "JOB_STATEMENT_TIMEOUT_MS", 0)
+    job = querywhisper.submit_question_job("user", "count", "sqlite", sqlite_uri, {}, "user", sql_query=SLOW_COUNT)
+    deadline = time.monotonic() + 30
+    while job["status"] not in querywhisper.JOB_FINISHED_STATES and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert job["status"] == "succeeded", job["error"]
+    assert job["result"]["rows"] == [[3000000]]
+
+    # The pooled connection is back on the request timeout
+    with pytest.raises(OperationalError, match="interrupted"):
+        querywhisper.execute_sql(sqlite_uri, SLOW_COUNT)
+
+
+def test_statement_timeout_override_is_restored_at_checkin(sqlite_uri):
+    with querywhisper.engine_connect(sqlite_uri) as connection:
+        querywhisper.override_statement_timeout(connection, 0)
+        record_info = connection.info
+        assert record_info["statement_timeout_ms"] == 0
+    assert "statement_timeout_ms" not in record_info
+
+
+def test_cost_guard_is_opt_in(sqlite_uri):
+    assert querywhisper.apply_cost_guard("sqlite", sqlite_uri, "SELECT * FROM orders") == ("run", "SELECT * FROM orders", None)
+
+
+@pytest.fixture
+def cost_guard(monkeypatch):
+    monkeypatch.setattr(querywhisper, "COST_GUARD_ENABLED", True)
+    monkeypatch.setattr(querywhisper, "COST_GUARD_ACTION", "limit")
+    monkeypatch.setattr(querywhisper, "COST_GUARD_MAX_ROWS", 10)
+    monkeypatch.setattr(querywhisper, "COST_GUARD_LIMIT", 5)
+
+
+def connect(client, sqlite_uri):
+    client.post("/getinput", data={"db_type": "sqlite", "database_path": sqlite_uri.removeprefix("sqlite:///")})
+    return client
+
+
+def test_api_reports_an_added_limit(login, sqlite_uri, stub_llm, cost_guard):
+    stub_llm("SELECT id, amount FROM orders")
+    body = connect(login(), sqlite_uri).post("/api/query", json={"sentence": "all orders"}).get_json()
+    assert len(body["rows"]) == 5
+    assert "A limit of 5 rows was added because the planner estimates" in body["message"]
+
+
+def test_batch_reports_an_added_limit(login, sqlite_uri, stub_llm, cost_guard):
+    stub_llm("SELECT id, amount FROM orders")
+    response = connect(login(), sqlite_uri).post("/submit_batch", json={"questions": ["all orders"]})
+    result = response.get_json()["results"][0]
+    assert len(result["rows"]) == 5
+    assert result["message"].startswith("A limit of 5 rows was added")
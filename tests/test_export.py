@@ -0,0 +1,65 @@
+"""/export in every format, and Arrow types that hold across batches"""
+import csv
+import io
+from decimal import Decimal
+
+import orjson
+import pyarrow.ipc
+import pyarrow.parquet as pq
+
+from conftest import connect, querywhisper
+
+
+def exported(login, sqlite_uri, stub_llm, output_format):
+    client = connect(login(), sqlite_uri)
+    stub_llm("SELECT id, status, amount FROM orders ORDER BY id")
+    client.post("/submit_sentence", data={"sentence": "all orders"})
+    response = client.get(f"/export?format={output_format}")
+    assert response.status_code == 200
+    return response
+
+
+def test_csv_export_holds_every_row(login, sqlite_uri, stub_llm):
+    response = exported(login, sqlite_uri, stub_llm, "csv")
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert rows[0] == ["id", "status", "amount"] and len(rows) == 2501
+    assert response.headers["Content-Disposition"] == "attachment; filename=query_result.csv"
+
+
+def test_jsonl_export_holds_every_row(login, sqlite_uri, stub_llm):
+    lines = exported(login, sqlite_uri, stub_llm, "jsonl").get_data().splitlines()
+    assert len(lines) == 2500
+    assert orjson.loads(lines[-1]) == {"id": 2500, "status": "paid", "amount": 3750.0}
+
+
+def test_parquet_and_arrow_exports_hold_every_row(login, sqlite_uri, stub_llm):
+    parquet = pq.read_table(io.BytesIO(exported(login, sqlite_uri, stub_llm, "parquet").get_data()))
+    assert parquet.num_rows == 2500 and parquet.column_names == ["id", "status", "amount"]
+    arrow = pyarrow.ipc.open_stream(exported(login, sqlite_uri, stub_llm, "arrow").get_data()).read_all()
+    assert arrow.column("id").to_pylist() == list(range(1, 2501))
+
+
+def test_unknown_format_is_rejected(login, sqlite_uri, stub_llm):
+    client = connect(login(), sqlite_uri)
+    assert client.get("/export?format=xlsx").status_code == 404
+    stub_llm("SELECT id FROM orders")
+    client.post("/submit_sentence", data={"sentence": "ids"})
+    assert client.get("/export?format=xlsx").status_code == 400
+
+
+def decimal_export(columns, batches):
+    formatter = querywhisper.EXPORT_FORMATS["parquet"][0]
+    return pq.read_table(io.BytesIO(b"".join(formatter(columns, iter(batches)))))
+
+
+def test_decimals_widen_to_the_declared_scale():
+    columns = querywhisper.ResultColumns(["price"], [("price", None, None, None, 10, 2, True)])
+    table = decimal_export(columns, [[(Decimal("1.5"),)], [(Decimal("123.45"),)], [(Decimal("99999999.99"),)]])
+    assert str(table.schema.field("price").type) == "decimal128(38, 2)"
+    assert table.column("price").to_pylist() == [Decimal("1.50"), Decimal("123.45"), Decimal("99999999.99")]
+
+
+def test_decimals_without_a_declared_scale_are_exported_as_text():
+    columns = querywhisper.ResultColumns(["price"])
+    table = decimal_export(columns, [[(Decimal("1.5"),)], [(Decimal("123.456789"),)]])
+    assert table.column("price").to_pylist() == ["1.5", "123.456789"]
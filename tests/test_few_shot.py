@@ -0,0 +1,66 @@
+"""Few-shot example store: similar questions, templated answers and the async path"""
+import threading
+
+import pytest
+
+from conftest import querywhisper
+
+
+class RecordingBackend(querywhisper.DiskFewShotBackend):
+    """Disk backend that remembers which threads loaded it"""
+
+    def __init__(self, directory):
+        super().__init__(directory)
+        self.load_threads = []
+
+    def load(self, scope):
+        self.load_threads.append(threading.current_thread().name)
+        return super().load(scope)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = querywhisper.FewShotStore(RecordingBackend(str(tmp_path / "examples")))
+    monkeypatch.setattr(querywhisper, "few_shot_store", store)
+    return store
+
+
+def test_question_values_become_slots():
+    template, values = querywhisper.question_template("Orders over 100 placed since 2024-01-31 by 'Paris' customers")
+    assert values == ["100", "2024-01-31", "Paris"]
+    assert template.count(querywhisper.TEMPLATE_SLOT) == 3
+
+
+def test_similar_questions_are_found(store, schema):
+    store.add(schema, "sqlite", "How many customers live in Paris?", "SELECT COUNT(*) FROM customers WHERE city = 'Paris'")
+    store.add(schema, "sqlite", "Total amount of paid orders", "SELECT SUM(amount) FROM orders WHERE status = 'paid'")
+    examples = store.similar(schema, "sqlite", "how many customers live in Berlin")
+    assert examples[0]["question"] == "How many customers live in Paris?"
+
+
+def test_writes_are_never_stored(store, schema):
+    store.add(schema, "sqlite", "close order 5", "UPDATE orders SET status = 'closed' WHERE id = 5")
+    assert store.get_stats()["examples"] == 0
+
+
+def test_known_template_is_answered_with_new_values(store, schema, monkeypatch):
+    monkeypatch.setattr(querywhisper, "FEW_SHOT_TEMPLATE_MIN_USES", 2)
+    store.add(schema, "sqlite", "orders over 100", "SELECT id FROM orders WHERE amount > 100")
+    assert store.from_template(schema, "sqlite", "orders over 75") is None
+    store.add(schema, "sqlite", "orders over 250", "SELECT id FROM orders WHERE amount > 250")
+    assert store.from_template(schema, "sqlite", "orders over 75") == "SELECT id FROM orders WHERE amount > 75"
+
+
+def test_examples_survive_a_reload(store, schema, tmp_path):
+    store.add(schema, "sqlite", "orders over 100", "SELECT id FROM orders WHERE amount > 100")
+    reloaded = querywhisper.FewShotStore(querywhisper.DiskFewShotBackend(str(tmp_path / "examples")))
+    assert [example["sql"] for example in reloaded.similar(schema, "sqlite", "orders over 100")] == ["SELECT id FROM orders WHERE amount > 100"]
+
+
+def test_async_generation_keeps_store_lookups_off_the_event_loop(store, schema, stub_llm):
+    stub_llm("SELECT COUNT(*) FROM orders")
+    sql_query = querywhisper.run_async(
+        querywhisper.generate_sql_query_async(schema, "how many orders", "sqlite", "user")
+    ).result(timeout=30)
+    assert sql_query.startswith("SELECT COUNT(*)")
+    assert store.backend.load_threads and "async-query-loop" not in store.backend.load_threads
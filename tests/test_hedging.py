@@ -0,0 +1,66 @@
+"""Hedged candidate generation: first valid answer wins, the rest are cancelled"""
+import time
+
+import pytest
+
+from conftest import querywhisper
+
+SLOW = "SELECT name FROM customers"
+FAST = "SELECT city FROM customers"
+
+
+class Candidates:
+    """One stub model per candidate, picked through the temperature it is bound with"""
+
+    def __init__(self, *models):
+        self.models = models
+
+    def bind(self, temperature):
+        return self.models[int(temperature)]
+
+
+@pytest.fixture
+def hedge(monkeypatch, stub_llm):
+    monkeypatch.setattr(querywhisper, "SQL_REPAIR_ENABLED", False)
+    monkeypatch.setattr(querywhisper, "LLM_HEDGE_CANDIDATES", 2)
+    monkeypatch.setattr(querywhisper, "LLM_HEDGE_TEMPERATURES", [0.0, 1.0])
+
+    def use(mode, delay_ms, *models):
+        monkeypatch.setattr(querywhisper, "LLM_HEDGE_MODE", mode)
+        monkeypatch.setattr(querywhisper, "LLM_HEDGE_DELAY_MS", delay_ms)
+        querywhisper.set_llm(Candidates(*models))
+    return use
+
+
+def generate(schema):
+    started = time.perf_counter()
+    sql_query = querywhisper.generate_sql_query(schema, "customers", "sqlite", "user")
+    return sql_query, time.perf_counter() - started
+
+
+def test_hedge_fires_after_the_delay_and_the_faster_answer_wins(hedge, schema):
+    hedge("hedged", 50, querywhisper.StubLLM(SLOW, 2000), querywhisper.StubLLM(FAST, 0))
+    sql_query, elapsed = generate(schema)
+    assert sql_query == FAST and 0.05 <= elapsed < 1
+
+
+def test_no_hedge_when_the_first_answer_is_fast(hedge, schema):
+    hedge("hedged", 1000, querywhisper.StubLLM(SLOW, 0), querywhisper.StubLLM(FAST, 0))
+    assert generate(schema)[0] == SLOW
+
+
+def test_invalid_answer_hedges_without_waiting_for_the_delay(hedge, schema):
+    hedge("hedged", 5000, querywhisper.StubLLM(SLOW, 0, invalid_rate=1), querywhisper.StubLLM(FAST, 0))
+    sql_query, elapsed = generate(schema)
+    assert sql_query == FAST and elapsed < 1
+
+
+def test_parallel_mode_launches_every_candidate_at_once(hedge, schema):
+    hedge("parallel", 5000, querywhisper.StubLLM(SLOW, 2000), querywhisper.StubLLM(FAST, 50))
+    sql_query, elapsed = generate(schema)
+    assert sql_query == FAST and elapsed < 1
+
+
+def test_every_candidate_invalid_returns_the_validation_error(hedge, schema):
+    hedge("parallel", 0, *[querywhisper.StubLLM(SLOW, 0, invalid_rate=1)] * 2)
+    assert generate(schema)[0].startswith("Error: ")
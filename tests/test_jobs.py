@@ -0,0 +1,90 @@
+"""Background jobs, within one worker and across workers through the job store"""
+import time
+
+import pytest
+
+from conftest import querywhisper
+
+SLOW_QUERY = ("WITH RECURSIVE c AS (SELECT 1 AS x UNION ALL SELECT x + 1 FROM c WHERE x < 500000000) "
+              "SELECT COUNT(*) FROM c")
+
+
+@pytest.fixture
+def connected(login, sqlite_uri):
+    client = login()
+    response = client.post("/getinput", data={"db_type": "sqlite", "database_path": sqlite_uri.removeprefix("sqlite:///")})
+    assert b"Successfully connected" in response.data
+    return client
+
+
+@pytest.fixture
+def job_store(monkeypatch):
+    monkeypatch.setattr(querywhisper, "JOB_STORE", "mongodb")
+    monkeypatch.setattr(querywhisper, "JOB_POLL_INTERVAL", 0.05)
+
+
+def submit(client, stub_llm, sql):
+    stub_llm(sql)
+    response = client.post("/submit_sentence", data={"sentence": "question", "background": "1"})
+    assert response.status_code == 202
+    return response.get_json()["job_id"]
+
+
+def wait_for(client, job_id, condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        snapshot = client.get(f"/jobs/{job_id}").get_json()
+        if condition(snapshot):
+            return snapshot
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} stuck at {snapshot['status']}")
+
+
+def finished(snapshot):
+    return snapshot["status"] in querywhisper.JOB_FINISHED_STATES
+
+
+def forget_locally(job_id):
+    """Make the job look like it runs in another worker"""
+    with querywhisper._jobs_lock:
+        querywhisper._jobs.pop(job_id)
+
+
+def test_job_streams_rows_in_batches(connected, stub_llm):
+    job_id = submit(connected, stub_llm, "SELECT id FROM orders")
+    snapshot = wait_for(connected, job_id, finished)
+    assert snapshot["status"] == "succeeded"
+    assert len(snapshot["result"]["rows"]) == querywhisper.RESULT_ROW_CAP
+    assert [event["rows_streamed"] for event in snapshot["events"] if event["stage"] == "rows"] == [1000, 2000]
+
+
+def test_jobs_are_private(connected, login, stub_llm):
+    job_id = submit(connected, stub_llm, "SELECT name FROM customers")
+    other = login()
+    assert other.get(f"/jobs/{job_id}").status_code == 404
+    assert other.post(f"/jobs/{job_id}/cancel").status_code == 404
+
+
+def test_other_workers_read_jobs_from_the_store(connected, stub_llm, job_store):
+    job_id = submit(connected, stub_llm, "SELECT name, city FROM customers ORDER BY id")
+    local = wait_for(connected, job_id, finished)
+    forget_locally(job_id)
+
+    stored = connected.get(f"/jobs/{job_id}").get_json()
+    assert stored == local
+    events = connected.get(f"/jobs/{job_id}/events").get_data(as_text=True)
+    assert "event: execute" in events and "event: result" in events
+    assert connected.post(f"/jobs/{job_id}/cancel").get_json()["status"] == "succeeded"
+
+
+def test_cancel_from_another_worker_stops_the_statement(connected, stub_llm, job_store):
+    job_id = submit(connected, stub_llm, SLOW_QUERY)
+    wait_for(connected, job_id, lambda snapshot: snapshot["stage"] == "execute")
+    job = querywhisper._jobs[job_id]
+    forget_locally(job_id)
+    assert connected.post(f"/jobs/{job_id}/cancel").status_code == 200
+
+    # The running worker's watcher picks the flag up and interrupts SQLite
+    with querywhisper._jobs_lock:
+        querywhisper._jobs[job_id] = job
+    assert wait_for(connected, job_id, finished)["status"] == "cancelled"
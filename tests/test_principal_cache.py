@@ -0,0 +1,72 @@
+"""Principal cache: one lookup per TTL and cross-worker role invalidation"""
+import os
+
+import pytest
+from flask import session
+
+from conftest import querywhisper
+
+
+@pytest.fixture
+def principals(monkeypatch):
+    monkeypatch.setattr(querywhisper, "_principal_cache", {})
+    monkeypatch.setattr(querywhisper, "_principal_version", None)
+    monkeypatch.setattr(querywhisper, "_principal_version_checked_at", None)
+    monkeypatch.setattr(querywhisper, "PRINCIPAL_VERSION_CHECK_INTERVAL", 0)
+    users = querywhisper.get_users_collection()
+
+    def add_user(role):
+        email = f"{role}-{os.urandom(4).hex()}@example.com"
+        user_id = users.insert_one({"name": role, "email": email, "role": role, "password": "x"}).inserted_id
+        return str(user_id), email
+    return add_user
+
+
+def current_role(user_id):
+    with querywhisper.app.test_request_context():
+        session["user_id"] = user_id
+        return querywhisper.get_current_user()["role"]
+
+
+def count_lookups(monkeypatch):
+    calls = []
+    users = querywhisper.get_users_collection()
+
+    class Users:
+        def find_one(self, *args, **kwargs):
+            calls.append(args)
+            return users.find_one(*args, **kwargs)
+    monkeypatch.setattr(querywhisper, "get_users_collection", Users)
+    return calls
+
+
+def test_principal_is_cached_across_requests(principals, monkeypatch):
+    user_id, _ = principals("analyst")
+    calls = count_lookups(monkeypatch)
+    assert [current_role(user_id) for _ in range(3)] == ["analyst"] * 3
+    assert len(calls) == 1
+
+
+def test_role_change_in_another_worker_is_picked_up(principals, monkeypatch):
+    user_id, email = principals("admin")
+    assert current_role(user_id) == "admin"
+    # Another worker changes the role: this process's own cache entry is left alone
+    monkeypatch.setattr(querywhisper, "invalidate_user_principal", lambda user_id: None)
+    assert querywhisper.set_user_role(email, "user")
+    assert current_role(user_id) == "user"
+
+
+def test_version_stamp_is_read_at_most_once_per_interval(principals, monkeypatch):
+    user_id, email = principals("admin")
+    monkeypatch.setattr(querywhisper, "PRINCIPAL_VERSION_CHECK_INTERVAL", 3600)
+    assert current_role(user_id) == "admin"
+    monkeypatch.setattr(querywhisper, "invalidate_user_principal", lambda user_id: None)
+    querywhisper.set_user_role(email, "user")
+    assert current_role(user_id) == "admin"
+
+
+def test_email_index_is_unique(principals, monkeypatch):
+    monkeypatch.setattr(querywhisper, "_user_indexes_ready", False)
+    querywhisper.ensure_user_indexes()
+    indexes = querywhisper.get_users_collection().index_information()
+    assert any(index.get("unique") and index["key"] == [("email", 1)] for index in indexes.values())
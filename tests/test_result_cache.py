@@ -0,0 +1,89 @@
+"""Query-result cache: hits, TTL, byte budget and invalidation by table"""
+import pytest
+
+from conftest import connect, querywhisper
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = querywhisper.ResultCache(1024 * 1024, 256 * 1024, 60, 3)
+    monkeypatch.setattr(querywhisper, "result_cache", cache)
+    return cache
+
+
+JOIN = "SELECT o.id, c.name FROM orders o, customers c WHERE o.customer_id = c.id AND o.id < 5"
+
+
+def test_repeated_select_is_served_from_the_cache(cache, sqlite_uri):
+    first = querywhisper.execute_sql_cached(sqlite_uri, JOIN)
+    second = querywhisper.execute_sql_cached(sqlite_uri, "  " + JOIN + " ;")
+    assert second["rows"] == first["rows"] and len(second["rows"]) == 4
+    assert cache.get_stats()["hits"] == 1
+
+
+def test_every_table_of_a_comma_join_is_recorded(sqlite_uri):
+    assert querywhisper.extract_table_names(sqlite_uri, JOIN) == {"orders", "customers"}
+    assert querywhisper.extract_table_names(sqlite_uri, "SELECT * FROM main.Orders JOIN customers USING (id)") == {"orders", "customers"}
+
+
+def test_write_to_the_second_joined_table_invalidates(cache, sqlite_uri):
+    querywhisper.execute_sql_cached(sqlite_uri, JOIN)
+    querywhisper.execute_sql_cached(sqlite_uri, "UPDATE customers SET name = 'renamed' WHERE id = 2")
+    result = querywhisper.execute_sql_cached(sqlite_uri, JOIN)
+    assert cache.get_stats().get("hits", 0) == 0
+    assert ["renamed"] in [row[1:] for row in result["rows"]]
+
+
+def test_write_to_an_unrelated_table_keeps_the_entry(cache, sqlite_uri):
+    querywhisper.execute_sql_cached(sqlite_uri, "SELECT COUNT(*) FROM orders")
+    querywhisper.execute_sql_cached(sqlite_uri, "UPDATE customers SET city = 'Rome' WHERE id = 1")
+    querywhisper.execute_sql_cached(sqlite_uri, "SELECT COUNT(*) FROM orders")
+    assert cache.get_stats()["hits"] == 1
+
+
+def test_expired_entries_are_not_served(cache, sqlite_uri, monkeypatch):
+    monkeypatch.setattr(cache, "ttl", -1)
+    querywhisper.execute_sql_cached(sqlite_uri, JOIN)
+    querywhisper.execute_sql_cached(sqlite_uri, JOIN)
+    assert cache.get_stats()["expired"] == 1
+    assert cache.get_stats().get("hits", 0) == 0
+
+
+def test_byte_budget_evicts_least_recently_used(cache, sqlite_uri, monkeypatch):
+    queries = [f"SELECT * FROM orders WHERE id % 3 = {n}" for n in range(3)]
+    querywhisper.execute_sql_cached(sqlite_uri, queries[0])
+    querywhisper.execute_sql_cached(sqlite_uri, queries[1])
+    monkeypatch.setattr(cache, "max_bytes", cache.total_bytes * 5 // 4)
+    querywhisper.execute_sql_cached(sqlite_uri, queries[0])
+    querywhisper.execute_sql_cached(sqlite_uri, queries[2])
+    assert cache.get_stats()["evictions"] == 1
+    assert cache.total_bytes <= cache.max_bytes
+    querywhisper.execute_sql_cached(sqlite_uri, queries[0])
+    assert cache.get_stats()["hits"] == 2
+
+
+CTE = "WITH paid AS (SELECT customer_id, amount FROM orders WHERE status = 'paid') SELECT customer_id, SUM(amount) FROM paid GROUP BY customer_id"
+
+
+def test_cte_reads_are_cached_and_do_not_invalidate(cache, sqlite_uri):
+    querywhisper.execute_sql_cached(sqlite_uri, JOIN)
+    first = querywhisper.execute_sql_cached(sqlite_uri, CTE)
+    second = querywhisper.execute_sql_cached(sqlite_uri, CTE)
+    querywhisper.execute_sql_cached(sqlite_uri, JOIN)
+    assert cache.get_stats()["hits"] == 2 and cache.get_stats().get("invalidations", 0) == 0
+    assert first["last_select"] == second["last_select"] == CTE
+
+
+def test_data_modifying_cte_is_a_write():
+    assert querywhisper.is_select_only(CTE)
+    assert not querywhisper.is_select_only("WITH gone AS (DELETE FROM orders RETURNING id) SELECT COUNT(*) FROM gone")
+
+
+def test_cte_results_can_be_paged_and_exported(login, sqlite_uri, stub_llm):
+    client = connect(login(), sqlite_uri)
+    stub_llm(CTE)
+    client.post("/submit_sentence", data={"sentence": "paid amount per customer"})
+    assert client.get("/export?format=csv").status_code == 200
+    with client.session_transaction() as session:
+        handle = session["result_handle"]
+    assert len(client.get(f"/results/{handle}?offset=0&limit=10").get_json()["rows"]) == 10
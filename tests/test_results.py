@@ -0,0 +1,76 @@
+"""/results pagination over result handles"""
+import re
+
+import pytest
+from sqlalchemy import event
+
+from conftest import connect, querywhisper
+
+
+@pytest.fixture
+def asked(login, sqlite_uri, stub_llm):
+    """Ask one question and return the client, the rendered page and the result handle"""
+    def ask(sql_query):
+        client = connect(login(), sqlite_uri)
+        stub_llm(sql_query)
+        html = client.post("/submit_sentence", data={"sentence": "question"}).get_data(as_text=True)
+        with client.session_transaction() as session:
+            handle = session.get("result_handle")
+        return client, html, handle
+    return ask
+
+
+def pages(client, url, limit):
+    rows, offset = [], 0
+    while True:
+        page = client.get(f"{url}?offset={offset}&limit={limit}").get_json()
+        rows.extend(page["rows"])
+        offset += limit
+        if not page["has_more"]:
+            return rows, page
+
+
+def test_complete_result_is_paged_from_memory(asked):
+    client, _, handle = asked("SELECT id, name FROM customers ORDER BY id")
+    rows, last = pages(client, f"/results/{handle}", 20)
+    assert [row[0] for row in rows] == list(range(1, 51)) and last["total"] == 50
+
+
+def test_truncated_result_is_paged_from_one_snapshot(asked, sqlite_uri, monkeypatch):
+    monkeypatch.setattr(querywhisper, "RESULT_ROW_CAP", 100)
+    client, html, handle = asked("SELECT id FROM orders")
+    # The first run's rows are not shown next to the snapshot's
+    assert "const firstPage = [];" in html
+
+    statements = []
+    engine = querywhisper.get_engine(sqlite_uri)
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        rows, last = pages(client, f"/results/{handle}", 300)
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert sorted(row[0] for row in rows) == list(range(1, 2501))
+    assert last["total"] == 2500
+    assert statements.count("SELECT id FROM orders") == 1
+
+
+def test_snapshot_is_capped(asked, monkeypatch):
+    monkeypatch.setattr(querywhisper, "RESULT_ROW_CAP", 100)
+    monkeypatch.setattr(querywhisper, "RESULT_SNAPSHOT_MAX_ROWS", 1500)
+    client, _, handle = asked("SELECT id FROM orders")
+    rows, last = pages(client, f"/results/{handle}", 1000)
+    assert len(rows) == 1500 and not last["has_more"]
+
+
+def test_earlier_result_sets_are_loaded_from_results(asked):
+    client, html, _ = asked("SELECT name FROM customers WHERE id = 7; SELECT COUNT(*) FROM orders")
+    assert "customer_7" not in html
+    url = re.search(r'data-page-url="(/results/[^"]+)"', html).group(1)
+    assert client.get(f"{url}?offset=0&limit=10").get_json()["rows"] == [["customer_7"]]
+
+
+def test_handles_belong_to_their_user(asked, login, sqlite_uri):
+    _, _, handle = asked("SELECT id FROM customers")
+    stranger = connect(login(), sqlite_uri)
+    assert stranger.get(f"/results/{handle}").status_code == 404
@@ -0,0 +1,28 @@
+import app as querywhisper
+
+
+def test_protected_routes_redirect_to_login():
+    client = querywhisper.app.test_client()
+    response = client.post("/submit_sentence", data={"sentence": "all orders"})
+    assert response.status_code == 302
+    assert response.headers["Location"].endswith("/login")
+
+
+def test_connect_and_answer_a_question(login, sqlite_uri, stub_llm):
+    stub_llm("SELECT name, city FROM customers ORDER BY id")
+    client = login("user")
+    path = sqlite_uri.removeprefix("sqlite:///")
+
+    response = client.post("/getinput", data={"db_type": "sqlite", "database_path": path})
+    assert b"Successfully connected" in response.data
+
+    response = client.post("/api/query", json={"sentence": "list the customers"})
+    body = response.get_json()
+    assert response.status_code == 200, body
+    assert body["columns"] == ["name", "city"]
+    assert body["rows"][0] == ["customer_1", "Paris"]
+
+
+def test_unknown_database_type_is_reported(login):
+    response = login("user").post("/getinput", data={"db_type": "oracle"})
+    assert b"Unsupported database type: oracle" in response.data
@@ -0,0 +1,79 @@
+"""Schema cache: TTL, version probes and explicit refresh"""
+import sqlite3
+
+import pytest
+from sqlalchemy.engine import make_url
+
+from conftest import connect, querywhisper
+
+
+@pytest.fixture
+def introspections(monkeypatch):
+    """Count full introspections; the cache starts empty"""
+    calls = []
+    introspect = querywhisper.get_database_schema
+
+    def counted(db_type, uri):
+        calls.append(uri)
+        return introspect(db_type, uri)
+
+    monkeypatch.setattr(querywhisper, "get_database_schema", counted)
+    monkeypatch.setattr(querywhisper, "_schema_cache", querywhisper.OrderedDict())
+    return calls
+
+
+def cached_schema(sqlite_uri):
+    credentials = {"database_path": make_url(sqlite_uri).database}
+    return querywhisper.get_cached_schema("sqlite", sqlite_uri, credentials)
+
+
+def alter(sqlite_uri, statement):
+    connection = sqlite3.connect(make_url(sqlite_uri).database)
+    connection.execute(statement)
+    connection.commit()
+    connection.close()
+
+
+def test_warm_lookup_makes_no_round_trips(sqlite_uri, introspections, monkeypatch):
+    cached_schema(sqlite_uri)
+    monkeypatch.setattr(querywhisper, "probe_schema_version", lambda *args: pytest.fail("probed within the TTL"))
+    assert [column["name"] for column in cached_schema(sqlite_uri)["orders"]] == ["id", "customer_id", "status", "amount"]
+    assert len(introspections) == 1
+
+
+def test_unchanged_schema_is_kept_after_the_ttl(sqlite_uri, introspections, monkeypatch):
+    monkeypatch.setattr(querywhisper, "SCHEMA_CACHE_TTL", 0)
+    cached_schema(sqlite_uri)
+    cached_schema(sqlite_uri)
+    assert len(introspections) == 1
+
+
+def test_schema_change_is_picked_up_after_the_ttl(sqlite_uri, introspections, monkeypatch):
+    monkeypatch.setattr(querywhisper, "SCHEMA_CACHE_TTL", 0)
+    cached_schema(sqlite_uri)
+    alter(sqlite_uri, "ALTER TABLE orders RENAME COLUMN status TO state")
+    assert "state" in [column["name"] for column in cached_schema(sqlite_uri)["orders"]]
+    assert len(introspections) == 2
+
+
+def test_postgres_probe_covers_columns_and_constraints():
+    probe = querywhisper.get_dialect("postgresql").schema_version_probe
+    assert "pg_attribute" in probe and "pg_constraint" in probe
+
+
+def test_refresh_endpoint_reintrospects(login, sqlite_uri, introspections):
+    client = connect(login(), sqlite_uri)
+    before = len(introspections)
+    alter(sqlite_uri, "CREATE TABLE refunds (id INTEGER PRIMARY KEY)")
+    assert b"3 tables found" in client.post("/refresh_schema").data
+    assert len(introspections) == before + 1
+
+
+def test_cache_is_bounded(tmp_path, introspections, monkeypatch):
+    monkeypatch.setattr(querywhisper, "SCHEMA_CACHE_MAX_ENTRIES", 2)
+    for n in range(3):
+        path = tmp_path / f"db{n}.db"
+        sqlite3.connect(path).execute("CREATE TABLE t (id INTEGER)").connection.close()
+        querywhisper.get_cached_schema("sqlite", f"sqlite:///{path}", {"database_path": str(path)})
+        querywhisper.dispose_engine(f"sqlite:///{path}")
+    assert len(querywhisper._schema_cache) == 2
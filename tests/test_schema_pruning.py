@@ -0,0 +1,58 @@
+"""Schema relevance pruning: top-k tables, foreign-key neighbours and fallbacks"""
+import pytest
+
+from conftest import querywhisper
+
+
+def column(name, foreign_key=None):
+    return {"name": name, "type": "INTEGER", "foreign_key": foreign_key}
+
+
+@pytest.fixture
+def wide_schema():
+    schema = {f"filler_{n}": [column("id"), column(f"metric_{n}")] for n in range(30)}
+    schema["customers"] = [column("id"), column("name"), column("city")]
+    schema["orders"] = [column("id"), column("customer_id", "customers.id"), column("amount")]
+    schema["order_items"] = [column("id"), column("order_id", "orders.id"), column("sku")]
+    return schema
+
+
+@pytest.fixture
+def pruning(monkeypatch):
+    monkeypatch.setattr(querywhisper, "SCHEMA_PRUNING_ENABLED", True)
+    monkeypatch.setattr(querywhisper, "SCHEMA_PRUNE_MIN_TABLES", 20)
+    monkeypatch.setattr(querywhisper, "SCHEMA_TOP_K", 1)
+
+
+def test_keeps_the_best_table_and_the_table_it_references(pruning, wide_schema):
+    pruned = querywhisper.prune_schema(wide_schema, "total amount of orders last month")
+    assert set(pruned) == {"orders", "customers"}
+    assert pruned["orders"] == wide_schema["orders"]
+
+
+def test_keeps_tables_referencing_the_best_table(pruning, wide_schema):
+    pruned = querywhisper.prune_schema(wide_schema, "customers per city")
+    assert set(pruned) == {"customers", "orders"}
+
+
+def test_small_schema_is_sent_whole(pruning, wide_schema):
+    small = {table: wide_schema[table] for table in ("customers", "orders", "order_items")}
+    assert querywhisper.prune_schema(small, "orders") is small
+
+
+def test_low_confidence_falls_back_to_the_full_schema(pruning, wide_schema):
+    assert querywhisper.prune_schema(wide_schema, "how are things going") is wide_schema
+
+
+def test_disabled_pruning_sends_the_full_schema(pruning, wide_schema, monkeypatch):
+    monkeypatch.setattr(querywhisper, "SCHEMA_PRUNING_ENABLED", False)
+    assert querywhisper.prune_schema(wide_schema, "orders") is wide_schema
+
+
+def test_plural_and_camel_case_terms_match_table_names():
+    index = querywhisper.SchemaIndex({
+        "customer_accounts": [column("accountId"), column("openedAt")],
+        "invoices": [column("id"), column("total")],
+    })
+    assert [table for table, _ in index.score("when were the accounts opened")] == ["customer_accounts"]
+    assert [table for table, _ in index.score("invoice totals")] == ["invoices"]
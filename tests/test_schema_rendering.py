@@ -0,0 +1,34 @@
+"""Compact schema rendering: format, determinism and memoization"""
+from conftest import querywhisper
+
+
+def test_one_line_per_table_with_keys(schema):
+    lines = querywhisper.render_schema(schema).splitlines()
+    assert [line.split("(")[0] for line in lines] == ["customers", "orders"]
+    assert lines[1].startswith("orders(id INTEGER PK, customer_id INTEGER FK->customers.id")
+
+
+def test_same_schema_renders_to_the_same_bytes(schema):
+    reordered = {table: [dict(reversed(list(column.items()))) for column in columns]
+                 for table, columns in reversed(list(schema.items()))}
+    assert querywhisper.render_schema(reordered) == querywhisper.render_schema(schema)
+
+
+def test_column_order_is_kept():
+    text = querywhisper.render_schema({"t": [{"name": "b", "type": "text"}, {"name": "a", "type": None}]})
+    assert text == "t(b TEXT, a)"
+
+
+def test_rendering_is_smaller_than_the_repr(schema):
+    assert len(querywhisper.render_schema(schema)) * 2 < len(repr(schema))
+
+
+def test_full_schema_is_rendered_once_per_content(schema, monkeypatch):
+    calls = []
+    render = querywhisper.render_schema
+    monkeypatch.setattr(querywhisper, "render_schema", lambda schema_dict: calls.append(1) or render(schema_dict))
+    monkeypatch.setattr(querywhisper, "_rendered_schemas", querywhisper.OrderedDict())
+    first = querywhisper.render_full_schema(schema)
+    assert querywhisper.render_full_schema(dict(schema)) == first
+    assert first == (render(schema), querywhisper.estimate_tokens(render(schema)))
+    assert len(calls) == 1
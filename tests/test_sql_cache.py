@@ -0,0 +1,66 @@
+"""Generated-SQL cache: normalization, scoping, fuzzy matches, LRU and TTL"""
+import pytest
+
+from conftest import querywhisper
+
+SQL = "SELECT name FROM customers ORDER BY id LIMIT 10"
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = querywhisper.SQLCache(querywhisper.InMemorySQLCacheBackend(100, 60))
+    monkeypatch.setattr(querywhisper, "sql_cache", cache)
+    return cache
+
+
+def test_reworded_question_hits(cache, schema):
+    cache.set(schema, "sqlite", "user", "Show me the top 10 customers", SQL)
+    assert cache.get(schema, "sqlite", "user", "  top 10 CUSTOMERS?! ") == SQL
+    assert cache.get_stats()["hits"] == 1
+
+
+def test_entries_are_scoped_by_role_dialect_and_schema(cache, schema):
+    cache.set(schema, "sqlite", "user", "top 10 customers", SQL)
+    changed = dict(schema, customers=schema["customers"] + [{"name": "tier", "type": "TEXT"}])
+    assert cache.get(schema, "sqlite", "admin", "top 10 customers") is None
+    assert cache.get(schema, "postgresql", "user", "top 10 customers") is None
+    assert cache.get(changed, "sqlite", "user", "top 10 customers") is None
+    assert cache.get_stats()["misses"] == 3
+
+
+def test_fuzzy_matching_is_opt_in_and_respects_numbers(cache, schema):
+    cache.set(schema, "sqlite", "user", "top 10 customers by revenue", SQL)
+    assert cache.get(schema, "sqlite", "user", "top 10 customer by revenues") is None
+    cache.fuzzy_threshold = 0.6
+    assert cache.get(schema, "sqlite", "user", "top 10 customer by revenues") == SQL
+    assert cache.get(schema, "sqlite", "user", "top 20 customers by revenue") is None
+    assert cache.get_stats()["fuzzy_hits"] == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    backend = querywhisper.InMemorySQLCacheBackend(2, 60)
+    backend.set("a", "scope", "a", "SELECT 1")
+    backend.set("b", "scope", "b", "SELECT 2")
+    backend.get("a")
+    backend.set("c", "scope", "c", "SELECT 3")
+    assert list(backend.entries) == ["a", "c"]
+
+
+def test_expired_entries_are_not_served():
+    backend = querywhisper.InMemorySQLCacheBackend(2, -1)
+    backend.set("a", "scope", "a", "SELECT 1")
+    assert backend.get("a") is None and backend.candidates("scope") == []
+
+
+def test_mongodb_backend_round_trip(schema):
+    cache = querywhisper.SQLCache(querywhisper.MongoSQLCacheBackend("sql_cache_test", 60), 0.6)
+    cache.set(schema, "sqlite", "user", "top 10 customers by revenue", SQL)
+    assert cache.get(schema, "sqlite", "user", "Top 10 customers by revenue.") == SQL
+    assert cache.get(schema, "sqlite", "user", "top 10 customer by revenues") == SQL
+
+
+def test_second_question_skips_the_llm(cache, schema, stub_llm):
+    stub_llm(SQL)
+    assert querywhisper.generate_sql_query(schema, "top 10 customers", "sqlite", "user") == SQL
+    stub_llm("SELECT city FROM customers")
+    assert querywhisper.generate_sql_query(schema, "Top 10 customers", "sqlite", "user") == SQL
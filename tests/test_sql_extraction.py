@@ -0,0 +1,73 @@
+"""Extracting SQL from LLM answers, streamed and complete"""
+import pytest
+
+from conftest import querywhisper
+
+MULTI_STATEMENT = """```sql
+UPDATE orders SET status = 'open' WHERE id = 1;
+UPDATE orders SET status = 'paid' WHERE id = 2;
+```"""
+
+CTE_WITH_BLANK_LINE = """WITH paid AS (
+  SELECT customer_id, amount FROM orders WHERE status = 'paid'
+)
+
+SELECT customer_id, SUM(amount) AS total FROM paid GROUP BY customer_id
+
+This query totals paid orders per customer."""
+
+COMMENT_WITH_QUOTE = """SELECT name, city -- each customer's city
+FROM customers
+WHERE city = 'Paris'
+
+This lists the customers in Paris."""
+
+
+def extract(text, chunk_size):
+    extractor = querywhisper.SQLStreamExtractor()
+    for start in range(0, len(text), chunk_size):
+        if extractor.feed(text[start:start + chunk_size]):
+            break
+    return extractor.sql()
+
+
+def collect(text, monkeypatch, streaming):
+    monkeypatch.setattr(querywhisper, "LLM_STREAMING_ENABLED", streaming)
+    model = querywhisper.StubLLM(text)
+    return querywhisper._collect_sql(model, querywhisper.human_messages("question")).content
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 1000])
+def test_stream_stops_at_the_first_statement(chunk_size):
+    assert extract(MULTI_STATEMENT, chunk_size) == "UPDATE orders SET status = 'open' WHERE id = 1"
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 1000])
+def test_stream_keeps_a_cte_across_a_blank_line(chunk_size):
+    assert extract(CTE_WITH_BLANK_LINE, chunk_size) == CTE_WITH_BLANK_LINE.split("\n\nThis")[0]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 1000])
+def test_stream_ignores_quotes_in_comments(chunk_size):
+    assert extract(COMMENT_WITH_QUOTE, chunk_size) == COMMENT_WITH_QUOTE.split("\n\nThis")[0]
+
+
+def test_stream_cut_after_a_blank_line_drops_partial_prose():
+    assert extract("SELECT 1\n\nThe", 1000) == "SELECT 1"
+
+
+def test_complete_answers_are_not_cut(monkeypatch, schema):
+    answer = collect(MULTI_STATEMENT, monkeypatch, streaming=False)
+    assert answer == MULTI_STATEMENT
+    validated = querywhisper.validate_sql(answer, schema, "sqlite")
+    assert validated.count("UPDATE orders") == 2
+
+
+def test_complete_cte_with_blank_line_validates(monkeypatch, schema):
+    sql = CTE_WITH_BLANK_LINE.split("\n\nThis")[0]
+    answer = collect(sql, monkeypatch, streaming=False)
+    assert querywhisper.validate_sql(answer, schema, "sqlite").startswith("WITH paid AS")
+
+
+def test_streamed_answer_ends_at_the_prose(monkeypatch):
+    assert collect(COMMENT_WITH_QUOTE, monkeypatch, streaming=True).endswith("WHERE city = 'Paris'")
@@ -0,0 +1,35 @@
+"""Server-side cursor batches and the exports built on them"""
+import io
+
+import pyarrow.parquet as pq
+
+from conftest import querywhisper
+
+
+def test_batches_hold_stream_batch_size_rows(sqlite_uri):
+    batches = querywhisper.iter_result_batches(sqlite_uri, "SELECT id, amount FROM orders ORDER BY id")
+    assert next(batches) == ["id", "amount"]
+    assert [len(batch) for batch in batches] == [1000, 1000, 500]
+
+
+def test_batch_size_follows_the_setting(sqlite_uri, monkeypatch):
+    monkeypatch.setattr(querywhisper, "STREAM_BATCH_SIZE", 700)
+    batches = querywhisper.iter_result_batches(sqlite_uri, "SELECT id FROM orders")
+    next(batches)
+    assert [len(batch) for batch in batches] == [700, 700, 700, 400]
+
+
+def test_offset_and_limit_span_batches(sqlite_uri):
+    batches = querywhisper.iter_result_batches(sqlite_uri, "SELECT id FROM orders ORDER BY id", offset=950, limit=100)
+    next(batches)
+    ids = [row[0] for batch in batches for row in batch]
+    assert ids == list(range(951, 1051))
+
+
+def test_parquet_export_writes_one_row_group_per_batch(sqlite_uri):
+    formatter = querywhisper.EXPORT_FORMATS["parquet"][0]
+    batches = querywhisper.iter_result_batches(sqlite_uri, "SELECT id, status, amount FROM orders ORDER BY id")
+    data = b"".join(formatter(next(batches), batches))
+    parquet = pq.ParquetFile(io.BytesIO(data))
+    assert parquet.metadata.num_rows == 2500
+    assert parquet.metadata.num_row_groups == 3
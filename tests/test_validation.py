@@ -0,0 +1,61 @@
+"""SQL validation against the schema and statement classification"""
+import pytest
+
+from conftest import querywhisper
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM orders",
+    "SELECT o.* FROM orders o",
+    "SELECT o.*, c.name FROM orders o JOIN customers c ON c.id = o.customer_id",
+    "SELECT COUNT(*) AS n FROM orders ORDER BY n",
+    "SELECT city AS town, COUNT(*) FROM customers GROUP BY town",
+    "WITH totals AS (SELECT customer_id, SUM(amount) AS total FROM orders GROUP BY customer_id) "
+    "SELECT c.name, t.total FROM totals t JOIN customers c ON c.id = t.customer_id",
+    "SELECT x.s, x.n FROM (SELECT status AS s, COUNT(*) AS n FROM orders GROUP BY status) x",
+    "SELECT name FROM customers WHERE id IN (SELECT customer_id FROM orders WHERE amount > 100)",
+    "SELECT name FROM sqlite_master",
+])
+def test_valid_queries_pass(sql, schema):
+    querywhisper.validate_sql(sql, schema, "sqlite")
+
+
+@pytest.mark.parametrize("sql, message", [
+    ("SELECT nope FROM orders", "Unknown column 'nope'"),
+    ("SELECT o.nope FROM orders o", "Unknown column 'o.nope'"),
+    ("SELECT * FROM nope", "Unknown table 'nope'"),
+    ("SELECT id FROM orders WHERE", "does not parse"),
+])
+def test_invalid_queries_are_rejected(sql, message, schema):
+    with pytest.raises(querywhisper.SQLValidationError, match=message):
+        querywhisper.validate_sql(sql, schema, "sqlite")
+
+
+def test_sqlite_double_quoted_strings_become_literals(schema, sqlite_uri):
+    sql = querywhisper.validate_sql('SELECT id FROM orders WHERE status = "paid" AND "amount" > 3', schema, "sqlite")
+    assert sql == "SELECT id FROM orders WHERE status = 'paid' AND \"amount\" > 3"
+    assert len(querywhisper.execute_sql(sqlite_uri, sql)["rows"]) == 1000
+
+
+def test_double_quotes_are_identifiers_elsewhere(schema):
+    with pytest.raises(querywhisper.SQLValidationError, match="Unknown column"):
+        querywhisper.validate_sql('SELECT id FROM orders WHERE status = "paid"', schema, "postgresql")
+
+
+@pytest.mark.parametrize("sql, kinds", [
+    ("SELECT 1", ["select"]),
+    ("WITH t AS (SELECT 1 AS x) SELECT x FROM t", ["select"]),
+    ("UPDATE orders SET status = 'open'; SELECT 1", ["update", "select"]),
+    ("WITH d AS (DELETE FROM orders RETURNING id) SELECT COUNT(*) FROM d", ["delete"]),
+    ("INSERT INTO orders (id) SELECT id + 10000 FROM orders", ["insert"]),
+    ("DROP TABLE orders", ["other"]),
+])
+def test_statement_kinds(sql, kinds):
+    assert querywhisper.sql_statement_kinds(sql, "postgresql") == kinds
+
+
+def test_users_may_only_read():
+    status, body = querywhisper.check_generated_sql("WITH d AS (DELETE FROM orders RETURNING id) SELECT * FROM d", "user", "postgresql")
+    assert status == 403
+    assert querywhisper.check_generated_sql("SELECT * FROM orders", "user", "postgresql") is None
+    assert querywhisper.check_generated_sql("DELETE FROM orders", "admin", "postgresql") is None